@@ -4,12 +4,13 @@ Provides endpoints for upload, status checking, and result retrieval
 """
 import os
 import uuid
+import hashlib
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 from datetime import datetime
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Depends, Header
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Depends, Header, Query
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -19,12 +20,10 @@ from app.config import settings, init_directories, validate_config
 from app.models import ModelManager
 from app.pipeline import NutritionVideoPipeline
 from app.database import Database, JobStatus
+from app.timing import configure_logging
 
-# Initialize logging
-logging.basicConfig(
-    level=settings.LOG_LEVEL,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Initialize logging (LOG_FORMAT=json emits one JSON object per line, incl. stage timings)
+configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
@@ -54,6 +53,7 @@ class JobResponse(BaseModel):
     job_id: str
     status: str
     message: str
+    content_hash: Optional[str] = None
 
 
 class StatusResponse(BaseModel):
@@ -109,7 +109,12 @@ async def startup_event():
     
     # Initialize database
     logger.info("Initializing database...")
-    db = Database(settings.DATABASE_URL)
+    db = Database(
+        settings.DATABASE_URL,
+        pool_min_connections=settings.DB_POOL_MIN_CONNECTIONS,
+        pool_max_connections=settings.DB_POOL_MAX_CONNECTIONS,
+        sqlite_busy_timeout_ms=settings.SQLITE_BUSY_TIMEOUT_MS
+    )
     db.init_db()
     
     # Initialize models (lazy loading)
@@ -132,6 +137,8 @@ async def shutdown_event():
     logger.info("Shutting down...")
     if model_manager:
         model_manager.clear_cache()
+    if db:
+        db.close()
 
 
 @app.get("/")
@@ -150,11 +157,13 @@ async def health_check():
     """Detailed health check"""
     import torch
     
+    residency = model_manager.residency()
     return {
         "status": "healthy",
         "gpu_available": torch.cuda.is_available(),
         "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
-        "models_loaded": bool(model_manager._florence2 or model_manager._sam2),
+        "models_loaded": bool(residency["models"]),
+        "models": residency,  # Resident models, footprints, load times (MODEL_MEMORY_BUDGET_MB)
         "database": "connected" if db else "not initialized"
     }
 
@@ -183,25 +192,16 @@ async def upload_video(
             detail=f"Invalid file format. Allowed: {settings.ALLOWED_FORMATS}"
         )
     
-    # Validate file size
-    contents = await file.read()
-    file_size_mb = len(contents) / (1024 * 1024)
-    
-    if file_size_mb > settings.MAX_VIDEO_SIZE_MB:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large ({file_size_mb:.1f}MB). Max: {settings.MAX_VIDEO_SIZE_MB}MB"
-        )
-    
     # Generate job ID
     job_id = str(uuid.uuid4())
     
-    # Save uploaded file
+    # Stream upload to disk in chunks (size limit enforced incrementally, never buffers whole file)
     upload_path = settings.UPLOAD_DIR / f"{job_id}{file_ext}"
-    with open(upload_path, "wb") as f:
-        f.write(contents)
+    max_bytes = settings.MAX_VIDEO_SIZE_MB * 1024 * 1024
+    file_size, content_hash = await _stream_upload_to_disk(file, upload_path, max_bytes)
+    file_size_mb = file_size / (1024 * 1024)
     
-    logger.info(f"Saved video: {upload_path} ({file_size_mb:.1f}MB)")
+    logger.info(f"Saved video: {upload_path} ({file_size_mb:.1f}MB, hash={content_hash})")
     
     # Create job in database
     db.create_job(
@@ -219,10 +219,62 @@ async def upload_video(
     return JobResponse(
         job_id=job_id,
         status="processing",
-        message="Video uploaded successfully and queued for processing"
+        message="Video uploaded successfully and queued for processing",
+        content_hash=content_hash
     )
 
 
+async def _stream_upload_to_disk(
+    file: UploadFile,
+    dest_path: Path,
+    max_bytes: int
+) -> Tuple[int, Optional[str]]:
+    """
+    Copy an upload to disk chunk by chunk, enforcing the size limit as bytes arrive
+    
+    Writes to a ".part" file and renames it on success, so a rejected or
+    interrupted upload never leaves a truncated video behind.
+    
+    Args:
+        file: Incoming upload
+        dest_path: Final path for the saved file
+        max_bytes: Maximum accepted size in bytes
+        
+    Returns:
+        (size_in_bytes, hex digest from UPLOAD_HASH_ALGORITHM or None)
+    """
+    chunk_size = max(1, settings.UPLOAD_CHUNK_SIZE_KB) * 1024
+    hasher = hashlib.new(settings.UPLOAD_HASH_ALGORITHM) if settings.UPLOAD_HASH_ALGORITHM else None
+    part_path = dest_path.with_name(dest_path.name + ".part")
+    total = 0
+    
+    try:
+        with open(part_path, "wb") as f:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    # Stop copying and drop the partial file (Starlette has already spooled the whole body)
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large (>{settings.MAX_VIDEO_SIZE_MB}MB). Max: {settings.MAX_VIDEO_SIZE_MB}MB"
+                    )
+                if hasher is not None:
+                    hasher.update(chunk)
+                f.write(chunk)
+        part_path.replace(dest_path)
+    except BaseException:
+        if part_path.exists():
+            part_path.unlink()
+        raise
+    finally:
+        await file.close()
+    
+    return total, hasher.hexdigest() if hasher is not None else None
+
+
 async def process_video_background(job_id: str, video_path: Path):
     """
     Background task for video processing
@@ -405,19 +457,29 @@ async def delete_job(job_id: str, dependencies=[Depends(verify_api_key)]):
 
 
 @app.get("/api/jobs")
-async def list_jobs(status: Optional[str] = None, limit: int = 100):
+async def list_jobs(
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
     """
     List all jobs with optional filtering
     
     Args:
         status: Filter by status (pending, processing, completed, failed)
-        limit: Maximum number of jobs to return
+        limit: Maximum number of jobs to return (1-1000)
+        cursor: next_cursor from a previous page (keyset pagination)
         
     Returns:
-        List of jobs
+        List of jobs and the cursor for the next page (None when exhausted)
     """
-    jobs = db.list_jobs(status=status, limit=limit)
-    return {"jobs": jobs, "count": len(jobs)}
+    try:
+        jobs = db.list_jobs(status=status, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    next_cursor = Database.encode_cursor(jobs[-1]) if jobs and len(jobs) == limit else None
+    return {"jobs": jobs, "count": len(jobs), "next_cursor": next_cursor}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,210 @@
+"""
+Florence-2 inference session
+Encodes an image once with the DaViT vision tower and reuses the visual tokens for every
+task prompt run against that image (OD, caption, grounding, VQA), decoding with the KV cache.
+
+Batched entry points run one task prompt over several frames (run_florence2_batch) or several
+prompts over one frame (Florence2Session.run_many) as padded generate calls.
+"""
+import logging
+import torch
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def supports_shared_vision(model) -> bool:
+    """True if the remote-code model exposes the encoder / merge hooks used here"""
+    return all(
+        hasattr(model, attr)
+        for attr in ("_encode_image", "_merge_input_ids_with_image_features", "language_model")
+    )
+
+
+def _tokenize_prompts(processor, prompts: Sequence[str], device: str) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Expand task tokens the way the processor does and tokenize with right padding"""
+    text = processor._construct_prompts(list(prompts))
+    tokens = processor.tokenizer(text, return_tensors="pt", padding=True)
+    return tokens["input_ids"].to(device), tokens["attention_mask"].to(device)
+
+
+def _generate_from_features(model, image_features, input_ids, text_attention_mask=None, **generation_kwargs):
+    """Merge prompt embeddings with precomputed visual tokens and decode"""
+    inputs_embeds = model.get_input_embeddings()(input_ids)
+    inputs_embeds, attention_mask = model._merge_input_ids_with_image_features(image_features, inputs_embeds)
+    if text_attention_mask is not None:
+        # Mask out padding of the shorter prompts in a batch (visual tokens come first)
+        attention_mask[:, -text_attention_mask.shape[1]:] = text_attention_mask.to(attention_mask.dtype)
+    return model.language_model.generate(
+        input_ids=None,
+        inputs_embeds=inputs_embeds,
+        attention_mask=attention_mask,
+        **generation_kwargs
+    )
+
+
+def _prompt(task_prompt: str, text_input: Optional[str]) -> str:
+    return task_prompt if text_input is None else task_prompt + text_input
+
+
+def run_florence2_batch(
+    processor,
+    model,
+    images: Sequence,
+    task_prompt: str,
+    text_inputs: Optional[Sequence[Optional[str]]] = None,
+    device: str = "cpu",
+    batch_size: int = 4,
+    **generation_kwargs
+) -> List[Dict]:
+    """
+    Run one Florence-2 task over several images in padded generate calls
+
+    Args:
+        processor: Florence-2 AutoProcessor
+        model: Florence-2 model
+        images: PIL images
+        task_prompt: Task token, e.g. "<OD>"
+        text_inputs: Optional per-image text (e.g. caption for grounding)
+        device: Torch device
+        batch_size: Images per generate call
+        **generation_kwargs: Passed to generate
+
+    Returns:
+        Parsed answers, one per image, in input order
+    """
+    images = list(images)
+    text_inputs = list(text_inputs) if text_inputs is not None else [None] * len(images)
+    if len(text_inputs) != len(images):
+        raise ValueError(f"Got {len(text_inputs)} text inputs for {len(images)} images")
+
+    if not supports_shared_vision(model) or not hasattr(processor, "_construct_prompts"):
+        # No access to the encoder hooks: padded batches would lose their attention mask
+        return [
+            Florence2Session(processor, model, image, device, share_vision=False).run(task_prompt, text, **generation_kwargs)
+            for image, text in zip(images, text_inputs)
+        ]
+
+    results = []
+    for start in range(0, len(images), max(1, batch_size)):
+        chunk = images[start:start + batch_size]
+        prompts = [_prompt(task_prompt, text) for text in text_inputs[start:start + batch_size]]
+        pixel_values = processor.image_processor(chunk, return_tensors="pt")["pixel_values"].to(device)
+        input_ids, text_mask = _tokenize_prompts(processor, prompts, device)
+        with torch.no_grad():
+            image_features = model._encode_image(pixel_values)
+            generated_ids = _generate_from_features(model, image_features, input_ids, text_mask, **generation_kwargs)
+        generated_texts = processor.batch_decode(generated_ids, skip_special_tokens=False)
+        for image, generated_text in zip(chunk, generated_texts):
+            results.append(processor.post_process_generation(
+                generated_text, task=task_prompt, image_size=(image.width, image.height)
+            ))
+    return results
+
+
+class Florence2Session:
+    """Run several Florence-2 task prompts against one image with a single vision encode"""
+
+    def __init__(self, processor, model, image, device: str, share_vision: bool = True):
+        """
+        Args:
+            processor: Florence-2 AutoProcessor
+            model: Florence-2 model (trust_remote_code)
+            image: PIL image
+            device: Torch device
+            share_vision: Reuse image features across prompts (falls back to model.generate if
+                the model doesn't expose _encode_image/_merge_input_ids_with_image_features)
+        """
+        self.processor = processor
+        self.model = model
+        self.image = image
+        self.device = device
+        self.share_vision = share_vision and supports_shared_vision(model)
+        self._pixel_values = None
+        self._image_features = None
+        self.num_vision_encodes = 0
+        self.results: Dict[Tuple[str, Optional[str]], Dict] = {}  # Answers precomputed by a batch
+
+    def _input_ids(self, prompt: str) -> torch.Tensor:
+        """Tokenize a task prompt; the image is preprocessed only on the first call"""
+        if self._pixel_values is None or not hasattr(self.processor, "_construct_prompts"):
+            inputs = self.processor(text=prompt, images=self.image, return_tensors="pt").to(self.device)
+            if self._pixel_values is None:
+                self._pixel_values = inputs["pixel_values"]
+            return inputs["input_ids"]
+        # Same task-token -> text expansion the processor applies, without re-processing the image
+        text = self.processor._construct_prompts([prompt])
+        return self.processor.tokenizer(text, return_tensors="pt")["input_ids"].to(self.device)
+
+    def image_features(self) -> torch.Tensor:
+        """Visual tokens for this image (computed once)"""
+        if self._image_features is None:
+            if self._pixel_values is None:
+                self._input_ids("<OD>")
+            with torch.no_grad():
+                self._image_features = self.model._encode_image(self._pixel_values)
+            self.num_vision_encodes += 1
+        return self._image_features
+
+    def generate(self, prompt: str, **generation_kwargs) -> torch.Tensor:
+        """Generate token IDs for one prompt against the session image"""
+        input_ids = self._input_ids(prompt)
+        with torch.no_grad():
+            if not self.share_vision:
+                self.num_vision_encodes += 1
+                return self.model.generate(
+                    input_ids=input_ids, pixel_values=self._pixel_values, **generation_kwargs
+                )
+            return _generate_from_features(self.model, self.image_features(), input_ids, **generation_kwargs)
+
+    def prime(self, task_prompt: str, text_input: Optional[str], parsed_answer: Dict):
+        """Store an answer computed elsewhere (batched) so run() returns it without decoding"""
+        self.results[(task_prompt, text_input)] = parsed_answer
+
+    def run_many(
+        self,
+        task_prompt: str,
+        text_inputs: Sequence[Optional[str]],
+        batch_size: int = 4,
+        **generation_kwargs
+    ) -> List[Dict]:
+        """Run several prompts (e.g. VQA questions) against this image in padded batches"""
+        text_inputs = list(text_inputs)
+        if not self.share_vision or not hasattr(self.processor, "_construct_prompts"):
+            return [self.run(task_prompt, text, **generation_kwargs) for text in text_inputs]
+
+        results = []
+        for start in range(0, len(text_inputs), max(1, batch_size)):
+            chunk = text_inputs[start:start + batch_size]
+            image_features = self.image_features()
+            input_ids, text_mask = _tokenize_prompts(
+                self.processor, [_prompt(task_prompt, text) for text in chunk], self.device
+            )
+            with torch.no_grad():
+                generated_ids = _generate_from_features(
+                    self.model,
+                    image_features.expand(len(chunk), -1, -1),
+                    input_ids,
+                    text_mask,
+                    **generation_kwargs
+                )
+            for generated_text in self.processor.batch_decode(generated_ids, skip_special_tokens=False):
+                results.append(self.processor.post_process_generation(
+                    generated_text, task=task_prompt, image_size=(self.image.width, self.image.height)
+                ))
+        return results
+
+    def run(self, task_prompt: str, text_input: Optional[str] = None, **generation_kwargs) -> Dict:
+        """Run a task prompt and return the processor's parsed answer"""
+        if (task_prompt, text_input) in self.results:
+            return self.results[(task_prompt, text_input)]
+        generated_ids = self.generate(_prompt(task_prompt, text_input), **generation_kwargs)
+        generated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
+
+        # Debug: Log generated text for VQA tasks
+        if task_prompt == "<VQA>":
+            logger.debug(f"Generated text before post-processing: '{generated_text[:500]}'")
+
+        return self.processor.post_process_generation(
+            generated_text, task=task_prompt, image_size=(self.image.width, self.image.height)
+        )
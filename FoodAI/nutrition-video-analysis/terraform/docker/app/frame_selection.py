@@ -0,0 +1,116 @@
+"""
+Content-aware frame selection
+Scores candidate frames on downscaled grayscale copies (sharpness, motion, histogram change)
+and picks the N sharpest, most diverse ones instead of N evenly spaced timestamps.
+"""
+import cv2
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+ANALYSIS_WIDTH = 160  # Scores are computed on tiny grayscale frames - cost is negligible
+HIST_BINS = 32
+
+
+def frame_features(frames: List[np.ndarray]) -> List[Dict]:
+    """
+    Per-frame quality features
+
+    Args:
+        frames: RGB frames in temporal order
+
+    Returns:
+        [{'sharpness', 'motion', 'histogram_change', 'hist'}] where motion / histogram_change
+        are relative to the previous frame (0 for the first)
+    """
+    features = []
+    prev_small = None
+    prev_hist = None
+    for frame in frames:
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        h, w = gray.shape[:2]
+        small = cv2.resize(gray, (ANALYSIS_WIDTH, max(1, int(ANALYSIS_WIDTH * h / w))), interpolation=cv2.INTER_AREA)
+
+        # Laplacian variance: low for blurred frames
+        sharpness = float(cv2.Laplacian(small, cv2.CV_64F).var())
+
+        hist = cv2.calcHist([small], [0], None, [HIST_BINS], [0, 256])
+        cv2.normalize(hist, hist, alpha=1.0, norm_type=cv2.NORM_L1)
+
+        if prev_small is not None:
+            motion = float(cv2.absdiff(small, prev_small).mean() / 255.0)
+            histogram_change = float(cv2.compareHist(prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA))
+        else:
+            motion = 0.0
+            histogram_change = 0.0
+
+        features.append({
+            'sharpness': sharpness,
+            'motion': motion,
+            'histogram_change': histogram_change,
+            'hist': hist,
+        })
+        prev_small, prev_hist = small, hist
+    return features
+
+
+def select_informative_frames(
+    frames: List[np.ndarray],
+    num_frames: int,
+    diversity_weight: float = 0.5,
+    motion_penalty: float = 0.5,
+    always_include: Optional[List[int]] = None
+) -> Tuple[List[int], List[Dict]]:
+    """
+    Greedily pick num_frames sharp, diverse frames from a candidate pool
+
+    Quality = normalized sharpness, reduced for frames with strong motion (likely motion blur).
+    Each pick after the first maximizes quality + diversity_weight * (histogram distance to the
+    closest already-selected frame), so near-duplicates lose to frames showing something new.
+
+    Args:
+        frames: Candidate RGB frames in temporal order
+        num_frames: How many to keep
+        diversity_weight: Weight of histogram diversity vs quality
+        motion_penalty: How strongly motion lowers quality (0 = ignore motion)
+        always_include: Positions that must be selected (picked first)
+
+    Returns:
+        (selected positions into frames, sorted ascending; per-candidate score dicts)
+    """
+    features = frame_features(frames)
+    if not features:
+        return [], []
+
+    sharpness = np.array([f['sharpness'] for f in features])
+    motion = np.array([f['motion'] for f in features])
+    sharp_norm = sharpness / sharpness.max() if sharpness.max() > 0 else np.ones_like(sharpness)
+    motion_norm = motion / motion.max() if motion.max() > 0 else np.zeros_like(motion)
+    quality = sharp_norm * (1.0 - motion_penalty * motion_norm)
+
+    selected = []
+    forced = [i for i in (always_include or []) if 0 <= i < len(features)]
+    diversity = np.ones(len(features))
+    while len(selected) < min(num_frames, len(features)):
+        if forced:
+            best = forced.pop(0)
+        else:
+            score = quality + diversity_weight * diversity
+            score[selected] = -np.inf
+            best = int(np.argmax(score))
+        selected.append(best)
+        # Distance of every candidate to its nearest selected frame
+        for i, f in enumerate(features):
+            dist = cv2.compareHist(features[best]['hist'], f['hist'], cv2.HISTCMP_BHATTACHARYYA)
+            diversity[i] = min(diversity[i], dist)
+
+    scores = [
+        {
+            'sharpness': round(f['sharpness'], 2),
+            'motion': round(f['motion'], 4),
+            'histogram_change': round(f['histogram_change'], 4),
+            'quality': round(float(quality[i]), 4),
+            'selected': i in selected,
+        }
+        for i, f in enumerate(features)
+    ]
+    return sorted(selected), scores
@@ -0,0 +1,135 @@
+"""
+Video frame source
+Sequential, generator-based frame decoding shared by frame loading and segmented-video generation.
+
+Backends:
+    - opencv: grab() every frame (demux + decode only) and retrieve() only the frames we keep,
+      so skipped frames are never converted/copied and no keyframe-relative seeks are needed
+    - pyav: threaded FFmpeg decode with scaling + RGB conversion done in swscale at decode time
+      (optional dependency: pip install av). Does not apply rotation metadata the way OpenCV does,
+      so portrait phone clips may come out sideways.
+"""
+import cv2
+import numpy as np
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+def _pyav_available() -> bool:
+    try:
+        import av  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class VideoFrameSource:
+    """Decode selected frames of a video as RGB arrays, resized to a target width"""
+
+    def __init__(self, video_path: Path, resize_width: Optional[int] = None, backend: str = "auto"):
+        """
+        Args:
+            video_path: Path to the video file
+            resize_width: Output width (aspect ratio kept); None = native size
+            backend: "opencv", "pyav" or "auto" (pyav when installed)
+        """
+        self.video_path = Path(video_path)
+        self.resize_width = resize_width
+
+        if backend == "auto":
+            backend = "pyav" if _pyav_available() else "opencv"
+        if backend not in ("opencv", "pyav"):
+            raise ValueError(f"Unknown video decode backend: {backend}")
+        self.backend = backend
+
+        # Stream metadata (OpenCV's probe is cheap and matches previous behaviour)
+        cap = cv2.VideoCapture(str(self.video_path))
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video: {video_path}")
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+    @property
+    def duration_sec(self) -> float:
+        return self.total_frames / self.fps if self.fps > 0 else 0.0
+
+    def _output_size(self, width: int, height: int) -> Tuple[int, int]:
+        if not self.resize_width:
+            return width, height
+        return self.resize_width, int(self.resize_width * (height / width))
+
+    def iter_frames(
+        self,
+        indices: Optional[Iterable[int]] = None,
+        step: int = 1,
+        max_frames: Optional[int] = None
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Yield (frame_idx, rgb_frame) in decode order
+
+        Args:
+            indices: Exact frame indices to return (any order/duplicates; yielded once each, ascending)
+            step: When indices is None, return every step-th frame
+            max_frames: Stop after this many frames have been yielded
+        """
+        wanted = set(indices) if indices is not None else None
+        if wanted is not None and not wanted:
+            return
+        last_wanted = max(wanted) if wanted is not None else None
+
+        def keep(idx: int) -> bool:
+            if wanted is not None:
+                return idx in wanted
+            return idx % max(1, step) == 0
+
+        if self.backend == "pyav":
+            frames = self._iter_pyav(keep, last_wanted)
+        else:
+            frames = self._iter_opencv(keep, last_wanted)
+
+        yielded = 0
+        for item in frames:
+            yield item
+            yielded += 1
+            if max_frames and yielded >= max_frames:
+                break
+
+    def _iter_opencv(self, keep, last_wanted: Optional[int]) -> Iterator[Tuple[int, np.ndarray]]:
+        cap = cv2.VideoCapture(str(self.video_path))
+        try:
+            idx = 0
+            while last_wanted is None or idx <= last_wanted:
+                if not cap.grab():
+                    break
+                if keep(idx):
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    h, w = frame.shape[:2]
+                    out_w, out_h = self._output_size(w, h)
+                    if (out_w, out_h) != (w, h):
+                        frame = cv2.resize(frame, (out_w, out_h), interpolation=cv2.INTER_AREA)
+                    yield idx, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                idx += 1
+        finally:
+            cap.release()
+
+    def _iter_pyav(self, keep, last_wanted: Optional[int]) -> Iterator[Tuple[int, np.ndarray]]:
+        import av
+
+        container = av.open(str(self.video_path))
+        try:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"  # Frame + slice threading in FFmpeg
+            for idx, frame in enumerate(container.decode(stream)):
+                if last_wanted is not None and idx > last_wanted:
+                    break
+                if not keep(idx):
+                    continue
+                out_w, out_h = self._output_size(frame.width, frame.height)
+                yield idx, frame.to_ndarray(
+                    width=out_w, height=out_h, format="rgb24", interpolation="AREA"
+                )
+        finally:
+            container.close()
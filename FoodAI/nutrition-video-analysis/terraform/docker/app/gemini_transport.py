@@ -0,0 +1,409 @@
+"""
+Gemini record/replay transport
+Intercepts every generate_content call made through google.generativeai (GenerativeModel) or
+google.genai (client.models) - pipeline, nutrition RAG, anything else in-process - so runs can be
+recorded to prompt-hash fixtures and replayed offline.
+
+Modes (GEMINI_TRANSPORT):
+    live:   SDK untouched (default)
+    record: call the real API and write one fixture per (model, prompt, images) hash
+    replay: serve fixtures without network, with synthetic latency and error injection;
+            works even when the SDKs are not installed (fake modules are registered)
+"""
+import hashlib
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import types
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_MODES = ("live", "record", "replay")
+FIXTURE_VERSION = 1
+
+
+class GeminiTransportError(RuntimeError):
+    """Injected transport failure (replay mode error injection)"""
+
+
+class GeminiFixtureMissing(RuntimeError):
+    """No recorded response for this request (replay mode)"""
+
+
+class ReplayResponse:
+    """Minimal stand-in for SDK responses: the pipeline only reads .text"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _content_parts(contents) -> List:
+    """Flatten contents (str / list / Content / Part / PIL image / dict) into hashable parts"""
+    if contents is None:
+        return []
+    if isinstance(contents, str):
+        return [("text", contents)]
+    if isinstance(contents, bytes):
+        return [("bytes", hashlib.sha256(contents).hexdigest())]
+    if isinstance(contents, (list, tuple)):
+        return [part for item in contents for part in _content_parts(item)]
+    if isinstance(contents, dict):
+        if "text" in contents:
+            return [("text", contents["text"])]
+        if "data" in contents:
+            return _content_parts(contents["data"])
+        return [("dict", json.dumps(contents, sort_keys=True, default=str))]
+    if hasattr(contents, "tobytes") and hasattr(contents, "size") and hasattr(contents, "mode"):
+        # PIL image: hash pixels, not the (address-dependent) repr
+        return [("image", hashlib.sha256(contents.tobytes()).hexdigest())]
+    parts = getattr(contents, "parts", None)
+    if parts is not None:
+        return _content_parts(parts)
+    text = getattr(contents, "text", None)
+    if isinstance(text, str):
+        return [("text", text)]
+    inline = getattr(contents, "inline_data", None)
+    if inline is not None:
+        return _content_parts(getattr(inline, "data", None))
+    file_data = getattr(contents, "file_data", None)
+    if file_data is not None:
+        return [("file", str(getattr(file_data, "file_uri", "")))]
+    return [("object", type(contents).__name__)]
+
+
+def prompt_text(contents) -> str:
+    """Text parts of a request, joined (for fixture previews and canned stubs)"""
+    return "\n".join(value for kind, value in _content_parts(contents) if kind == "text")
+
+
+def request_key(model_name: str, contents) -> str:
+    """Stable hash of model + prompt text + image bytes"""
+    model_name = (model_name or "").split("/")[-1]
+    payload = json.dumps([model_name, _content_parts(contents)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GeminiTransport:
+    """Routes intercepted generate_content calls according to the mode"""
+
+    def __init__(
+        self,
+        mode: str = "live",
+        fixtures_dir: Optional[Path] = None,
+        replay_latency_ms: Optional[float] = None,
+        replay_jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        on_miss: str = "error",
+        seed: int = 0
+    ):
+        """
+        Args:
+            mode: "live", "record" or "replay"
+            fixtures_dir: Directory of <hash>.json fixtures
+            replay_latency_ms: Fixed replay latency; None = replay the recorded latency
+            replay_jitter_ms: Uniform +/- jitter added to replay latency
+            error_rate: Fraction of replayed calls that raise GeminiTransportError
+            on_miss: Replay without fixture: "error" (raise), "empty" (empty text) or "live" (call API)
+            seed: RNG seed for jitter / error injection (deterministic load tests)
+        """
+        if mode not in TRANSPORT_MODES:
+            raise ValueError(f"Unknown Gemini transport mode: {mode}")
+        if mode != "live" and fixtures_dir is None:
+            raise ValueError(f"Gemini transport mode '{mode}' needs a fixtures directory")
+        self.mode = mode
+        self.fixtures_dir = Path(fixtures_dir) if fixtures_dir is not None else None
+        self.replay_latency_ms = replay_latency_ms
+        self.replay_jitter_ms = replay_jitter_ms
+        self.error_rate = error_rate
+        self.on_miss = on_miss
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "recorded": 0, "replayed": 0, "misses": 0, "injected_errors": 0, "latency_ms": 0.0}
+        if self.mode == "record":
+            self.fixtures_dir.mkdir(parents=True, exist_ok=True)
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def stats(self) -> Dict:
+        """Cumulative counters; latency_ms = time spent inside (real or simulated) Gemini calls"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["latency_ms"] = round(stats["latency_ms"], 1)
+        return stats
+
+    def _fixture_path(self, key: str) -> Path:
+        return self.fixtures_dir / f"{key}.json"
+
+    def generate(self, model_name: str, contents, call_live: Optional[Callable]):
+        """
+        Serve one generate_content call
+
+        Args:
+            model_name: Model the caller asked for
+            contents: Request contents as passed to the SDK
+            call_live: Zero-arg callable performing the real SDK call (None when the SDK is faked)
+        """
+        self._count(calls=1)
+        if self.mode == "replay":
+            return self._replay(model_name, contents, call_live)
+
+        start = time.perf_counter()
+        response = call_live()
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        self._count(latency_ms=latency_ms)
+        if self.mode == "record":
+            self._record(model_name, contents, response, latency_ms)
+        return response
+
+    def _record(self, model_name: str, contents, response, latency_ms: float):
+        try:
+            text = response.text
+        except Exception as e:
+            # Blocked / empty candidates: nothing replayable
+            logger.warning(f"[Gemini record] Not recording response without text: {e}")
+            return
+        key = request_key(model_name, contents)
+        fixture = {
+            "version": FIXTURE_VERSION,
+            "key": key,
+            "model": model_name,
+            "prompt_preview": prompt_text(contents)[:500],
+            "response_text": text,
+            "latency_ms": round(latency_ms, 1),
+            "recorded_at": datetime.utcnow().isoformat() + "Z",
+        }
+        path = self._fixture_path(key)
+        tmp_path = path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(fixture, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_path.replace(path)
+        self._count(recorded=1)
+
+    def _replay(self, model_name: str, contents, call_live: Optional[Callable]):
+        key = request_key(model_name, contents)
+        path = self._fixture_path(key)
+        if not path.exists():
+            self._count(misses=1)
+            if self.on_miss == "live" and call_live is not None:
+                start = time.perf_counter()
+                response = call_live()
+                self._count(latency_ms=(time.perf_counter() - start) * 1000.0)
+                return response
+            if self.on_miss == "empty":
+                return ReplayResponse("")
+            raise GeminiFixtureMissing(f"No Gemini fixture for model={model_name} key={key[:12]}")
+
+        fixture = json.loads(path.read_text(encoding="utf-8"))
+        with self._lock:
+            base = fixture.get("latency_ms", 0.0) if self.replay_latency_ms is None else self.replay_latency_ms
+            latency_ms = max(0.0, base + self._rng.uniform(-self.replay_jitter_ms, self.replay_jitter_ms))
+            inject_error = self._rng.random() < self.error_rate
+        if latency_ms:
+            time.sleep(latency_ms / 1000.0)
+        self._count(latency_ms=latency_ms)
+        if inject_error:
+            self._count(injected_errors=1)
+            raise GeminiTransportError("503 Service Unavailable (injected by replay transport)")
+        self._count(replayed=1)
+        return ReplayResponse(fixture.get("response_text", ""))
+
+
+_transport: Optional[GeminiTransport] = None
+_install_lock = threading.Lock()
+
+
+def get_gemini_transport() -> Optional[GeminiTransport]:
+    """Installed transport (None in live mode)"""
+    return _transport
+
+
+def install_fake_sdk(handler: Callable[[str, object], object], legacy: bool = True, new: bool = True):
+    """
+    Register fake google.generativeai and/or google.genai modules whose generate_content calls
+    handler(model_name, contents) and returns its result (an object with .text)
+
+    Args:
+        handler: (model_name, contents) -> response
+        legacy: Fake google.generativeai
+        new: Fake google.genai
+    """
+    google = sys.modules.get("google")
+    if google is None:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+
+    # Legacy SDK: genai.configure / genai.GenerativeModel(name).generate_content(contents)
+    generativeai = types.ModuleType("google.generativeai")
+
+    class GenerativeModel:
+        def __init__(self, model_name, *args, **kwargs):
+            self.model_name = model_name
+
+        def generate_content(self, contents, *args, **kwargs):
+            return handler(self.model_name, contents)
+
+    generativeai.configure = lambda *args, **kwargs: None
+    generativeai.GenerativeModel = GenerativeModel
+
+    # New SDK: genai.Client(api_key).models.generate_content(model=..., contents=...)
+    genai = types.ModuleType("google.genai")
+    genai_types = types.ModuleType("google.genai.types")
+
+    class _Obj:
+        def __init__(self, *args, **kwargs):
+            self.__dict__.update(kwargs)
+
+    for name in ("Part", "Blob", "Content", "GenerateContentConfig", "FileData"):
+        setattr(genai_types, name, type(name, (_Obj,), {}))
+
+    class _Models:
+        def generate_content(self, model=None, contents=None, **kwargs):
+            return handler(model, contents)
+
+    class _Files:
+        def upload(self, *args, **kwargs):
+            raise RuntimeError("File upload is not available without the google-genai SDK")
+
+    class Client:
+        def __init__(self, *args, **kwargs):
+            self.models = _Models()
+            self.files = _Files()
+
+    genai.Client = Client
+    genai.types = genai_types
+
+    if legacy:
+        sys.modules["google.generativeai"] = generativeai
+        google.generativeai = generativeai
+    if new:
+        sys.modules["google.genai"] = genai
+        sys.modules["google.genai.types"] = genai_types
+        google.genai = genai
+
+
+def _patch_sdks(transport: GeminiTransport) -> set:
+    """Wrap generate_content of the installed SDKs; returns which were patched ("legacy", "new")"""
+    patched = set()
+    try:
+        import google.generativeai as generativeai
+        model_cls = generativeai.GenerativeModel
+        if not getattr(model_cls.generate_content, "_gemini_transport", False):
+            original = model_cls.generate_content
+
+            def generate_content(self, contents, *args, **kwargs):
+                return transport.generate(
+                    getattr(self, "model_name", ""), contents, lambda: original(self, contents, *args, **kwargs)
+                )
+            generate_content._gemini_transport = True
+            model_cls.generate_content = generate_content
+        patched.add("legacy")
+    except ImportError:
+        pass
+    try:
+        from google.genai import models as genai_models
+        models_cls = genai_models.Models
+        if not getattr(models_cls.generate_content, "_gemini_transport", False):
+            original_new = models_cls.generate_content
+
+            def generate_content_new(self, *args, **kwargs):
+                model = kwargs.get("model", args[0] if args else "")
+                contents = kwargs.get("contents", args[1] if len(args) > 1 else None)
+                return transport.generate(model, contents, lambda: original_new(self, *args, **kwargs))
+            generate_content_new._gemini_transport = True
+            models_cls.generate_content = generate_content_new
+        patched.add("new")
+    except ImportError:
+        pass
+    return patched
+
+
+def install_gemini_transport(config) -> Optional[GeminiTransport]:
+    """
+    Install the transport selected by config.GEMINI_TRANSPORT (idempotent per process)
+
+    Returns:
+        The active transport, or None in live mode
+    """
+    global _transport
+    mode = (config.GEMINI_TRANSPORT or "live").strip().lower()
+    if mode == "live":
+        return None
+    with _install_lock:
+        if _transport is not None:
+            if _transport.mode != mode:
+                logger.warning(f"Gemini transport already installed in '{_transport.mode}' mode; ignoring '{mode}'")
+            return _transport
+        transport = GeminiTransport(
+            mode=mode,
+            fixtures_dir=config.GEMINI_FIXTURES_DIR,
+            replay_latency_ms=config.GEMINI_REPLAY_LATENCY_MS,
+            replay_jitter_ms=config.GEMINI_REPLAY_JITTER_MS,
+            error_rate=config.GEMINI_REPLAY_ERROR_RATE,
+            on_miss=config.GEMINI_REPLAY_ON_MISS,
+            seed=config.GEMINI_REPLAY_SEED,
+        )
+        patched = _patch_sdks(transport)
+        if mode == "replay" and len(patched) < 2:
+            # SDK(s) not installed: serve replays through fake modules
+            install_fake_sdk(
+                lambda model, contents: transport.generate(model, contents, None),
+                legacy="legacy" not in patched,
+                new="new" not in patched,
+            )
+        elif mode == "record" and not patched:
+            raise RuntimeError("GEMINI_TRANSPORT=record needs google-generativeai or google-genai installed")
+        _transport = transport
+        logger.info(f"Gemini transport: {mode} (fixtures: {config.GEMINI_FIXTURES_DIR})")
+        return transport
+
+
+def limit_gemini_concurrency(semaphore) -> set:
+    """
+    Bound in-flight generate_content calls with semaphore (threading or multiprocessing
+    semaphore, so one limit can be shared by a process pool). Wraps whatever SDK classes are
+    currently importable - real, transport-patched or fake - so call it after the transport
+    or fake SDK is installed.
+
+    Returns:
+        Which SDKs were wrapped ("legacy", "new")
+    """
+    wrapped = set()
+    targets = []
+    try:
+        import google.generativeai as generativeai
+        targets.append(("legacy", generativeai.GenerativeModel))
+    except ImportError:
+        pass
+    try:
+        from google.genai import models as genai_models
+        targets.append(("new", genai_models.Models))
+    except ImportError:
+        try:
+            import google.genai as genai
+            # Fake SDK (install_fake_sdk): Models class is only reachable through a client
+            targets.append(("new", type(genai.Client().models)))
+        except (ImportError, AttributeError, TypeError):
+            pass
+    for name, cls in targets:
+        original = cls.generate_content
+        if getattr(original, "_gemini_limited", False):
+            wrapped.add(name)
+            continue
+
+        def generate_content(self, *args, _original=original, **kwargs):
+            with semaphore:
+                return _original(self, *args, **kwargs)
+        generate_content._gemini_limited = True
+        generate_content._gemini_transport = getattr(original, "_gemini_transport", False)
+        cls.generate_content = generate_content
+        wrapped.add(name)
+    return wrapped
@@ -15,6 +15,8 @@
 # ------------------------------------------------------------------------------------------------
 
 import math
+import os
+import threading
 import warnings
 from typing import Optional
 
@@ -28,6 +30,7 @@ from torch.nn.init import constant_, xavier_uniform_
 try:
     from grounding_dino.groundingdino import _C
 except:
+    _C = None
     warnings.warn("Failed to load custom C++ ops. Running on CPU mode Only!")
 
 
@@ -133,6 +136,123 @@ def multi_scale_deformable_attn_pytorch(
     return output.transpose(1, 2).contiguous()
 
 
+# ------------------------------------------------------------------------------------------------
+# Fused pure-PyTorch path (CPU images without the compiled extension)
+#
+# All levels are copied into one zero-padded (bs*heads*levels, C, H_max, W_max) buffer and sampled
+# with a single grid_sample; sampling grids are rescaled per level so every level keeps its own
+# normalized coordinate frame. Bilinear taps that fall outside a level land on the zero padding,
+# which is exactly grid_sample's padding_mode="zeros" behaviour, so results match the reference.
+# ------------------------------------------------------------------------------------------------
+
+# "auto" (CUDA extension on GPU, fused otherwise) | "cuda" | "fused" | "pytorch" (per-level reference)
+_MSDA_IMPL = os.environ.get("GDINO_MSDA_IMPL", "auto").lower()
+_MSDA_COMPILE = os.environ.get("GDINO_MSDA_COMPILE", "0") == "1"
+_compiled_sample = None
+_buffers = threading.local()
+
+
+def set_ms_deform_attn_impl(impl: str = "auto", compile: bool = False):
+    """Select the MultiScaleDeformableAttention kernel ("auto", "cuda", "fused", "pytorch")."""
+    global _MSDA_IMPL, _MSDA_COMPILE, _compiled_sample
+    impl = impl.lower()
+    if impl not in ("auto", "cuda", "fused", "pytorch"):
+        raise ValueError("Unknown ms_deform_attn implementation: {}".format(impl))
+    _MSDA_IMPL = impl
+    if compile != _MSDA_COMPILE:
+        _compiled_sample = None
+    _MSDA_COMPILE = compile
+
+
+def _resolve_impl(value: torch.Tensor) -> str:
+    cuda_ok = _C is not None and value.is_cuda
+    if _MSDA_IMPL == "auto":
+        return "cuda" if cuda_ok else "fused"
+    if _MSDA_IMPL == "cuda" and not cuda_ok:
+        return "fused"
+    return _MSDA_IMPL
+
+
+def _padded_value_buffer(bs, num_heads, num_levels, embed_dims, h_max, w_max, shapes, dtype, device):
+    """Per-thread reusable padded buffer; pad regions are never written, so they stay zero."""
+    key = (bs, num_heads, num_levels, embed_dims, tuple(shapes), dtype, device)
+    if getattr(_buffers, "key", None) != key:
+        _buffers.key = key
+        _buffers.tensor = torch.zeros(
+            bs, num_heads, num_levels, embed_dims, h_max, w_max, dtype=dtype, device=device
+        )
+    return _buffers.tensor
+
+
+def _fused_sample(padded, grids, weights):
+    # padded: (N*L, C, H_max, W_max), grids: (N*L, Q, P, 2), weights: (N, L, Q, P) with N = bs*heads
+    n, num_levels, num_queries, num_points = weights.shape
+    sampled = F.grid_sample(
+        padded, grids, mode="bilinear", padding_mode="zeros", align_corners=False
+    )
+    sampled = sampled.view(n, num_levels, -1, num_queries, num_points)
+    # sum over levels and points in one batched contraction -> (N, C, Q)
+    return torch.einsum("nlcqp,nlqp->ncq", sampled, weights)
+
+
+def _get_sample_fn():
+    global _compiled_sample
+    if not _MSDA_COMPILE or not hasattr(torch, "compile"):
+        return _fused_sample
+    if _compiled_sample is None:
+        try:
+            _compiled_sample = torch.compile(_fused_sample, dynamic=True)
+        except Exception as e:
+            warnings.warn("torch.compile failed for ms_deform_attn, using eager: {}".format(e))
+            _compiled_sample = _fused_sample
+    return _compiled_sample
+
+
+def multi_scale_deformable_attn_fused(
+    value: torch.Tensor,
+    value_spatial_shapes: torch.Tensor,
+    sampling_locations: torch.Tensor,
+    attention_weights: torch.Tensor,
+) -> torch.Tensor:
+    """Drop-in replacement for multi_scale_deformable_attn_pytorch with one grid_sample call."""
+    bs, _, num_heads, embed_dims = value.shape
+    _, num_queries, _, num_levels, num_points, _ = sampling_locations.shape
+    shapes = [(int(h), int(w)) for h, w in value_spatial_shapes.tolist()]
+    h_max = max(h for h, _ in shapes)
+    w_max = max(w for _, w in shapes)
+
+    if value.requires_grad:
+        padded = value.new_zeros(bs, num_heads, num_levels, embed_dims, h_max, w_max)
+    else:
+        padded = _padded_value_buffer(
+            bs, num_heads, num_levels, embed_dims, h_max, w_max, shapes, value.dtype, value.device
+        )
+    start = 0
+    for level, (h, w) in enumerate(shapes):
+        # bs, h*w, num_heads, embed_dims -> bs, num_heads, embed_dims, h, w
+        padded[:, :, level, :, :h, :w] = (
+            value[:, start : start + h * w].permute(0, 2, 3, 1).reshape(bs, num_heads, embed_dims, h, w)
+        )
+        start += h * w
+
+    # Rescale [0, 1] level coordinates into the padded frame, then to grid_sample's [-1, 1]
+    scale = sampling_locations.new_tensor([[w / w_max, h / h_max] for h, w in shapes])
+    grids = 2 * sampling_locations * scale[None, None, None, :, None, :] - 1
+    # bs, num_queries, num_heads, num_levels, num_points, 2 -> bs*num_heads*num_levels, num_queries, num_points, 2
+    grids = grids.permute(0, 2, 3, 1, 4, 5).reshape(
+        bs * num_heads * num_levels, num_queries, num_points, 2
+    )
+    # bs, num_queries, num_heads, num_levels, num_points -> bs*num_heads, num_levels, num_queries, num_points
+    weights = attention_weights.permute(0, 2, 3, 1, 4).reshape(
+        bs * num_heads, num_levels, num_queries, num_points
+    )
+
+    output = _get_sample_fn()(
+        padded.view(bs * num_heads * num_levels, embed_dims, h_max, w_max), grids, weights
+    )
+    return output.view(bs, num_heads * embed_dims, num_queries).transpose(1, 2).contiguous()
+
+
 class MultiScaleDeformableAttention(nn.Module):
     """Multi-Scale Deformable Attention Module used in Deformable-DETR
 
@@ -327,7 +447,8 @@ class MultiScaleDeformableAttention(nn.Module):
                 )
             )
     
-        if torch.cuda.is_available() and value.is_cuda:
+        impl = _resolve_impl(value)
+        if impl == "cuda":
             halffloat = False
             if value.dtype == torch.float16:
                 halffloat = True
@@ -346,6 +467,10 @@ class MultiScaleDeformableAttention(nn.Module):
 
             if halffloat:
                 output = output.half()
+        elif impl == "fused":
+            output = multi_scale_deformable_attn_fused(
+                value, spatial_shapes, sampling_locations, attention_weights
+            )
         else:
             output = multi_scale_deformable_attn_pytorch(
                 value, spatial_shapes, sampling_locations, attention_weights
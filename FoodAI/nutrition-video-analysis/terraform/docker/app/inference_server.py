@@ -0,0 +1,317 @@
+"""
+In-host inference server
+Owns SAM2 (image predictor) and Metric3D in one process and serves concurrent jobs over a local
+Unix socket. Requests arriving within INFERENCE_MAX_WAIT_MS of the first one are coalesced into one
+batch of up to INFERENCE_MAX_BATCH: one set_image_batch + predict_batch call for SAM2, one stacked
+Metric3D forward per frame size. Jobs reach it through InferenceClient when the pipeline has
+INFERENCE_SERVER_ADDRESS set; SAM2 video tracking keeps its per-job memory and stays in-process.
+Server and jobs must share INFERENCE_SERVER_AUTHKEY; the socket is only accessible to its owner.
+
+    python -m app.inference_server                  # listens on INFERENCE_SERVER_ADDRESS
+    python -m app.inference_server --address /tmp/nutrition-inference.sock --max-batch 16
+
+worker.py starts one itself with WORKER_INFERENCE_SERVER=true (see run_prefork).
+"""
+import argparse
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+OPS = ("segment", "depth")
+
+
+class _Request:
+    """One queued call: payload plus where to send the reply"""
+    __slots__ = ("request_id", "payload", "conn", "conn_lock")
+
+    def __init__(self, request_id, payload: Dict, conn, conn_lock):
+        self.request_id = request_id
+        self.payload = payload
+        self.conn = conn
+        self.conn_lock = conn_lock
+
+    def reply(self, status: str, result):
+        try:
+            with self.conn_lock:
+                self.conn.send((self.request_id, status, result))
+        except (OSError, EOFError) as e:
+            # Caller went away (job failed / process exited); nothing to deliver to
+            logger.debug(f"Dropped reply for request {self.request_id}: {e}")
+
+
+class InferenceServer:
+    """Dynamic batching over the heavy models, one batching thread per operation"""
+
+    def __init__(self, model_manager, address: str, authkey: bytes, max_batch: int = 8, max_wait_ms: float = 10.0):
+        """
+        Args:
+            model_manager: ModelManager owning SAM2 / Metric3D
+            address: Unix socket path
+            authkey: Shared secret checked on every connection
+            max_batch: Max requests per batch
+            max_wait_ms: How long a batch waits for more requests after its first one
+        """
+        if not authkey:
+            raise ValueError("InferenceServer requires a non-empty authkey")
+        self.models = model_manager
+        self.address = address
+        self.authkey = authkey
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queues = {op: queue.Queue() for op in OPS}
+        self._handlers = {"segment": self._segment_batch, "depth": self._depth_batch}
+        self._stats_lock = threading.Lock()
+        self._stats = {op: {'requests': 0, 'batches': 0, 'max_batch': 0, 'busy_ms': 0.0} for op in OPS}
+
+    def preload(self):
+        """Load the served models before accepting connections"""
+        _ = self.models.sam2
+        _ = self.models.metric3d
+
+    def serve_forever(self):
+        """Accept connections (one reader thread each) until interrupted"""
+        for op in OPS:
+            threading.Thread(target=self._batch_loop, args=(op,), name=f"batch-{op}", daemon=True).start()
+        if os.path.exists(self.address):
+            os.unlink(self.address)  # Stale socket from a previous run
+        # Requests are unpickled: only the owner may connect (umask closes the window before the chmod)
+        old_umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+            os.chmod(self.address, 0o600)
+        finally:
+            os.umask(old_umask)
+        with listener:
+            print(f"✓ Inference server listening on {self.address} "
+                  f"(max batch {self.max_batch}, max wait {self.max_wait * 1000:.0f} ms)")
+            sys.stdout.flush()
+            while True:
+                try:
+                    conn = listener.accept()
+                except KeyboardInterrupt:
+                    break
+                except Exception as e:
+                    logger.warning(f"Rejected inference connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        print("Inference server stopped")
+
+    def stats(self) -> Dict:
+        """Requests, batches and mean batch size per operation"""
+        with self._stats_lock:
+            return {
+                op: {**entry, 'mean_batch': round(entry['requests'] / entry['batches'], 2) if entry['batches'] else None}
+                for op, entry in self._stats.items()
+            }
+
+    def _serve_connection(self, conn):
+        conn_lock = threading.Lock()
+        with conn:
+            while True:
+                try:
+                    request_id, op, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                request = _Request(request_id, payload, conn, conn_lock)
+                if op == "stats":
+                    request.reply("ok", self.stats())
+                elif op in self._queues:
+                    self._queues[op].put(request)
+                else:
+                    request.reply("error", f"unknown operation '{op}'")
+
+    def _batch_loop(self, op: str):
+        """Take the first waiting request, collect more until the batch is full or its deadline passes, run it"""
+        requests = self._queues[op]
+        while True:
+            batch = [requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            start = time.perf_counter()
+            try:
+                results = self._handlers[op]([request.payload for request in batch])
+            except Exception as e:
+                logger.error(f"Inference batch failed ({op}, {len(batch)} request(s)): {e}", exc_info=True)
+                for request in batch:
+                    request.reply("error", f"{type(e).__name__}: {e}")
+                continue
+            busy_ms = (time.perf_counter() - start) * 1000.0
+            with self._stats_lock:
+                entry = self._stats[op]
+                entry['requests'] += len(batch)
+                entry['batches'] += 1
+                entry['max_batch'] = max(entry['max_batch'], len(batch))
+                entry['busy_ms'] = round(entry['busy_ms'] + busy_ms, 1)
+            for request, result in zip(batch, results):
+                request.reply("ok", result)
+            logger.debug(f"{op}: batch of {len(batch)} in {busy_ms:.1f} ms")
+
+    def _segment_batch(self, payloads: List[Dict]) -> List[np.ndarray]:
+        """SAM2 box prompts for several images: one batched encoder pass, one batched decode"""
+        predictor = self.models.sam2_image
+        with torch.inference_mode():
+            predictor.set_image_batch([payload['image'] for payload in payloads])
+            masks, _, _ = predictor.predict_batch(
+                box_batch=[payload['boxes'] for payload in payloads],
+                multimask_output=False,
+                return_logits=True
+            )
+        # predict_batch squeezes the box axis for a single box: always (num_boxes, 1, H, W)
+        return [
+            np.ascontiguousarray(mask.reshape(len(payload['boxes']), 1, *mask.shape[-2:]), dtype=np.float32)
+            for mask, payload in zip(masks, payloads)
+        ]
+
+    def _depth_batch(self, payloads: List[Dict]) -> List[np.ndarray]:
+        """Metric3D depth (meters) for several frames: one stacked forward per distinct frame size"""
+        model = self.models.metric3d
+        by_shape = {}
+        for i, payload in enumerate(payloads):
+            by_shape.setdefault(payload['frame'].shape, []).append(i)
+        results = [None] * len(payloads)
+        for shape, indices in by_shape.items():
+            frames = np.stack([payloads[i]['frame'] for i in indices])
+            rgb_input = torch.from_numpy(frames).permute(0, 3, 1, 2).float().to(self.models.device)
+            with torch.no_grad():
+                pred_depth, _, _ = model.inference({'input': rgb_input})
+            depth = pred_depth.reshape(len(indices), *pred_depth.shape[-2:]).cpu().numpy()
+            for i, depth_map in zip(indices, depth):
+                if depth_map.shape != shape[:2]:
+                    depth_map = cv2.resize(depth_map, (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
+                results[i] = depth_map
+        return results
+
+
+class InferenceClient:
+    """
+    Pipeline-side stub for the inference server
+    Each thread gets its own connection with one request in flight, so the SAM2 branch and the depth
+    branch of a job (and concurrent jobs) are separate requests the server can batch together.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        if not authkey:
+            raise ValueError("InferenceClient requires a non-empty authkey (INFERENCE_SERVER_AUTHKEY)")
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            except (OSError, EOFError, AuthenticationError) as e:
+                raise RuntimeError(f"Inference server not reachable at {self.address}: {e}") from e
+            self._local.conn = conn
+            self._local.next_id = 0
+        return conn
+
+    def call(self, op: str, **payload):
+        """Send one request and wait for its (batched) result"""
+        conn = self._connection()
+        self._local.next_id += 1
+        request_id = self._local.next_id
+        try:
+            conn.send((request_id, op, payload))
+            reply_id, status, result = conn.recv()
+        except (OSError, EOFError) as e:
+            self._local.conn = None
+            raise RuntimeError(f"Inference server connection lost ({op}): {e}") from e
+        if reply_id != request_id:
+            self._local.conn = None
+            raise RuntimeError(f"Inference server reply out of order ({reply_id} != {request_id})")
+        if status != "ok":
+            raise RuntimeError(f"Inference server {op} failed: {result}")
+        return result
+
+    def estimate_depth(self, frame: np.ndarray) -> np.ndarray:
+        """Metric3D depth in meters for an HxWx3 RGB frame (HxW float32)"""
+        return self.call("depth", frame=np.ascontiguousarray(frame))
+
+    def segment(self, image: np.ndarray, boxes) -> np.ndarray:
+        """SAM2 mask logits (num_boxes, 1, H, W) for box prompts on an RGB image"""
+        return self.call("segment", image=np.ascontiguousarray(image),
+                         boxes=np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+
+    def stats(self) -> Dict:
+        return self.call("stats")
+
+
+class RemoteImagePredictor:
+    """SAM2ImagePredictor surface used by SAM2ImageSession, answered by the inference server"""
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+        self._image = None
+
+    def set_image(self, image: np.ndarray):
+        # The server encodes the image together with other jobs' images at predict time
+        self._image = image
+
+    def predict(self, box=None, multimask_output: bool = False, return_logits: bool = True, **kwargs):
+        if box is None or multimask_output or not return_logits:
+            raise ValueError("RemoteImagePredictor supports single-mask box prompts returning logits only")
+        return self.client.segment(self._image, box), None, None
+
+
+def serve(address: str, authkey: bytes, max_batch: Optional[int] = None, max_wait_ms: Optional[float] = None):
+    """Load SAM2 / Metric3D and serve until interrupted (also the pre-fork worker's server process)"""
+    from app.config import Settings
+    from app.models import ModelManager
+    from app.timing import configure_logging
+
+    config = Settings()
+    configure_logging(config.LOG_LEVEL, config.LOG_FORMAT)
+    server = InferenceServer(
+        ModelManager(config),
+        address=address,
+        authkey=authkey,
+        max_batch=config.INFERENCE_MAX_BATCH if max_batch is None else max_batch,
+        max_wait_ms=config.INFERENCE_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+    )
+    print("⏳ Loading SAM2 and Metric3D...")
+    sys.stdout.flush()
+    server.preload()
+    server.serve_forever()
+
+
+def main():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(description="Serve SAM2 / Metric3D to local jobs with dynamic batching")
+    parser.add_argument("--address", type=str, default=settings.INFERENCE_SERVER_ADDRESS or "/tmp/nutrition-inference.sock",
+                        help="Unix socket path (default: INFERENCE_SERVER_ADDRESS)")
+    parser.add_argument("--max-batch", type=int, default=settings.INFERENCE_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=settings.INFERENCE_MAX_WAIT_MS)
+    args = parser.parse_args()
+    if not settings.INFERENCE_SERVER_AUTHKEY:
+        # Every request is unpickled: never serve without a secret shared with the job processes
+        sys.exit("❌ INFERENCE_SERVER_AUTHKEY is not set (e.g. export INFERENCE_SERVER_AUTHKEY=$(openssl rand -hex 32))")
+
+    serve(args.address, settings.INFERENCE_SERVER_AUTHKEY.encode(), args.max_batch, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compact per-frame mask storage
+All object masks of a frame are bit-packed (np.packbits) into a single compressed .npz
+with object IDs and labels as metadata, instead of one full-resolution PNG per object.
+
+Usage (decode an archive back to per-object PNGs):
+    python -m app.mask_codec frame_00000_masks.npz --out decoded/
+"""
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import Dict, Tuple
+
+MASK_ARCHIVE_VERSION = 1
+
+
+def mask_archive_name(frame_idx: int) -> str:
+    """File name of the mask archive for a frame"""
+    return f"frame_{frame_idx:05d}_masks.npz"
+
+
+def save_frame_masks(path: Path, masks: Dict[int, np.ndarray], labels: Dict[int, str]) -> Path:
+    """
+    Save all masks of one frame into a single bit-packed .npz
+
+    Args:
+        path: Output .npz path
+        masks: {obj_id: mask} with 2D (H, W) or 3D (1, H, W) boolean-like masks (same H, W)
+        labels: {obj_id: label}
+
+    Returns:
+        Path written
+    """
+    path = Path(path)
+    obj_ids = list(masks.keys())
+    masks_2d = [np.asarray(masks[o])[0] if np.asarray(masks[o]).ndim == 3 else np.asarray(masks[o])
+                for o in obj_ids]
+    if masks_2d:
+        h, w = masks_2d[0].shape[:2]
+        stacked = np.stack([m.astype(bool) for m in masks_2d]).reshape(len(masks_2d), -1)
+    else:
+        h, w = 0, 0
+        stacked = np.zeros((0, 0), dtype=bool)
+
+    np.savez_compressed(
+        path,
+        version=np.array(MASK_ARCHIVE_VERSION),
+        shape=np.array([h, w], dtype=np.int32),
+        obj_ids=np.array(obj_ids, dtype=np.int64),
+        labels=np.array([labels.get(o, '') for o in obj_ids], dtype=str),
+        areas=stacked.sum(axis=1).astype(np.int64),
+        packed=np.packbits(stacked, axis=1),
+    )
+    return path
+
+
+def load_frame_masks(path: Path) -> Dict[int, Tuple[str, np.ndarray]]:
+    """
+    Decode a mask archive written by save_frame_masks
+
+    Args:
+        path: .npz path
+
+    Returns:
+        {obj_id: (label, bool mask of shape (H, W))}
+    """
+    with np.load(Path(path), allow_pickle=False) as data:
+        h, w = (int(v) for v in data['shape'])
+        obj_ids = data['obj_ids'].tolist()
+        labels = data['labels'].tolist()
+        if not obj_ids:
+            return {}
+        unpacked = np.unpackbits(data['packed'], axis=1, count=h * w).astype(bool)
+
+    return {
+        obj_id: (label, unpacked[i].reshape(h, w))
+        for i, (obj_id, label) in enumerate(zip(obj_ids, labels))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a per-frame mask archive (.npz) to PNG masks")
+    parser.add_argument("archive", type=Path, help="frame_XXXXX_masks.npz file")
+    parser.add_argument("--out", type=Path, default=None, help="Directory for decoded PNGs (default: print summary only)")
+    args = parser.parse_args()
+
+    decoded = load_frame_masks(args.archive)
+    print(f"{args.archive}: {len(decoded)} objects")
+    for obj_id, (label, mask) in decoded.items():
+        print(f"  ID{obj_id}: {label} ({int(mask.sum())} px, {mask.shape[1]}x{mask.shape[0]})")
+
+    if args.out:
+        import cv2
+        args.out.mkdir(parents=True, exist_ok=True)
+        stem = args.archive.name.replace("_masks.npz", "")
+        for obj_id, (label, mask) in decoded.items():
+            safe_label = label.replace(' ', '_').replace('/', '_')[:50]
+            cv2.imwrite(str(args.out / f"{stem}_obj_{obj_id}_{safe_label}.png"), mask.astype(np.uint8) * 255)
+        print(f"✓ Wrote {len(decoded)} PNG masks to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
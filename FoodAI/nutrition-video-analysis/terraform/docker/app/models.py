@@ -37,6 +37,11 @@ import numpy as np
 print(f"✅ NumPy {np.__version__} imported before PyTorch in models.py")
 
 import torch
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, Any
 from functools import lru_cache
@@ -48,26 +53,227 @@ from sam2.build_sam import build_sam2_video_predictor
 logger = logging.getLogger(__name__)
 
 
+# Declared weight footprints (MB) used to make room before a load; replaced by the measured
+# parameter + buffer size once the model is in memory
+MODEL_FOOTPRINTS_MB = {
+    "florence2": 930,          # Florence-2-base (0.23B params, fp32)
+    "florence2-large": 3100,   # Florence-2-large (0.77B params, fp32)
+    "flan_t5": 310,
+    "sam2": 330,               # sam2.1_hiera_base_plus
+    "groundingdino": 700,      # Swin-T OGC
+    "metric3d": 160,           # metric3d_vit_small
+    "rag": 500,                # sentence embedder + FAISS index + nutrition tables (host RAM)
+}
+
+
+def _torch_modules(model) -> list:
+    """nn.Modules held by a cached value: the value itself, tuple members, or a wrapper's .model"""
+    if isinstance(model, torch.nn.Module):
+        return [model]
+    if isinstance(model, (tuple, list)):
+        return [m for m in model if isinstance(m, torch.nn.Module)]
+    inner = getattr(model, "model", None)
+    return [inner] if isinstance(inner, torch.nn.Module) else []
+
+
+def _measured_footprint_mb(model) -> float:
+    """Parameter + buffer bytes of the torch modules in a cached value (0 when there are none)"""
+    total = 0
+    for module in _torch_modules(model):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total / 1024 ** 2
+
+
 class ModelCache:
-    """Singleton class to cache loaded models"""
+    """
+    Singleton residency manager for loaded models
+    
+    Entries are kept in LRU order. With a memory budget set, loading (or restoring) a model first
+    makes room on its device: least recently used models are offloaded to CPU RAM (CUDA + offload
+    enabled) or dropped, skipping models pinned by a running job. Without a budget nothing is evicted.
+    """
     _instance = None
-    _models = {}
+    _models = OrderedDict()
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance._lock = threading.RLock()
+            cls._instance._pending = {}
+            cls._instance._scopes = threading.local()
+            cls._instance.budget_mb = None
+            cls._instance.offload = True
         return cls._instance
     
+    def configure(self, budget_mb: Optional[float] = None, offload: bool = True):
+        """
+        Args:
+            budget_mb: Max MB of model weights resident on the compute device (None = unbounded)
+            offload: On CUDA, evict by moving weights to CPU RAM instead of dropping the model
+        """
+        with self._lock:
+            self.budget_mb = budget_mb
+            self.offload = offload
+            self._make_room(0)
+    
     def get(self, key: str):
-        return self._models.get(key)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                return None
+            self._models.move_to_end(key)
+            entry['last_used'] = time.time()
+            entry['hits'] += 1
+            self._pin(key)
+            if entry['offloaded']:
+                self._restore(key, entry)
+            return entry['model']
+    
+    def reserve(self, key: str, name: str, device: str, declared_mb: float):
+        """Called by a loader on a cache miss: make room for the declared footprint and start the load clock"""
+        with self._lock:
+            self._pending[key] = {'name': name, 'device': device, 'declared_mb': declared_mb,
+                                  'start': time.perf_counter()}
+            self._make_room(declared_mb, device, keep=key)
     
     def set(self, key: str, model: Any):
-        self._models[key] = model
+        with self._lock:
+            pending = self._pending.pop(key, None) or {'name': key, 'device': 'cpu', 'declared_mb': 0.0, 'start': None}
+            measured_mb = _measured_footprint_mb(model)
+            self._models[key] = {
+                'model': model,
+                'name': pending['name'],
+                'device': pending['device'],
+                'home_device': pending['device'],
+                'footprint_mb': measured_mb or pending['declared_mb'],
+                'declared_mb': pending['declared_mb'],
+                'load_seconds': time.perf_counter() - pending['start'] if pending['start'] else None,
+                'loaded_at': time.time(),
+                'last_used': time.time(),
+                'hits': 0,
+                'offloaded': False,
+                'pins': 0,
+            }
+            self._pin(key)
+            # The measured size can exceed the declared one; the new model itself is never the victim
+            self._make_room(0, pending['device'], keep=key)
+            entry = self._models[key]
+            logger.info(f"Model '{entry['name']}' resident on {entry['device']}: {entry['footprint_mb']:.0f} MB"
+                        + (f", loaded in {entry['load_seconds']:.1f}s" if entry['load_seconds'] is not None else ""))
+    
+    def evict(self, name: str) -> int:
+        """Drop every cached model with this name (e.g. "florence2"); returns how many were dropped"""
+        with self._lock:
+            keys = [key for key, entry in self._models.items() if entry['name'] == name]
+            for key in keys:
+                self._drop(key)
+            return len(keys)
     
     def clear(self):
         """Clear all cached models to free memory"""
-        self._models.clear()
+        with self._lock:
+            self._models.clear()
+            self._pending.clear()
+        torch.cuda.empty_cache()
+    
+    @contextmanager
+    def pin_scope(self):
+        """Models fetched from the cache by this thread inside the block are not evicted until it exits"""
+        pinned = set()
+        stack = getattr(self._scopes, 'stack', None)
+        if stack is None:
+            stack = self._scopes.stack = []
+        stack.append(pinned)
+        try:
+            yield
+        finally:
+            stack.pop()
+            with self._lock:
+                for key in pinned:
+                    entry = self._models.get(key)
+                    if entry is not None:
+                        entry['pins'] -= 1
+    
+    def resident(self) -> list:
+        """Cached models in LRU order (least recently used first), without the model objects"""
+        with self._lock:
+            return [
+                {'key': key, **{field: value for field, value in entry.items() if field != 'model'}}
+                for key, entry in self._models.items()
+            ]
+    
+    def resident_mb(self, device: str) -> float:
+        """MB of model weights currently on device"""
+        with self._lock:
+            return sum(e['footprint_mb'] for e in self._models.values() if e['device'] == device)
+    
+    def _pin(self, key: str):
+        stack = getattr(self._scopes, 'stack', None)
+        if stack and key not in stack[-1]:
+            stack[-1].add(key)
+            self._models[key]['pins'] += 1
+    
+    def _make_room(self, needed_mb: float, device: Optional[str] = None, keep: Optional[str] = None):
+        """
+        Evict LRU models until needed_mb more fits in the budget
+        
+        Args:
+            needed_mb: MB about to be loaded / restored on device
+            device: Device to make room on (None = every device in use)
+            keep: Key that is never evicted (the model being stored or restored)
+        """
+        if self.budget_mb is None:
+            return
+        kept = self._models.get(keep)
+        devices = [device] if device else {entry['device'] for entry in self._models.values()}
+        for dev in devices:
+            kept_mb = kept['footprint_mb'] if kept is not None and kept['device'] == dev else 0.0
+            if kept_mb + needed_mb > self.budget_mb:
+                # Evicting the others cannot make it fit - keep them rather than thrash
+                name = (kept or self._pending.get(keep) or {}).get('name', "model")
+                logger.warning(f"Model '{name}' ({kept_mb + needed_mb:.0f} MB) alone exceeds the "
+                               f"{self.budget_mb} MB budget on {dev}; keeping it resident without evicting others")
+                continue
+            while self.resident_mb(dev) + needed_mb > self.budget_mb:
+                victim = next((key for key, entry in self._models.items()
+                               if entry['device'] == dev and not entry['pins'] and key != keep), None)
+                if victim is None:
+                    logger.warning(f"Model budget {self.budget_mb} MB exceeded on {dev} "
+                                   f"({self.resident_mb(dev) + needed_mb:.0f} MB needed; remaining models are in use)")
+                    break
+                entry = self._models[victim]
+                if self.offload and dev.startswith("cuda") and _torch_modules(entry['model']):
+                    self._offload(victim, entry)
+                else:
+                    self._drop(victim)
+    
+    def _offload(self, key: str, entry: Dict):
+        """Move a model's weights to CPU RAM; it stays cached and is restored on the next get"""
+        for module in _torch_modules(entry['model']):
+            module.to("cpu")
+        entry['device'] = "cpu"
+        entry['offloaded'] = True
         torch.cuda.empty_cache()
+        logger.info(f"Offloaded model '{entry['name']}' to CPU ({entry['footprint_mb']:.0f} MB)")
+    
+    def _restore(self, key: str, entry: Dict):
+        """Move an offloaded model back to its device (making room for it first)"""
+        start = time.perf_counter()
+        self._make_room(entry['footprint_mb'], entry['home_device'], keep=key)
+        for module in _torch_modules(entry['model']):
+            module.to(entry['home_device'])
+        entry['device'] = entry['home_device']
+        entry['offloaded'] = False
+        logger.info(f"Restored model '{entry['name']}' to GPU in {time.perf_counter() - start:.2f}s")
+    
+    def _drop(self, key: str):
+        entry = self._models.pop(key)
+        name, device, footprint_mb = entry['name'], entry['device'], entry['footprint_mb']
+        del entry
+        if device.startswith("cuda"):
+            torch.cuda.empty_cache()
+        logger.info(f"Evicted model '{name}' ({footprint_mb:.0f} MB)")
 
 
 # Global cache instance
@@ -88,9 +294,10 @@ def load_florence2(model_name: str = "microsoft/Florence-2-base-ft", device: str
     cache_key = f"florence2_{model_name}_{device}"
     cached = model_cache.get(cache_key)
     if cached:
-        logger.info(f"Using cached Florence-2 model")
+        logger.debug("Using cached Florence-2 model")
         return cached
     
+    model_cache.reserve(cache_key, "florence2", device, MODEL_FOOTPRINTS_MB["florence2-large" if "large" in model_name.lower() else "florence2"])
     logger.info(f"Loading Florence-2 model: {model_name}...")
     print(f"⏳ Loading Florence-2 model '{model_name}' from HuggingFace...")
     print("   This may take 1-2 minutes (downloading ~1GB)...")
@@ -164,9 +371,10 @@ def load_flan_t5(model_name: str = "google/flan-t5-small", device: str = "cpu")
     cache_key = f"flan_t5_{model_name}_{device}"
     cached = model_cache.get(cache_key)
     if cached:
-        logger.info(f"Using cached FLAN-T5 model")
+        logger.debug("Using cached FLAN-T5 model")
         return cached
     
+    model_cache.reserve(cache_key, "flan_t5", device, MODEL_FOOTPRINTS_MB["flan_t5"])
     logger.info(f"Loading FLAN-T5 model: {model_name}...")
     print(f"⏳ Loading FLAN-T5 model '{model_name}' from HuggingFace...")
     print("   This is a small model (~300MB) for text formatting...")
@@ -204,9 +412,10 @@ def load_sam2(config_path: str, checkpoint_path: str, device: str = "cuda"):
     cache_key = f"sam2_{checkpoint_path}_{device}"
     cached = model_cache.get(cache_key)
     if cached:
-        logger.info("Using cached SAM2 model")
+        logger.debug("Using cached SAM2 model")
         return cached
     
+    model_cache.reserve(cache_key, "sam2", device, MODEL_FOOTPRINTS_MB["sam2"])
     logger.info(f"Loading SAM2 model: {checkpoint_path}...")
     print(f"⏳ Loading SAM2 model from checkpoint...")
     print(f"   Config: {config_path}")
@@ -270,6 +479,63 @@ def load_sam2(config_path: str, checkpoint_path: str, device: str = "cuda"):
     return predictor
 
 
+def load_groundingdino(
+    config_path: str,
+    checkpoint_path: str,
+    device: str = "cuda",
+    msda_impl: str = "auto",
+    msda_compile: bool = False
+):
+    """
+    Load GroundingDINO open-vocabulary detector (vendored in app/grounding_dino)
+    
+    Args:
+        config_path: Path to GroundingDINO config (.py)
+        checkpoint_path: Path to GroundingDINO checkpoint (.pth)
+        device: Device to load model on
+        msda_impl: Deformable-attention kernel ("auto", "cuda", "fused", "pytorch")
+        msda_compile: torch.compile the fused kernel
+        
+    Returns:
+        grounding_dino.groundingdino.util.inference.Model
+    """
+    cache_key = f"groundingdino_{checkpoint_path}_{device}"
+    cached = model_cache.get(cache_key)
+    if cached:
+        logger.debug("Using cached GroundingDINO model")
+        return cached
+    
+    model_cache.reserve(cache_key, "groundingdino", device, MODEL_FOOTPRINTS_MB["groundingdino"])
+    logger.info(f"Loading GroundingDINO model: {checkpoint_path}...")
+    print(f"⏳ Loading GroundingDINO model from checkpoint...")
+    print(f"   Config: {config_path}")
+    print(f"   Checkpoint: {checkpoint_path}")
+    sys.stdout.flush()
+    
+    # Vendored package imports itself as "grounding_dino.groundingdino..." - needs app/ on sys.path
+    app_dir = str(Path(__file__).parent)
+    if app_dir not in sys.path:
+        sys.path.insert(0, app_dir)
+    from grounding_dino.groundingdino.util.inference import Model as GroundingDINOModel
+    from grounding_dino.groundingdino.models.GroundingDINO.ms_deform_attn import set_ms_deform_attn_impl
+    
+    # CPU images don't build the C++/CUDA extension - use the fused grid_sample kernel there
+    set_ms_deform_attn_impl(msda_impl, compile=msda_compile)
+    
+    model = GroundingDINOModel(
+        model_config_path=str(config_path),
+        model_checkpoint_path=str(checkpoint_path),
+        device=device
+    )
+    print("✓ GroundingDINO model loaded")
+    sys.stdout.flush()
+    
+    model_cache.set(cache_key, model)
+    
+    logger.info("✓ GroundingDINO loaded successfully")
+    return model
+
+
 def _find_decoder_recursive(module, visited=None):
     """Recursively find decoder module with get_bins method"""
     if visited is None:
@@ -378,9 +644,10 @@ def load_metric3d(model_name: str = "metric3d_vit_small", device: str = "cuda"):
     cache_key = f"metric3d_{model_name}_{device}"
     cached = model_cache.get(cache_key)
     if cached:
-        logger.info("Using cached Metric3D model")
+        logger.debug("Using cached Metric3D model")
         return cached
     
+    model_cache.reserve(cache_key, "metric3d", device, MODEL_FOOTPRINTS_MB["metric3d"])
     logger.info(f"Loading Metric3D model: {model_name}...")
     
     try:
@@ -450,9 +717,10 @@ def load_nutrition_rag(
     cache_key = "nutrition_rag"
     cached = model_cache.get(cache_key)
     if cached:
-        logger.info("Using cached NutritionRAG system")
+        logger.debug("Using cached NutritionRAG system")
         return cached
     
+    model_cache.reserve(cache_key, "rag", "cpu", MODEL_FOOTPRINTS_MB["rag"])
     logger.info("Loading Nutrition RAG system...")
     
     # Import here to avoid circular dependency
@@ -494,81 +762,132 @@ class ModelManager:
         else:
             self.device = config.DEVICE
         
-        # Models will be loaded on demand
-        self._florence2 = None
-        self._flan_t5 = None
-        self._sam2 = None
-        self._metric3d = None
-        self._rag = None
+        # Models are loaded on demand and owned by model_cache (no references kept here, so an
+        # evicted model is really freed); the cache enforces MODEL_MEMORY_BUDGET_MB
+        model_cache.configure(
+            budget_mb=config.MODEL_MEMORY_BUDGET_MB,
+            offload=config.MODEL_OFFLOAD_TO_CPU
+        )
     
     @property
     def florence2(self):
         """Lazy load Florence-2"""
-        if self._florence2 is None:
-            self._florence2 = load_florence2(
-                model_name=self.config.FLORENCE2_MODEL,
-                device=self.device
-            )
-        return self._florence2
+        return load_florence2(
+            model_name=self.config.FLORENCE2_MODEL,
+            device=self.device
+        )
     
     @property
     def flan_t5(self):
         """Lazy load FLAN-T5 for text formatting"""
-        if self._flan_t5 is None:
-            self._flan_t5 = load_flan_t5(
-                model_name=self.config.FLAN_T5_MODEL,
-                device="cpu"  # Always use CPU for this small model
-            )
-        return self._flan_t5
+        return load_flan_t5(
+            model_name=self.config.FLAN_T5_MODEL,
+            device="cpu"  # Always use CPU for this small model
+        )
     
     @property
     def sam2(self):
         """Lazy load SAM2"""
-        if self._sam2 is None:
-            self._sam2 = load_sam2(
-                config_path=self.config.SAM2_CONFIG,
-                checkpoint_path=self.config.SAM2_CHECKPOINT,
-                device=self.device
-            )
-        return self._sam2
+        return load_sam2(
+            config_path=self.config.SAM2_CONFIG,
+            checkpoint_path=self.config.SAM2_CHECKPOINT,
+            device=self.device
+        )
+    
+    @property
+    def sam2_image(self):
+        """SAM2ImagePredictor sharing the video predictor's weights (single-image jobs)"""
+        from sam2.sam2_image_predictor import SAM2ImagePredictor
+        # Cheap wrapper (transforms + per-image features); built per job so it never outlives an evicted SAM2
+        return SAM2ImagePredictor(self.sam2)
+    
+    @property
+    def groundingdino(self):
+        """Lazy load GroundingDINO (DETECTOR_BACKEND="groundingdino")"""
+        return load_groundingdino(
+            config_path=self.config.GROUNDINGDINO_CONFIG,
+            checkpoint_path=self.config.GROUNDINGDINO_CHECKPOINT,
+            device=self.device,
+            msda_impl=self.config.GROUNDINGDINO_MSDA_IMPL,
+            msda_compile=self.config.GROUNDINGDINO_MSDA_COMPILE
+        )
     
     @property
     def metric3d(self):
         """Lazy load Metric3D"""
-        if self._metric3d is None:
-            self._metric3d = load_metric3d(
-                model_name=self.config.METRIC3D_MODEL,
-                device=self.device
-            )
-        return self._metric3d
+        return load_metric3d(
+            model_name=self.config.METRIC3D_MODEL,
+            device=self.device
+        )
     
     @property
     def rag(self):
         """Lazy load NutritionRAG"""
-        if self._rag is None:
-            self._rag = load_nutrition_rag(
-                pdf_path=self.config.DENSITY_PDF_PATH,
-                fndds_path=self.config.FNDDS_EXCEL_PATH,
-                cofid_path=self.config.COFID_EXCEL_PATH,
-                gemini_api_key=self.config.GEMINI_API_KEY
-            )
-        return self._rag
-    
-    def preload_all(self):
-        """Preload all models (useful for container warmup)"""
-        logger.info("Preloading all models...")
-        _ = self.florence2
-        _ = self.sam2
-        _ = self.metric3d
-        _ = self.rag
+        return load_nutrition_rag(
+            pdf_path=self.config.DENSITY_PDF_PATH,
+            fndds_path=self.config.FNDDS_EXCEL_PATH,
+            cofid_path=self.config.COFID_EXCEL_PATH,
+            gemini_api_key=self.config.GEMINI_API_KEY
+        )
+    
+    def profile_models(self) -> list:
+        """
+        Models the configured pipeline uses (MODEL_PRELOAD overrides)
+        
+        Returns:
+            Model names in load order, e.g. ["sam2", "metric3d", "rag"] with the Gemini detector
+        """
+        if self.config.MODEL_PRELOAD is not None:
+            return list(self.config.MODEL_PRELOAD)
+        names = []
+        if self.config.DETECTOR_BACKEND in ("florence2", "groundingdino"):
+            names.append(self.config.DETECTOR_BACKEND)
+        return names + ["sam2", "metric3d", "rag"]
+    
+    def preload_all(self, names: Optional[list] = None):
+        """Preload the models the configured pipeline uses, or just `names` (useful for container warmup)"""
+        names = self.profile_models() if names is None else list(names)
+        logger.info(f"Preloading models: {', '.join(names)}...")
+        for name in names:
+            getattr(self, name)
         logger.info("✓ All models preloaded")
     
+    @contextmanager
+    def in_use(self):
+        """Keep the models fetched inside the block resident (never offloaded mid-job)"""
+        with model_cache.pin_scope():
+            yield
+    
+    def residency(self) -> Dict:
+        """Resident models with footprints, load times and LRU order (health / debugging)"""
+        models = model_cache.resident()
+        return {
+            'device': self.device,
+            'budget_mb': model_cache.budget_mb,
+            'resident_mb': round(model_cache.resident_mb(self.device), 1),
+            'models': [
+                {
+                    'name': entry['name'],
+                    'device': entry['device'],
+                    'offloaded': entry['offloaded'],
+                    'footprint_mb': round(entry['footprint_mb'], 1),
+                    'load_seconds': round(entry['load_seconds'], 2) if entry['load_seconds'] is not None else None,
+                    'loaded_at': datetime.utcfromtimestamp(entry['loaded_at']).isoformat() + "Z",
+                    'idle_seconds': round(time.time() - entry['last_used'], 1),
+                    'hits': entry['hits'],
+                    'in_use': entry['pins'] > 0,
+                }
+                for entry in models
+            ]
+        }
+    
+    def evict(self, *names: str):
+        """Drop specific models (e.g. "florence2") and keep the rest resident"""
+        for name in names:
+            model_cache.evict(name)
+    
     def clear_cache(self):
         """Clear all cached models"""
-        self._florence2 = None
-        self._sam2 = None
-        self._metric3d = None
-        self._rag = None
         model_cache.clear()
         logger.info("Model cache cleared")
 
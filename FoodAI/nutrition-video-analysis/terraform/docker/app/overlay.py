@@ -0,0 +1,158 @@
+"""
+Segmentation overlay rendering
+Vectorized NumPy/OpenCV compositor for SAM2 masks (replaces per-object matplotlib imshow)
+"""
+import cv2
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# tab20 palette (RGB) - same colors the old matplotlib overlay used
+_TAB20_RGB = np.array([
+    (31, 119, 180), (174, 199, 232), (255, 127, 14), (255, 187, 120),
+    (44, 160, 44), (152, 223, 138), (214, 39, 40), (255, 152, 150),
+    (148, 103, 189), (197, 176, 213), (140, 86, 75), (196, 156, 148),
+    (227, 119, 194), (247, 182, 210), (127, 127, 127), (199, 199, 199),
+    (188, 189, 34), (219, 219, 141), (23, 190, 207), (158, 218, 229),
+], dtype=np.uint8)
+PALETTE_BGR = _TAB20_RGB[:, ::-1].copy()
+
+IMAGE_CONTENT_TYPES = {
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.jpg': 'image/jpeg',
+}
+
+
+def object_color_bgr(index: int) -> Tuple[int, int, int]:
+    """Palette color (BGR) for the index-th object"""
+    b, g, r = PALETTE_BGR[index % len(PALETTE_BGR)]
+    return int(b), int(g), int(r)
+
+
+def build_label_map(masks: Dict[int, np.ndarray], shape: Tuple[int, int]) -> Tuple[np.ndarray, list]:
+    """
+    Merge per-object masks into a single label map
+
+    Args:
+        masks: {obj_id: mask} with 2D (H, W) or 3D (1, H, W) masks
+        shape: (H, W) of the output frame
+
+    Returns:
+        (label_map, obj_ids) where label_map[y, x] = k means obj_ids[k - 1] and 0 is background.
+        Later objects win where masks overlap.
+    """
+    h, w = shape
+    label_map = np.zeros((h, w), dtype=np.uint16)
+    obj_ids = []
+    for obj_id, mask in masks.items():
+        mask_2d = mask[0] if mask.ndim == 3 else mask
+        if mask_2d.shape[:2] != (h, w):
+            mask_2d = cv2.resize(mask_2d.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST)
+        obj_ids.append(obj_id)
+        label_map[mask_2d.astype(bool)] = len(obj_ids)
+    return label_map, obj_ids
+
+
+def composite_overlay(
+    frame_bgr: np.ndarray,
+    masks: Dict[int, np.ndarray],
+    labels: Optional[Dict[int, str]] = None,
+    alpha: float = 0.5,
+    draw_legend: bool = True,
+    colors: Optional[Dict[int, Tuple[int, int, int]]] = None
+) -> np.ndarray:
+    """
+    Blend colored masks onto a frame in one pass
+
+    Builds a label map from all masks, looks colors up from the palette for every
+    pixel at once, alpha-blends only the labelled pixels, then draws a legend
+    with cv2.putText.
+
+    Args:
+        frame_bgr: (H, W, 3) uint8 BGR frame
+        masks: {obj_id: mask}; objects are colored in dict order
+        labels: {obj_id: label} for the legend
+        alpha: Mask opacity
+        draw_legend: Draw "ID{n}: label" entries in the top-left corner
+        colors: Optional fixed {obj_id: BGR} colors (keeps colors stable across video frames)
+
+    Returns:
+        (H, W, 3) uint8 BGR overlay
+    """
+    h, w = frame_bgr.shape[:2]
+    label_map, obj_ids = build_label_map(masks, (h, w))
+    if not obj_ids:
+        return frame_bgr.copy()
+
+    # Row 0 = background; row k = color of obj_ids[k - 1]
+    lut = np.zeros((len(obj_ids) + 1, 3), dtype=np.uint8)
+    obj_colors = [
+        (colors or {}).get(obj_id) or object_color_bgr(i) for i, obj_id in enumerate(obj_ids)
+    ]
+    lut[1:] = obj_colors
+    color_layer = lut[label_map]
+
+    blended = cv2.addWeighted(frame_bgr, 1.0 - alpha, color_layer, alpha, 0)
+    overlay = np.where((label_map > 0)[..., None], blended, frame_bgr)
+
+    if draw_legend and labels:
+        _draw_legend(overlay, [(color, f"ID{obj_id}: {labels.get(obj_id, '')}")
+                               for color, obj_id in zip(obj_colors, obj_ids)])
+    return overlay
+
+
+def _draw_legend(image: np.ndarray, entries: list):
+    """Draw color swatch + text rows in the top-left corner (in place)"""
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    scale = max(0.4, min(image.shape[:2]) / 1200.0)
+    thickness = 1
+    line_h = int(22 * scale / 0.5)
+    swatch = int(line_h * 0.7)
+
+    text_w = max(cv2.getTextSize(text[:50], font, scale, thickness)[0][0] for _, text in entries)
+    box_w = min(image.shape[1], 12 + swatch + 8 + text_w)
+    box_h = min(image.shape[0], 8 + line_h * len(entries))
+
+    # Semi-transparent background box
+    roi = image[0:box_h, 0:box_w]
+    image[0:box_h, 0:box_w] = cv2.addWeighted(roi, 0.3, np.full_like(roi, 255), 0.7, 0)
+
+    for row, (color, text) in enumerate(entries):
+        y = 4 + row * line_h
+        cv2.rectangle(image, (6, y + 2), (6 + swatch, y + 2 + swatch), color, -1)
+        cv2.putText(image, text[:50], (12 + swatch, y + swatch), font, scale, (0, 0, 0),
+                    thickness, cv2.LINE_AA)
+
+
+def write_image(
+    path: Path,
+    image: np.ndarray,
+    image_format: str = "png",
+    png_compression: int = 3,
+    webp_quality: int = 90
+) -> Path:
+    """
+    Encode and save an image with configurable compression
+
+    Args:
+        path: Output path (suffix is replaced to match image_format)
+        image: BGR or single-channel uint8 image
+        image_format: "png" or "webp"
+        png_compression: PNG zlib level 0-9 (lower = faster, larger)
+        webp_quality: WebP quality 1-100 (101 = lossless)
+
+    Returns:
+        Path actually written
+    """
+    image_format = image_format.lower().lstrip('.')
+    if image_format == "webp":
+        path = Path(path).with_suffix(".webp")
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(webp_quality)]
+    else:
+        path = Path(path).with_suffix(".png")
+        params = [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+
+    if not cv2.imwrite(str(path), image, params):
+        raise IOError(f"Failed to write image: {path}")
+    return path
@@ -13,14 +13,27 @@ import logging
 import json
 import sys
 import re
+import threading
 from datetime import datetime
 import os
 import boto3
 
+from app.overlay import IMAGE_CONTENT_TYPES, composite_overlay, object_color_bgr, write_image
+from app.mask_codec import mask_archive_name, save_frame_masks
+from app.timing import NULL_TIMER, StageTimer, timed_stage
+from app.gemini_transport import install_gemini_transport
+from app.sam2_image import SAM2ImageSession
+from app.inference_server import InferenceClient, RemoteImagePredictor
+from app.redetect import RedetectionScheduler
+from app.stage_executor import FrameStageExecutor
+
 logger = logging.getLogger(__name__)
 
 # Initialize S3 client for uploading segmented images
 s3_client = None
+# Background uploader for all jobs in the process (the worker builds a new pipeline per job)
+s3_uploader = None
+_s3_uploader_lock = threading.Lock()
 S3_RESULTS_BUCKET = os.environ.get('S3_RESULTS_BUCKET')
 UPLOAD_SEGMENTED_IMAGES = (os.environ.get('UPLOAD_SEGMENTED_IMAGES', 'true')).strip().lower() == 'true'
 
@@ -67,6 +80,52 @@ class NutritionVideoPipeline:
             
             # Store Florence-2 detection results for debugging
             self.florence_detections = []
+            
+            # Candidate scores from content-aware frame selection (video only)
+            self.frame_selection = None
+            
+            # Process-wide background S3 uploader, set once this pipeline queues an upload
+            self._uploader = None
+            
+            # Florence-2 sessions holding batch-precomputed answers, keyed by id(frame_pil)
+            self._florence_prefetched = {}
+            
+            # Per-job stage timings (replaced by a StageTimer at the start of each job)
+            self.timer = NULL_TIMER
+            
+            # Record/replay interception of all Gemini calls (None when GEMINI_TRANSPORT=live)
+            self.gemini_transport = install_gemini_transport(config)
+            self._gemini_stats_start = None
+            
+            # SAM2 image segmentation / Metric3D depth served (and batched across jobs) by the inference server
+            self.inference_client = None
+            if config.INFERENCE_SERVER_ADDRESS:
+                self.inference_client = InferenceClient(
+                    config.INFERENCE_SERVER_ADDRESS, (config.INFERENCE_SERVER_AUTHKEY or "").encode()
+                )
+    
+    def _start_timer(self, job_id: str):
+        """Begin stage instrumentation for a job"""
+        if self.config.STAGE_TIMING_ENABLED:
+            self.timer = StageTimer(job_id, track_cuda=self.device == "cuda")
+        else:
+            self.timer = NULL_TIMER
+        if self.gemini_transport is not None:
+            self._gemini_stats_start = self.gemini_transport.stats()
+    
+    def _processing_info(self) -> Dict:
+        """processing_info block for results (stage timings, resource peaks, counters)"""
+        info = {}
+        if self.timer is not NULL_TIMER:
+            info['timings'] = self.timer.summary()
+        if self.gemini_transport is not None and self._gemini_stats_start is not None:
+            # This job's share of Gemini calls and time spent in them (network or simulated)
+            end = self.gemini_transport.stats()
+            info['gemini_transport'] = {
+                'mode': self.gemini_transport.mode,
+                **{key: round(end[key] - self._gemini_stats_start[key], 1) for key in end}
+            }
+        return info
     
     def process_image(self, image_path: Path, job_id: str) -> Dict:
         """
@@ -80,6 +139,7 @@ class NutritionVideoPipeline:
             Complete results dictionary with tracking, volumes, and nutrition
         """
         logger.info(f"[{job_id}] Starting image processing: {image_path.name}")
+        self._start_timer(job_id)
 
         try:
             # Load image as a single frame
@@ -98,10 +158,12 @@ class NutritionVideoPipeline:
             img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
             frames = [img]
+            self.timer.count('frames', 1)
             logger.info(f"[{job_id}] Loaded image as single frame")
 
-            # Step 2: Run tracking pipeline with depth
-            tracking_results = self._run_tracking_pipeline(frames, job_id)
+            # Step 2: Run tracking pipeline with depth (its models stay resident until it returns)
+            with self.models.in_use():
+                tracking_results = self._run_tracking_pipeline(frames, job_id)
 
             # Step 3: Analyze nutrition
             print("🍎 Analyzing nutrition...")
@@ -125,11 +187,18 @@ class NutritionVideoPipeline:
                 'status': 'completed'
             }
 
+            # Step 5: Join background S3 uploads and report per-file failures
+            upload_report = self._finish_uploads(job_id)
+            if upload_report is not None:
+                final_results['uploads'] = upload_report
+            final_results['processing_info'] = self._processing_info()
+
             logger.info(f"[{job_id}] ✓ Image processing completed successfully")
             return final_results
 
         except Exception as e:
             logger.error(f"[{job_id}] Image processing failed: {e}", exc_info=True)
+            self._finish_uploads(job_id)
             raise
 
     def process_video(self, video_path: Path, job_id: str) -> Dict:
@@ -144,6 +213,7 @@ class NutritionVideoPipeline:
             Complete results dictionary with tracking, volumes, and nutrition
         """
         logger.info(f"[{job_id}] Starting video processing: {video_path.name}")
+        self._start_timer(job_id)
 
         try:
             # Step 1: Load and prepare frames
@@ -152,9 +222,11 @@ class NutritionVideoPipeline:
                 raise ValueError("No frames loaded from video")
 
             logger.info(f"[{job_id}] Loaded {len(frames)} frames")
+            self.timer.count('frames', len(frames))
 
             # Step 2: Run tracking pipeline with depth (pass video_path for one-shot Gemini video)
-            tracking_results = self._run_tracking_pipeline(frames, job_id, video_path=video_path)
+            with self.models.in_use():
+                tracking_results = self._run_tracking_pipeline(frames, job_id, video_path=video_path)
 
             # Step 3: Analyze nutrition
             nutrition_results = self._analyze_nutrition(tracking_results, job_id)
@@ -166,6 +238,7 @@ class NutritionVideoPipeline:
                 'media_type': 'video',
                 'timestamp': datetime.utcnow().isoformat(),
                 'num_frames_processed': len(frames),
+                'frame_selection': self.frame_selection,
                 'calibration': self.calibration,
                 'florence_detections': self.florence_detections,
                 'tracking': tracking_results,
@@ -181,22 +254,28 @@ class NutritionVideoPipeline:
                 except Exception as e:
                     logger.warning(f"[{job_id}] Segmented video generation failed (non-fatal): {e}", exc_info=True)
 
+            # Step 6: Join background S3 uploads and report per-file failures
+            upload_report = self._finish_uploads(job_id)
+            if upload_report is not None:
+                final_results['uploads'] = upload_report
+            final_results['processing_info'] = self._processing_info()
+
             logger.info(f"[{job_id}] ✓ Processing completed successfully")
             return final_results
 
         except Exception as e:
             logger.error(f"[{job_id}] Pipeline failed: {e}", exc_info=True)
+            self._finish_uploads(job_id)
             raise
     
+    @timed_stage("load_frames")
     def _load_frames(self, video_path: Path) -> List[np.ndarray]:
-        """Load frames from video. If VIDEO_NUM_FRAMES is set, enforce VIDEO_MAX_DURATION_SECONDS and load exactly that many frames evenly spaced."""
-        cap = cv2.VideoCapture(str(video_path))
-        
-        if not cap.isOpened():
-            raise ValueError(f"Could not open video: {video_path}")
+        """Load frames from video. If VIDEO_NUM_FRAMES is set, enforce VIDEO_MAX_DURATION_SECONDS and load exactly that many frames (evenly spaced, or content-selected when FRAME_SELECTION_MODE="content")."""
+        self.frame_selection = None
+        source = self._open_frame_source(video_path)
         
-        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = source.fps or 30.0
+        total_frames = source.total_frames
         duration_sec = total_frames / fps if fps > 0 else 0.0
         
         num_frames_to_load = getattr(self.config, "VIDEO_NUM_FRAMES", None)
@@ -211,19 +290,27 @@ class NutritionVideoPipeline:
                 )
             # Exactly N frames evenly spaced in time (same prompt logic as single image; 5 frames for no-duplicate handling)
             logger.info(f"Video: {fps:.1f}fps, {total_frames} total frames, {duration_sec:.1f}s — loading exactly {num_frames_to_load} frames (window {window_sec:.1f}s)")
+            # Content-aware mode: score a larger evenly spaced pool, keep the sharpest / most diverse
+            use_selection = self.config.FRAME_SELECTION_MODE == "content"
+            num_candidates = num_frames_to_load
+            if use_selection:
+                num_candidates = max(num_frames_to_load, num_frames_to_load * self.config.FRAME_SELECTION_CANDIDATE_FACTOR)
+                if total_frames > 0:
+                    num_candidates = min(num_candidates, total_frames)
+                use_selection = num_candidates > num_frames_to_load
+            target_indices = []
+            for i in range(num_candidates):
+                t_sec = (i / max(1, num_candidates - 1)) * max(0.0, window_sec - 0.001)
+                target_indices.append(min(int(t_sec * fps), total_frames - 1) if total_frames > 0 else 0)
+            # One sequential pass (no per-frame seeks); duplicates in target_indices reuse the decoded frame
+            decoded = dict(source.iter_frames(indices=target_indices))
             frames = []
-            for i in range(num_frames_to_load):
-                t_sec = (i / max(1, num_frames_to_load - 1)) * max(0.0, window_sec - 0.001)
-                frame_idx = min(int(t_sec * fps), total_frames - 1) if total_frames > 0 else 0
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                ret, frame = cap.read()
-                if not ret:
+            for frame_idx in target_indices:
+                if frame_idx not in decoded:
                     break
-                aspect_ratio = frame.shape[0] / frame.shape[1]
-                new_height = int(self.config.RESIZE_WIDTH * aspect_ratio)
-                frame_resized = cv2.resize(frame, (self.config.RESIZE_WIDTH, new_height))
-                frames.append(cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB))
-            cap.release()
+                frames.append(decoded[frame_idx])
+            if use_selection and len(frames) > num_frames_to_load:
+                frames = self._select_informative_frames(frames, target_indices[:len(frames)], num_frames_to_load, fps)
             if len(frames) != num_frames_to_load:
                 if len(frames) >= 1:
                     logger.warning(
@@ -236,32 +323,49 @@ class NutritionVideoPipeline:
         logger.info(f"Video: {fps:.1f}fps, {total_frames} total frames")
         logger.info(f"Processing every {self.config.FRAME_SKIP} frames")
         
-        frames = []
-        frame_idx = 0
-        frames_loaded = 0
-        
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_idx % self.config.FRAME_SKIP == 0:
-                # Resize frame
-                aspect_ratio = frame.shape[0] / frame.shape[1]
-                new_height = int(self.config.RESIZE_WIDTH * aspect_ratio)
-                frame_resized = cv2.resize(frame, (self.config.RESIZE_WIDTH, new_height))
-                frames.append(cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB))
-                frames_loaded += 1
-                
-                # Check max_frames limit
-                if self.config.MAX_FRAMES and frames_loaded >= self.config.MAX_FRAMES:
-                    break
-            
-            frame_idx += 1
-        
-        cap.release()
-        return frames
+        # Skipped frames are grabbed but never retrieved/converted
+        return [
+            frame for _, frame in source.iter_frames(
+                step=self.config.FRAME_SKIP,
+                max_frames=self.config.MAX_FRAMES or None
+            )
+        ]
+    
+    def _select_informative_frames(self, frames: List[np.ndarray], frame_indices: List[int], num_frames: int, fps: float) -> List[np.ndarray]:
+        """Keep the num_frames sharpest, most diverse candidates (temporal order preserved); scores go to results"""
+        from app.frame_selection import select_informative_frames
+        
+        selected, scores = select_informative_frames(
+            frames,
+            num_frames,
+            diversity_weight=self.config.FRAME_SELECTION_DIVERSITY_WEIGHT,
+            motion_penalty=self.config.FRAME_SELECTION_MOTION_PENALTY,
+            always_include=[0]  # _generate_segmented_video prompts SAM2 with frame-0 boxes on video frame 0
+        )
+        for score, frame_idx in zip(scores, frame_indices):
+            score['frame_index'] = frame_idx
+            score['time_sec'] = round(frame_idx / fps, 3) if fps > 0 else 0.0
+        self.frame_selection = {
+            'method': 'content',
+            'num_candidates': len(frames),
+            'selected_frame_indices': [frame_indices[i] for i in selected],
+            'candidates': scores
+        }
+        logger.info(f"Frame selection: kept frames {self.frame_selection['selected_frame_indices']} of {len(frames)} candidates")
+        return [frames[i] for i in selected]
     
+    def _open_frame_source(self, video_path: Path):
+        """Frame source shared by _load_frames and _generate_segmented_video (same decoder + resize)"""
+        from app.frame_source import VideoFrameSource
+        source = VideoFrameSource(
+            video_path,
+            resize_width=self.config.RESIZE_WIDTH,
+            backend=self.config.VIDEO_DECODE_BACKEND
+        )
+        logger.info(f"Video decode backend: {source.backend}")
+        return source
+    
+    @timed_stage("tracking")
     def _run_tracking_pipeline(self, frames: List[np.ndarray], job_id: str, video_path: Optional[Path] = None) -> Dict:
         """
         Run complete tracking pipeline with depth estimation.
@@ -305,35 +409,43 @@ class NutritionVideoPipeline:
             else:
                 logger.warning(f"[{job_id}] Gemini video one-shot failed; continuing with no detections (no frame-wise fallback)")
         
-        # Get models (Florence only when not using Gemini for detection)
+        # Get models (Florence only when it is the detector backend)
         florence_processor, florence_model = None, None
-        if not self.config.USE_GEMINI_DETECTION:
+        if self.config.DETECTOR_BACKEND == "florence2":
             florence_processor, florence_model = self.models.florence2
-        video_predictor = self.models.sam2
-        metric3d_model = self.models.metric3d
+        # Single image: SAM2ImagePredictor session (one encoder pass, boxes decoded as one batch, no temp frames)
+        use_image_predictor = (
+            video_path is None and len(frames) == 1 and self.config.SAM2_IMAGE_FAST_PATH
+            and hasattr(type(self.models), "sam2_image")
+        )
+        if use_image_predictor:
+            image_predictor = (
+                RemoteImagePredictor(self.inference_client) if self.inference_client is not None
+                else self.models.sam2_image
+            )
+            video_predictor = SAM2ImageSession(image_predictor, frames[0])
+        else:
+            video_predictor = self.models.sam2
+        metric3d_model = self.inference_client if self.inference_client is not None else self.models.metric3d
         
-        # Prepare frame directory for SAM2
+        # Frame directory for SAM2: written on first SAM2 use (mass-first jobs may never need it).
+        # The inference state is (re)initialized at every detection frame that adds objects.
         frame_dir = self.config.OUTPUT_DIR / job_id / "frames_temp"
-        frame_dir.mkdir(parents=True, exist_ok=True)
+        frames_saved = False
+        inference_state = None
         
-        # Save frames
-        for idx, frame in enumerate(frames):
-            frame_path = frame_dir / f"{idx:05d}.jpg"
-            Image.fromarray(frame).save(frame_path)
+        # Mass-first: objects with Gemini grams skip masks / depth / volume unless masks are wanted
+        masks_requested = self.config.MASS_FIRST_KEEP_MASKS or bool(S3_RESULTS_BUCKET and UPLOAD_SEGMENTED_IMAGES)
+        mass_first = self.config.MASS_FIRST_MODE and not masks_requested
+        geometry_skipped_ids = set()
         
-        # Initialize SAM2 inference state
-        print("📦 Initializing SAM2 inference state...")
-        sys.stdout.flush()
-        try:
-            inference_state = video_predictor.init_state(video_path=str(frame_dir))
-            print("✓ SAM2 state initialized")
-            sys.stdout.flush()
-        except Exception as e:
-            print(f"❌ SAM2 init failed: {e}")
-            import traceback
-            traceback.print_exc()
-            sys.stdout.flush()
-            raise
+        # Which frames run the detector (fixed interval or tracking-health driven)
+        scheduler = RedetectionScheduler.from_config(self.config)
+        
+        # Depth branch of a detection frame runs concurrently with SAM2
+        stage_executor = FrameStageExecutor(
+            self.device, enabled=self.config.DEPTH_CONCURRENT, depth_threads=self.config.DEPTH_THREADS
+        )
         
         # Tracking state
         tracked_objects = {}
@@ -341,10 +453,28 @@ class NutritionVideoPipeline:
         colors = {}
         volume_history = {}
         video_segments = {}  # Store SAM2 masks for all frames
+        mask_files = []  # Per-frame mask file references for results
         sam2_to_obj_id = {}  # Map SAM2's internal IDs to our persistent obj_ids
         current_window_start = 0
         caption = None  # Store the caption from Florence-2
         
+        # Batch Florence-2 over all re-detection frames up front (answers are replayed in the loop)
+        florence_frames = {}
+        if (self.config.DETECTOR_BACKEND == "florence2" and not self.config.USE_GEMINI_DETECTION
+                and self.config.FLORENCE2_BATCH_SIZE > 1):
+            planned_frames = set(scheduler.planned_frames(len(frames)))
+            florence_frames = {
+                idx: Image.fromarray(frame)
+                for idx, frame in enumerate(frames)
+                if idx in planned_frames
+            }
+            try:
+                self._prefetch_florence_detections(list(florence_frames.values()), florence_processor, florence_model, job_id)
+            except Exception as e:
+                # Per-frame detection below still works without the precomputed answers
+                logger.warning(f"[{job_id}] Batched Florence-2 detection failed, falling back to per-frame: {e}")
+                self._florence_prefetched = {}
+        
         # Process frames
         print(f"\n📹 Processing {len(frames)} frame(s)...")
         sys.stdout.flush()
@@ -355,10 +485,13 @@ class NutritionVideoPipeline:
                 print(f"\n🖼️  Frame {frame_idx+1}/{len(frames)}")
                 sys.stdout.flush()
                 
-                frame_pil = Image.fromarray(frame)
+                frame_pil = florence_frames[frame_idx] if frame_idx in florence_frames else Image.fromarray(frame)
                 
-                # Periodic re-detection
-                if frame_idx % self.config.DETECTION_INTERVAL == 0:
+                # Re-detection (one-shot video: frame 0 only; otherwise as scheduled)
+                if (frame_idx == 0) if is_video_one_shot_mode else scheduler.should_detect(frame_idx):
+                    if is_video_one_shot_mode:
+                        scheduler.record(frame_idx, "one-shot video detection")
+                    scheduler.detected(frame_idx, frame)
                     # Video: one-shot only — use precomputed detections at frame 0; never run frame-wise Gemini
                     detection_grams_list = []
                     if is_video_one_shot_mode and (frame_idx > 0 or initial_video_detections is None):
@@ -404,6 +537,8 @@ class NutritionVideoPipeline:
                         logger.info(f"[{job_id}] Frame {frame_idx}: Re-detecting objects...")
                         if self.config.USE_GEMINI_DETECTION:
                             print(f"🔍 Detecting objects in frame {frame_idx} (Gemini image understanding)...")
+                        elif self.config.DETECTOR_BACKEND == "groundingdino":
+                            print(f"🔍 Detecting objects in frame {frame_idx} (GroundingDINO, local)...")
                         else:
                             print(f"🔍 Detecting objects in frame {frame_idx}... (this may take 30-60 seconds on CPU)")
                         sys.stdout.flush()
@@ -412,6 +547,12 @@ class NutritionVideoPipeline:
                                 boxes, labels, detected_caption, unquantified_ingredients, detection_grams_list, detection_quantity_list = self._detect_objects_gemini(
                                     frame_pil, job_id
                                 )
+                            elif self.config.DETECTOR_BACKEND == "groundingdino":
+                                boxes, labels, detected_caption, unquantified_ingredients = self._detect_objects_groundingdino(
+                                    frame, job_id
+                                )
+                                detection_grams_list = []
+                                detection_quantity_list = [1] * len(labels)
                             else:
                                 boxes, labels, detected_caption, unquantified_ingredients = self._detect_objects_florence(
                                     frame_pil, florence_processor, florence_model
@@ -431,7 +572,7 @@ class NutritionVideoPipeline:
                         logger.info(f"[{job_id}] Frame {frame_idx}: Detected {len(boxes)} objects: {labels}")
                     
                     # Use Gemini to format VQA answer and filter non-food items (only when using Florence-2)
-                    if not self.config.USE_GEMINI_DETECTION and self.config.GEMINI_API_KEY and len(labels) > 0:
+                    if self.config.DETECTOR_BACKEND == "florence2" and self.config.GEMINI_API_KEY and len(labels) > 0:
                         filtered_boxes, filtered_labels, formatted_answer = self._format_and_filter_with_gemini(
                             boxes, labels, detected_caption, job_id, frame_idx
                         )
@@ -506,12 +647,6 @@ class NutritionVideoPipeline:
                         
                         logger.info(f"[{job_id}] Frame {frame_idx}: Matched {len(matched_mapping)} objects, {len(unmatched_new)} new objects")
                         
-                        # Reset SAM2 state
-                        inference_state = video_predictor.init_state(video_path=str(frame_dir))
-                        video_segments = {}  # Reset video segments when SAM2 resets
-                        sam2_to_obj_id = {}  # Reset SAM2 ID mapping
-                        current_window_start = frame_idx
-                        
                         # Update tracked objects
                         boxes_to_add = []
                         ids_to_add = []
@@ -565,6 +700,40 @@ class NutritionVideoPipeline:
                             ids_to_add.append(obj_id)
                             logger.info(f"[{job_id}] Frame {frame_idx}: Added NEW object ID{obj_id} ('{labels[new_idx]}') - no spatial overlap with existing objects")
                         
+                        # Mass-first: only objects without Gemini grams need SAM2 masks, depth and volume
+                        if mass_first:
+                            needs_geometry = [not tracked_objects[obj_id].get('gemini_grams') for obj_id in ids_to_add]
+                            skipped = [obj_id for obj_id, needed in zip(ids_to_add, needs_geometry) if not needed]
+                            boxes_to_add = [box for box, needed in zip(boxes_to_add, needs_geometry) if needed]
+                            ids_to_add = [obj_id for obj_id, needed in zip(ids_to_add, needs_geometry) if needed]
+                            if skipped:
+                                geometry_skipped_ids.update(skipped)
+                                self.timer.count('geometry_skipped', len(skipped))
+                                logger.info(f"[{job_id}] Frame {frame_idx}: Mass-first: skipping geometry for {len(skipped)} object(s) sized by Gemini, {len(ids_to_add)} still need volume")
+                            if not ids_to_add:
+                                # Nothing to measure: no SAM2, no Metric3D (calibration keeps its defaults)
+                                if self.calibration['pixels_per_cm'] is None:
+                                    self.calibration['pixels_per_cm'] = self.config.DEFAULT_PIXELS_PER_CM
+                                continue
+                        
+                        # Depth only needs the RGB frame: start it now, join at the volume step
+                        depth_future = stage_executor.submit(self._estimate_depth_metric3d, frame, metric3d_model)
+                        
+                        # Reset SAM2 state (frames are written on first use)
+                        if not frames_saved and not use_image_predictor:
+                            frame_dir.mkdir(parents=True, exist_ok=True)
+                            for idx, frame_to_save in enumerate(frames):
+                                Image.fromarray(frame_to_save).save(frame_dir / f"{idx:05d}.jpg")
+                            frames_saved = True
+                        print("📦 Initializing SAM2 inference state...")
+                        sys.stdout.flush()
+                        with self.timer.span("sam2_init", frames=len(frames)):
+                            inference_state = video_predictor.init_state(video_path=str(frame_dir))
+                        video_segments = {}  # Reset video segments when SAM2 resets
+                        sam2_to_obj_id = {}  # Reset SAM2 ID mapping
+                        # init_state loads every frame of frame_dir, so SAM2 frame indices are clip frame indices
+                        current_window_start = 0
+                        
                         # Add objects to SAM2 with sequential SAM2 IDs (1, 2, 3...)
                         successfully_added = []
                         sam2_id = 1  # SAM2 uses sequential IDs starting from 1
@@ -604,12 +773,13 @@ class NutritionVideoPipeline:
                         logger.info(f"[{job_id}] Frame {frame_idx}: Added {len(successfully_added)}/{len(ids_to_add)} objects to SAM2. Successfully added IDs: {successfully_added}")
                         
                         # Get masks for the current detection frame only (optimization)
-                        relative_idx = 0  # Detection happens at start of window
+                        relative_idx = frame_idx - current_window_start
                         logger.info(f"[{job_id}] Frame {frame_idx}: Getting SAM2 masks for detection frame...")
                         try:
-                            out_frame_idx, sam2_obj_ids, out_mask_logits = video_predictor.infer_single_frame(
-                                inference_state, relative_idx
-                            )
+                            with self.timer.span("sam2_masks", objects=len(successfully_added)):
+                                out_frame_idx, sam2_obj_ids, out_mask_logits = video_predictor.infer_single_frame(
+                                    inference_state, relative_idx
+                                )
                             # Map SAM2's IDs back to our persistent obj_ids
                             video_segments[relative_idx] = {}
                             for i, sam2_id in enumerate(sam2_obj_ids):
@@ -625,7 +795,7 @@ class NutritionVideoPipeline:
                         # Calibration (if not already calibrated)
                         if not self.calibration['calibrated']:
                             logger.info(f"[{job_id}] Frame {frame_idx}: Performing calibration...")
-                            depth_map_meters = self._estimate_depth_metric3d(frame, metric3d_model)
+                            depth_map_meters = stage_executor.join(depth_future)
                             self.calibration['pixels_per_cm'] = self.config.DEFAULT_PIXELS_PER_CM
                             scene_depths = depth_map_meters[depth_map_meters > 0]
                             if len(scene_depths) > 0:
@@ -636,37 +806,61 @@ class NutritionVideoPipeline:
                             logger.info(f"[{job_id}] Calibration: {self.calibration['pixels_per_cm']:.2f} px/cm, reference plane at {self.calibration['reference_plane_depth_m']:.3f}m")
                         else:
                             # Already calibrated, get depth for this frame
-                            depth_map_meters = self._estimate_depth_metric3d(frame, metric3d_model)
+                            depth_map_meters = stage_executor.join(depth_future)
                         
                         # Calculate volumes for objects in the detection frame
                         if relative_idx in video_segments:
                             # Collect masks for saving/uploading
-                            masks_dict = {}
-                            for obj_id in video_segments[relative_idx]:
-                                if obj_id in tracked_objects:
-                                    mask = video_segments[relative_idx][obj_id][0]
-                                    box = tracked_objects[obj_id]['box']
-                                    label = tracked_objects[obj_id]['label']
-                                    
-                                    # Store mask for saving
-                                    masks_dict[obj_id] = mask
-                                    
-                                    volume_metrics = self._calculate_volume_metric3d(mask, depth_map_meters, box, label)
-                                    
-                                    if obj_id not in volume_history:
-                                        volume_history[obj_id] = []
-                                    volume_history[obj_id].append({
-                                        'frame': frame_idx,
-                                        'volume_ml': volume_metrics['volume_ml'],
-                                        'height_cm': volume_metrics['avg_height_cm'],
-                                        'area_cm2': volume_metrics['surface_area_cm2'],
-                                        'diameter_cm': volume_metrics.get('diameter_cm', 0.0)  # Store for batch validation
-                                    })
-                                    logger.info(f"[{job_id}] Frame {frame_idx}: ID{obj_id} ({label}) volume={volume_metrics['volume_ml']:.1f}ml")
+                            masks_dict = {
+                                obj_id: video_segments[relative_idx][obj_id][0]
+                                for obj_id in video_segments[relative_idx]
+                                if obj_id in tracked_objects
+                            }
+                            scheduler.detected(frame_idx, frame, masks_dict)
+                            # All objects of the frame in one batched pass over the depth map
+                            frame_volumes = self._calculate_volumes_metric3d(
+                                masks_dict, depth_map_meters,
+                                {obj_id: tracked_objects[obj_id]['label'] for obj_id in masks_dict}
+                            )
+                            for obj_id, volume_metrics in frame_volumes.items():
+                                label = tracked_objects[obj_id]['label']
+                                
+                                if obj_id not in volume_history:
+                                    volume_history[obj_id] = []
+                                volume_history[obj_id].append({
+                                    'frame': frame_idx,
+                                    'volume_ml': volume_metrics['volume_ml'],
+                                    'height_cm': volume_metrics['avg_height_cm'],
+                                    'area_cm2': volume_metrics['surface_area_cm2'],
+                                    'diameter_cm': volume_metrics.get('diameter_cm', 0.0)  # Store for batch validation
+                                })
+                                logger.info(f"[{job_id}] Frame {frame_idx}: ID{obj_id} ({label}) volume={volume_metrics['volume_ml']:.1f}ml")
                             
                             # Save and upload segmented images to S3
                             if masks_dict:
-                                self._save_segmentation_masks(frame, masks_dict, tracked_objects, frame_idx, job_id)
+                                mask_files.append(
+                                    self._save_segmentation_masks(frame, masks_dict, tracked_objects, frame_idx, job_id)
+                                )
+                
+                elif scheduler.adaptive and not is_video_one_shot_mode and inference_state is not None and sam2_to_obj_id:
+                    # Tracking-health signals for the scheduler: propagate the SAM2 masks to this frame
+                    sam2_frame_idx = frame_idx - current_window_start
+                    try:
+                        with self.timer.span("sam2_track", objects=len(sam2_to_obj_id)):
+                            _, sam2_obj_ids, out_mask_logits = video_predictor.infer_single_frame(
+                                inference_state, sam2_frame_idx
+                            )
+                        tracked_masks = {
+                            sam2_to_obj_id[sam2_id]: (out_mask_logits[i] > 0.0).cpu().numpy()[0]
+                            for i, sam2_id in enumerate(sam2_obj_ids)
+                            if sam2_id in sam2_to_obj_id
+                        }
+                        object_scores = self._sam2_object_scores(inference_state, sam2_frame_idx, sam2_obj_ids, sam2_to_obj_id)
+                        reason = scheduler.observe(frame_idx, frame, tracked_masks, object_scores)
+                        if reason:
+                            logger.info(f"[{job_id}] Frame {frame_idx}: Re-detection requested ({reason})")
+                    except Exception as e:
+                        logger.warning(f"[{job_id}] Frame {frame_idx}: SAM2 tracking step failed, waiting for the next scheduled detection: {e}")
             
             # No additional processing needed - volumes calculated at each detection frame
             
@@ -679,6 +873,9 @@ class NutritionVideoPipeline:
             traceback.print_exc()
             sys.stdout.flush()
             raise
+        finally:
+            self._florence_prefetched = {}
+            stage_executor.shutdown()
         
         # Final deduplication: merge tracked objects that are duplicates
         tracked_objects = self._deduplicate_tracked_objects(tracked_objects, volume_history)
@@ -689,8 +886,11 @@ class NutritionVideoPipeline:
         results = {
             'objects': {},
             'total_objects': len(tracked_objects),
-            'caption': caption  # Include the Florence-2 caption
+            'caption': caption,  # Include the Florence-2 caption
+            'mask_files': mask_files,
+            'redetection': scheduler.summary()
         }
+        self.timer.count('detections', len(scheduler.decisions))
         
         # Compile results for ALL objects that have volume history (not just current tracked_objects)
         # This ensures we don't lose objects from previous SAM2 windows
@@ -767,6 +967,12 @@ class NutritionVideoPipeline:
                     'gemini_quantity': gemini_quantity
                 })
         
+        # Mass-first objects: volume is not used for nutrition (grams are), so keep the box-area estimate
+        # and leave them out of the Gemini estimation call
+        mass_first_ids = {item['obj_id'] for item in untracked_items if item['obj_id'] in geometry_skipped_ids and item['gemini_grams_g']}
+        mass_first_items = [item for item in untracked_items if item['obj_id'] in mass_first_ids]
+        untracked_items = [item for item in untracked_items if item['obj_id'] not in mass_first_ids]
+        
         # Batch process: Validate calculated volumes + Estimate untracked volumes in ONE Gemini call
         if self.config.GEMINI_API_KEY and (items_for_validation or untracked_items):
             validated_and_estimated = self._batch_validate_and_estimate_volumes_with_gemini(
@@ -811,11 +1017,12 @@ class NutritionVideoPipeline:
             results['objects'][f"ID{obj_id}_{label}"] = obj_entry
         
         # Add untracked items with estimated volumes to results
-        for item in untracked_items:
+        for item in untracked_items + mass_first_items:
             obj_id = item['obj_id']
             label = item['label']
             area_cm2 = item['area_cm2']
             estimated_volume_ml = estimated_volumes.get(obj_id, area_cm2 * 2.0)
+            mass_first_item = obj_id in mass_first_ids
             
             logger.info(f"[{job_id}] Object ID{obj_id} ('{label}') detected but no volume calculated - using estimated volume {estimated_volume_ml:.1f}ml")
             
@@ -827,7 +1034,7 @@ class NutritionVideoPipeline:
                 'max_area_cm2': float(area_cm2),
                 'num_frames': 1,
                 'estimated': True,  # Flag to indicate this is an estimate
-                'estimation_method': 'gemini' if self.config.GEMINI_API_KEY else 'fallback'
+                'estimation_method': 'mass_first' if mass_first_item else ('gemini' if self.config.GEMINI_API_KEY else 'fallback')
             }
             if item.get('gemini_grams_g') is not None and item['gemini_grams_g'] > 0:
                 stats['gemini_grams_g'] = float(item['gemini_grams_g'])
@@ -845,8 +1052,24 @@ class NutritionVideoPipeline:
         
         logger.info(f"[{job_id}] Tracked {len(results['objects'])} objects across all frames ({len(objects_with_volume)} with calculated volumes, {len(results['objects']) - len(objects_with_volume)} with estimated volumes)")
         results['total_objects'] = len(results['objects'])
+        self.timer.count('objects', results['total_objects'])
         return results
     
+    @staticmethod
+    def _sam2_object_scores(inference_state, sam2_frame_idx, sam2_obj_ids, sam2_to_obj_id) -> Optional[Dict]:
+        """SAM2 object score logits of a propagated frame by obj_id (None if the predictor does not expose them)"""
+        try:
+            frame_out = inference_state["output_dict"]["non_cond_frame_outputs"][sam2_frame_idx]
+            logits = frame_out["object_score_logits"].reshape(-1).float().cpu().numpy()
+        except (KeyError, TypeError, AttributeError):
+            return None
+        return {
+            sam2_to_obj_id[sam2_id]: float(logits[i])
+            for i, sam2_id in enumerate(sam2_obj_ids)
+            if sam2_id in sam2_to_obj_id and i < len(logits)
+        }
+    
+    @timed_stage("deduplication")
     def _deduplicate_tracked_objects(self, tracked_objects, volume_history):
         """Remove duplicate tracked objects with same label and overlapping boxes"""
         if len(tracked_objects) <= 1:
@@ -931,6 +1154,7 @@ class NutritionVideoPipeline:
         
         return result
     
+    @timed_stage("detection")
     def _detect_objects_gemini(self, image_pil, job_id: str):
         """
         Detect food objects using Gemini image understanding (same structure as gemini/test_gemini_analysis).
@@ -973,6 +1197,7 @@ class NutritionVideoPipeline:
                 print(f"  → Calling Gemini for food detection ({model_name})...")
                 sys.stdout.flush()
                 gemini_model = genai.GenerativeModel(model_name)
+                self.timer.count('gemini_calls')
                 response = gemini_model.generate_content([prompt, image_pil])
                 response_text = response.text or ""
                 if response_text:
@@ -1040,6 +1265,7 @@ class NutritionVideoPipeline:
         sys.stdout.flush()
         return boxes, labels, caption, [], grams_list, quantity_list
     
+    @timed_stage("detection")
     def _detect_objects_gemini_multi_image(self, frames_list: List[np.ndarray], job_id: str):
         """
         Detect food objects using Gemini with multiple images (5 frames) in one prompt.
@@ -1096,6 +1322,7 @@ class NutritionVideoPipeline:
                 try:
                     print(f"  → Calling Gemini multi-image for food detection ({model_name}), 5 frames (no duplicates)...")
                     sys.stdout.flush()
+                    self.timer.count('gemini_calls')
                     response = client.models.generate_content(
                         model=model_name,
                         contents=types.Content(parts=parts),
@@ -1186,6 +1413,7 @@ class NutritionVideoPipeline:
     _GEMINI_VIDEO_REF_H = 720
     _GEMINI_VIDEO_INLINE_LIMIT = 20 * 1024 * 1024  # 20 MB
     
+    @timed_stage("detection")
     def _detect_objects_gemini_video(self, video_path: Path, job_id: str):
         """
         One-shot Gemini video understanding: call Gemini video API once for the whole clip.
@@ -1230,6 +1458,7 @@ class NutritionVideoPipeline:
                     ]
                     for model_name in video_models_try:
                         try:
+                            self.timer.count('gemini_calls')
                             response = client.models.generate_content(
                                 model=model_name,
                                 contents=types.Content(parts=parts),
@@ -1246,6 +1475,7 @@ class NutritionVideoPipeline:
                     myfile = client.files.upload(file=str(video_path))
                     for model_name in video_models_try:
                         try:
+                            self.timer.count('gemini_calls')
                             response = client.models.generate_content(
                                 model=model_name,
                                 contents=[myfile, prompt],
@@ -1352,6 +1582,178 @@ class NutritionVideoPipeline:
         sys.stdout.flush()
         return (np.array(boxes, dtype=np.float32), labels, caption, grams_list, quantity_list, (self._GEMINI_VIDEO_REF_W, self._GEMINI_VIDEO_REF_H))
     
+    def _groundingdino_vocabulary(self) -> List[str]:
+        """Food classes for GroundingDINO (FOOD_VOCABULARY_PATH file, else FOOD_VOCABULARY)"""
+        vocab_path = self.config.FOOD_VOCABULARY_PATH
+        if vocab_path and Path(vocab_path).exists():
+            classes = [line.strip() for line in Path(vocab_path).read_text(encoding="utf-8").splitlines()]
+        else:
+            classes = list(self.config.FOOD_VOCABULARY)
+        # GroundingDINO matches lowercase phrases; drop blanks/duplicates, keep order
+        return list(dict.fromkeys(c.lower() for c in classes if c and c.strip()))
+    
+    def _groundingdino_prompt_chunks(self, gdino_model, classes: List[str]) -> List[List[str]]:
+        """
+        Split the vocabulary into prompts that each tokenize under GROUNDINGDINO_MAX_TEXT_TOKENS
+        (the text encoder truncates longer captions, silently dropping classes)
+        """
+        cache_key = (tuple(classes), self.config.GROUNDINGDINO_MAX_TEXT_TOKENS)
+        cached = getattr(self, '_gdino_chunk_cache', None)
+        if cached and cached[0] == cache_key:
+            return cached[1]
+        
+        tokenizer = getattr(getattr(gdino_model, 'model', None), 'tokenizer', None)
+        
+        def num_tokens(chunk):
+            caption = ". ".join(chunk) + "."
+            if tokenizer is not None:
+                return len(tokenizer(caption)["input_ids"])  # Includes [CLS]/[SEP]
+            return 2 + sum(len(c.split()) * 2 + 1 for c in chunk)  # Conservative word-piece estimate
+        
+        max_tokens = self.config.GROUNDINGDINO_MAX_TEXT_TOKENS
+        chunks = []
+        current = []
+        for cls in classes:
+            if current and num_tokens(current + [cls]) > max_tokens:
+                chunks.append(current)
+                current = []
+            current.append(cls)
+        if current:
+            chunks.append(current)
+        
+        self._gdino_chunk_cache = (cache_key, chunks)
+        return chunks
+    
+    @staticmethod
+    def _groundingdino_class(phrase: str, classes: List[str]) -> Optional[str]:
+        """Vocabulary class for a predicted phrase: exact match, else the longest class contained in it"""
+        phrase = phrase.strip().lower()
+        if phrase in classes:
+            return phrase
+        contained = [cls for cls in classes if cls in phrase]
+        return max(contained, key=len) if contained else None
+    
+    @timed_stage("detection")
+    def _detect_objects_groundingdino(self, frame_rgb: np.ndarray, job_id: str):
+        """
+        Detect food items locally with GroundingDINO against the food vocabulary (DETECTOR_BACKEND="groundingdino").
+        Returns the same (boxes, labels, caption, unquantified_ingredients) tuple as _detect_objects_florence.
+        """
+        gdino = self.models.groundingdino
+        classes = self._groundingdino_vocabulary()
+        chunks = self._groundingdino_prompt_chunks(gdino, classes)
+        frame_bgr = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)  # Model.preprocess_image expects BGR
+        
+        all_boxes = []
+        all_labels = []
+        all_scores = []
+        with torch.inference_mode():
+            for chunk in chunks:
+                # Same caption as predict_with_classes, but phrases are mapped here: its phrases2classes
+                # takes the first class contained in the phrase ("rice" for "fried rice")
+                detections, phrases = gdino.predict_with_caption(
+                    image=frame_bgr,
+                    caption=". ".join(chunk),
+                    box_threshold=self.config.GROUNDINGDINO_BOX_THRESHOLD,
+                    text_threshold=self.config.GROUNDINGDINO_TEXT_THRESHOLD
+                )
+                for box, phrase, score in zip(detections.xyxy, phrases, detections.confidence):
+                    label = self._groundingdino_class(phrase, chunk)
+                    if label is None:
+                        continue  # Phrase didn't map back to a vocabulary class
+                    all_boxes.append(np.asarray(box, dtype=np.float32))
+                    all_labels.append(label)
+                    all_scores.append(float(score))
+        
+        logger.info(f"[{job_id}] GroundingDINO: {len(all_boxes)} raw detections over {len(chunks)} prompt(s) ({len(classes)} classes)")
+        if not all_boxes:
+            return np.array([]), [], "GroundingDINO: no food items detected", []
+        
+        # Highest-confidence first so dedup keeps the best box per item
+        order = np.argsort(all_scores)[::-1]
+        boxes, labels = self._deduplicate_detections(
+            [all_boxes[i] for i in order], [all_labels[i] for i in order]
+        )
+        caption = f"GroundingDINO: {', '.join(dict.fromkeys(labels))}"
+        return boxes, labels, caption, []
+    
+    def _florence_batch_plan(self):
+        """
+        Task steps _detect_objects_florence runs for the current caption_type that can be batched:
+        (task_prompt, text_input) where text_input may name an earlier step's task whose answer is
+        the text (caption -> grounding). VQA questions all go through one padded batch per frame.
+        """
+        caption_type = self.config.caption_type
+        if caption_type == "object_detection":
+            return [("<OD>", None)]
+        if caption_type == "hybrid_detection":
+            return [("<OD>", None), ("<MORE_DETAILED_CAPTION>", None),
+                    ("<CAPTION_TO_PHRASE_GROUNDING>", "<MORE_DETAILED_CAPTION>")]
+        if caption_type == "detailed_od":
+            return [("<OD>", None), ("<DETAILED_CAPTION>", None),
+                    ("<CAPTION_TO_PHRASE_GROUNDING>", "<DETAILED_CAPTION>")]
+        if caption_type == "vqa":
+            return [("<VQA>", question) for question in self.config.VQA_QUESTIONS]
+        caption_task = self.TASK_PROMPTS.get(caption_type)
+        if caption_task:
+            return [(caption_task, None), ("<CAPTION_TO_PHRASE_GROUNDING>", caption_task)]
+        return []
+    
+    @timed_stage("detection_batch")
+    def _prefetch_florence_detections(self, images_pil: List, processor, model, job_id: str):
+        """
+        Run the Florence-2 steps of the detection mode over several frames as padded batches
+        and store the answers on per-frame sessions, so the per-frame _detect_objects_florence
+        calls return them without decoding again.
+        
+        Args:
+            images_pil: Re-detection frames (the same PIL objects later passed to detection)
+            processor: Florence-2 processor
+            model: Florence-2 model
+            job_id: Job ID for logging
+        """
+        from app.florence import Florence2Session, run_florence2_batch
+        
+        plan = self._florence_batch_plan()
+        if not images_pil or not plan:
+            return
+        batch_size = self.config.FLORENCE2_BATCH_SIZE
+        sessions = [
+            Florence2Session(processor, model, image, self.device,
+                             share_vision=self.config.FLORENCE2_SHARE_VISION_ENCODING)
+            for image in images_pil
+        ]
+        self._florence_prefetched = {id(session.image): session for session in sessions}
+        
+        print(f"📦 Batched Florence-2 detection: {len(images_pil)} frame(s), batch size {batch_size}")
+        sys.stdout.flush()
+        
+        if self.config.caption_type == "vqa":
+            # Several questions over one frame share its visual tokens
+            questions = [text for _, text in plan]
+            for session in sessions:
+                answers = session.run_many("<VQA>", questions, batch_size=batch_size,
+                                           **self._florence2_generation_kwargs("<VQA>"))
+                for question, answer in zip(questions, answers):
+                    session.prime("<VQA>", question, answer)
+            logger.info(f"[{job_id}] Florence-2 VQA batched: {len(questions)} question(s) x {len(sessions)} frame(s)")
+            return
+        
+        for task_prompt, source_task in plan:
+            texts = None
+            if source_task is not None:
+                # Text comes from an earlier step (the caption), exactly as the per-frame path reads it
+                texts = [session.results[(source_task, None)].get(source_task, "") for session in sessions]
+            answers = run_florence2_batch(
+                processor, model, images_pil, task_prompt, texts,
+                device=self.device, batch_size=batch_size,
+                **self._florence2_generation_kwargs(task_prompt)
+            )
+            for i, (session, answer) in enumerate(zip(sessions, answers)):
+                session.prime(task_prompt, texts[i] if texts is not None else None, answer)
+            logger.info(f"[{job_id}] Florence-2 {task_prompt} batched over {len(images_pil)} frame(s)")
+    
+    @timed_stage("detection")
     def _detect_objects_florence(self, image_pil, processor, model):
         """Detect objects using Florence-2 (used when USE_GEMINI_DETECTION is False)."""
         import sys
@@ -1579,6 +1981,7 @@ class NutritionVideoPipeline:
                                 f"Answer with just the comma-separated list:"
                             )
                             
+                            self.timer.count('gemini_calls')
                             response = gemini_model.generate_content(prompt)
                             formatted_answer = response.text.strip()
                             print(f"    → Gemini output: {formatted_answer[:100]}...")
@@ -2136,13 +2539,17 @@ class NutritionVideoPipeline:
         
         return np.array(filtered_boxes) if filtered_boxes else np.array([]), filtered_labels
     
+    @timed_stage("save_masks")
     def _save_segmentation_masks(self, frame, masks_dict, tracked_objects, frame_idx, job_id):
-        """Save SAM2 segmentation masks as images using matplotlib for better visualization"""
-        import matplotlib.pyplot as plt
-        import matplotlib.patches as mpatches
-        from matplotlib.colors import ListedColormap
-        from pathlib import Path
+        """
+        Save SAM2 segmentation masks and a single-pass OpenCV overlay (frame is RGB)
+        
+        Masks go into one bit-packed archive per frame (MASK_STORAGE_FORMAT="npz", decode with
+        app.mask_codec) or one PNG per object ("png").
         
+        Returns:
+            Mask file reference for the results JSON
+        """
         # Create masks directory
         masks_dir = self.config.OUTPUT_DIR / job_id / "masks"
         masks_dir.mkdir(parents=True, exist_ok=True)
@@ -2151,22 +2558,15 @@ class NutritionVideoPipeline:
         overlay_dir = self.config.OUTPUT_DIR / job_id / "masks_overlay"
         overlay_dir.mkdir(parents=True, exist_ok=True)
         
-        # Convert BGR to RGB for matplotlib
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Generate distinct colors for each object
-        import matplotlib.cm as cm
-        num_objects = len(masks_dict)
-        colors = cm.get_cmap('tab20', num_objects)(np.linspace(0, 1, num_objects))
-        color_map = {obj_id: colors[i] for i, obj_id in enumerate(masks_dict.keys())}
+        image_format = self.config.OVERLAY_IMAGE_FORMAT
+        png_compression = self.config.OVERLAY_PNG_COMPRESSION
+        webp_quality = self.config.OVERLAY_WEBP_QUALITY
         
-        # Create figure for overlay
-        fig, ax = plt.subplots(1, 1, figsize=(12, 12))
-        ax.imshow(frame_rgb)
-        ax.axis('off')
+        store_npz = self.config.MASK_STORAGE_FORMAT.lower() == "npz"
         
-        # Save individual masks and add to overlay
-        legend_elements = []
+        # Save individual masks
+        overlay_masks = {}
+        labels = {}
         for obj_id, mask in masks_dict.items():
             if obj_id not in tracked_objects:
                 continue
@@ -2179,40 +2579,43 @@ class NutritionVideoPipeline:
             else:
                 mask_2d = mask
             
-            # Convert mask to uint8 (0 or 255) and save
-            mask_uint8 = (mask_2d * 255).astype(np.uint8)
-            safe_label = label.replace(' ', '_').replace('/', '_')[:50]
-            mask_filename = masks_dir / f"frame_{frame_idx:05d}_obj_{obj_id}_{safe_label}.png"
-            cv2.imwrite(str(mask_filename), mask_uint8)
-            
-            # Add colored mask to overlay using matplotlib
-            color = color_map[obj_id]
-            mask_bool = mask_2d.astype(bool)
+            if not store_npz:
+                # Convert mask to uint8 (0 or 255) and save
+                mask_uint8 = mask_2d.astype(bool).astype(np.uint8) * 255
+                safe_label = label.replace(' ', '_').replace('/', '_')[:50]
+                mask_filename = masks_dir / f"frame_{frame_idx:05d}_obj_{obj_id}_{safe_label}.png"
+                write_image(mask_filename, mask_uint8, "png", png_compression=png_compression)
             
-            # Create colored mask overlay
-            colored_mask = np.zeros((*mask_2d.shape, 4))
-            colored_mask[mask_bool] = [*color[:3], 0.5]  # RGB + alpha
-            
-            ax.imshow(colored_mask)
-            
-            # Add label to legend
-            legend_elements.append(mpatches.Patch(facecolor=color[:3], label=f"ID{obj_id}: {label}"))
+            overlay_masks[obj_id] = mask_2d
+            labels[obj_id] = label
+        
+        # All masks of the frame in one packed archive
+        if store_npz:
+            mask_file = save_frame_masks(masks_dir / mask_archive_name(frame_idx), overlay_masks, labels)
+            mask_ref = {'frame': frame_idx, 'format': 'npz', 'path': str(mask_file), 'objects': len(overlay_masks)}
+        else:
+            mask_ref = {'frame': frame_idx, 'format': 'png', 'path': str(masks_dir), 'objects': len(overlay_masks)}
+        if S3_RESULTS_BUCKET and UPLOAD_SEGMENTED_IMAGES:
+            mask_ref['s3_prefix'] = f"segmented_images/{job_id}/frame_{frame_idx:05d}/masks/"
         
-        # Add legend
-        if legend_elements:
-            ax.legend(handles=legend_elements, loc='upper left', bbox_to_anchor=(0, 1), 
-                     fontsize=8, framealpha=0.9)
+        # Frames are RGB; cv2 encodes BGR
+        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        overlay = composite_overlay(frame_bgr, overlay_masks, labels, alpha=self.config.OVERLAY_ALPHA)
         
         # Save overlay
-        overlay_filename = overlay_dir / f"frame_{frame_idx:05d}_all_masks.png"
-        plt.tight_layout()
-        plt.savefig(str(overlay_filename), dpi=150, bbox_inches='tight', pad_inches=0)
-        plt.close()
+        write_image(
+            overlay_dir / f"frame_{frame_idx:05d}_all_masks",
+            overlay,
+            image_format,
+            png_compression=png_compression,
+            webp_quality=webp_quality
+        )
         
         # Upload segmented images to S3
         self._upload_segmented_images_to_s3(job_id, masks_dir, overlay_dir, frame_idx)
         
         logger.info(f"[{job_id}] Frame {frame_idx}: Saved {len(masks_dict)} segmentation masks to {masks_dir}")
+        return mask_ref
     
     def _upload_segmented_images_to_s3(self, job_id: str, masks_dir: Path, overlay_dir: Path, frame_idx: int):
         """
@@ -2235,49 +2638,71 @@ class NutritionVideoPipeline:
             return
         
         try:
-            # Initialize S3 client if not already done
-            if s3_client is None:
-                s3_client = boto3.client('s3')
-            
-            uploaded_count = 0
+            uploader = self._get_uploader()
+            queued_count = 0
             frame_folder = f"frame_{frame_idx:05d}"
             
-            # Upload individual mask files
+            # Upload mask files (per-object PNGs or the frame's .npz archive)
             # Structure: segmented_images/{job_id}/frame_XXXXX/masks/mask_file.png
-            mask_files = list(masks_dir.glob(f"frame_{frame_idx:05d}_*.png"))
+            mask_files = list(masks_dir.glob(f"frame_{frame_idx:05d}_*.png")) + \
+                list(masks_dir.glob(f"frame_{frame_idx:05d}_*.npz"))
             for mask_file in mask_files:
                 # Extract just the filename (without the frame prefix since it's in the folder name)
                 mask_filename = mask_file.name
                 s3_key = f"segmented_images/{job_id}/{frame_folder}/masks/{mask_filename}"
-                s3_client.upload_file(
-                    str(mask_file),
-                    S3_RESULTS_BUCKET,
-                    s3_key,
-                    ExtraArgs={'ContentType': 'image/png'}
+                uploader.submit(
+                    job_id, mask_file, s3_key,
+                    IMAGE_CONTENT_TYPES.get(mask_file.suffix, 'application/octet-stream')
                 )
-                uploaded_count += 1
-                logger.info(f"[{job_id}] Uploaded mask to s3://{S3_RESULTS_BUCKET}/{s3_key}")
+                queued_count += 1
             
-            # Upload overlay file
+            # Upload overlay file (PNG or WebP depending on OVERLAY_IMAGE_FORMAT)
             # Structure: segmented_images/{job_id}/frame_XXXXX/overlays/all_masks.png
-            overlay_file = overlay_dir / f"frame_{frame_idx:05d}_all_masks.png"
-            if overlay_file.exists():
-                s3_key = f"segmented_images/{job_id}/{frame_folder}/overlays/all_masks.png"
-                s3_client.upload_file(
-                    str(overlay_file),
-                    S3_RESULTS_BUCKET,
-                    s3_key,
-                    ExtraArgs={'ContentType': 'image/png'}
+            for overlay_file in overlay_dir.glob(f"frame_{frame_idx:05d}_all_masks.*"):
+                s3_key = f"segmented_images/{job_id}/{frame_folder}/overlays/all_masks{overlay_file.suffix}"
+                uploader.submit(
+                    job_id, overlay_file, s3_key,
+                    IMAGE_CONTENT_TYPES.get(overlay_file.suffix, 'application/octet-stream')
                 )
-                uploaded_count += 1
-                logger.info(f"[{job_id}] Uploaded overlay to s3://{S3_RESULTS_BUCKET}/{s3_key}")
+                queued_count += 1
             
-            logger.info(f"[{job_id}] Frame {frame_idx}: Uploaded {uploaded_count} segmented images to S3 (bucket: {S3_RESULTS_BUCKET}, path: segmented_images/{job_id}/{frame_folder}/)")
+            # Uploads run in the background; _finish_uploads() joins them before the job completes
+            logger.info(f"[{job_id}] Frame {frame_idx}: Queued {queued_count} segmented images for S3 upload (bucket: {S3_RESULTS_BUCKET}, path: segmented_images/{job_id}/{frame_folder}/)")
             
         except Exception as e:
-            logger.error(f"[{job_id}] Failed to upload segmented images to S3: {e}", exc_info=True)
+            logger.error(f"[{job_id}] Failed to queue segmented images for S3 upload: {e}", exc_info=True)
             # Don't fail the entire pipeline if S3 upload fails
     
+    def _get_uploader(self):
+        """
+        Background S3 uploader shared by every pipeline in the process (one pool + boto3 client),
+        created on first use with this pipeline's S3_UPLOAD_* settings
+        """
+        global s3_client, s3_uploader
+        
+        if self._uploader is None:
+            with _s3_uploader_lock:
+                if s3_uploader is None:
+                    from app.uploads import S3UploadManager
+                    if s3_client is None:
+                        s3_client = boto3.client('s3')
+                    s3_uploader = S3UploadManager(
+                        S3_RESULTS_BUCKET,
+                        s3_client=s3_client,
+                        max_workers=self.config.S3_UPLOAD_MAX_WORKERS,
+                        max_pending=self.config.S3_UPLOAD_MAX_PENDING
+                    )
+            self._uploader = s3_uploader
+        return self._uploader
+    
+    @timed_stage("uploads_wait")
+    def _finish_uploads(self, job_id: str) -> Optional[Dict]:
+        """Wait for this job's queued S3 uploads; returns the upload report (None if nothing was queued)"""
+        if self._uploader is None:
+            return None
+        return self._uploader.wait(job_id, timeout=self.config.S3_UPLOAD_TIMEOUT_SECONDS)
+    
+    @timed_stage("segmented_video")
     def _generate_segmented_video(self, video_path: Path, job_id: str, tracking_results: Dict):
         """
         After pipeline has results from the 5 frames, run the full 5-second video through SAM2
@@ -2306,28 +2731,19 @@ class NutritionVideoPipeline:
         if not initial_detections:
             logger.info(f"[{job_id}] No objects with boxes for segmented video; skipping")
             return
-        # Load full video and extract all frames (same resize as pipeline)
-        cap = cv2.VideoCapture(str(video_path))
-        if not cap.isOpened():
+        # Load full video and extract all frames (same frame source + resize as _load_frames)
+        try:
+            source = self._open_frame_source(video_path)
+        except ValueError:
             logger.warning(f"[{job_id}] Could not open video for segmented overlay: {video_path}")
             return
-        fps = cap.get(cv2.CAP_PROP_FPS) or 15.0
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = source.fps or 15.0
+        total_frames = source.total_frames
         max_duration_sec = getattr(self.config, "VIDEO_MAX_DURATION_SECONDS", 5.0)
         if total_frames / max(fps, 1) > max_duration_sec + 0.5:
-            cap.release()
             logger.warning(f"[{job_id}] Video longer than {max_duration_sec}s; skipping segmented video")
             return
-        frames_list = []
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            aspect_ratio = frame.shape[0] / frame.shape[1]
-            new_h = int(self.config.RESIZE_WIDTH * aspect_ratio)
-            frame_resized = cv2.resize(frame, (self.config.RESIZE_WIDTH, new_h))
-            frames_list.append(cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB))
-        cap.release()
+        frames_list = [frame for _, frame in source.iter_frames()]
         if not frames_list:
             logger.warning(f"[{job_id}] No frames read for segmented video")
             return
@@ -2360,12 +2776,8 @@ class NutritionVideoPipeline:
             # Per-frame masks: sam2_id -> obj_id mapping
             sam2_to_obj = {i: det[0] for i, det in enumerate(initial_detections, start=1)}
             obj_id_to_label = {det[0]: det[1] for det in initial_detections}
-            # Distinct colors per object (BGR for cv2)
-            np.random.seed(42)
-            colors_bgr = {}
-            for i, (obj_id, _, _) in enumerate(initial_detections):
-                r, g, b = np.random.randint(50, 255, size=3)
-                colors_bgr[obj_id] = (int(b), int(g), int(r))
+            # Fixed palette color per object so colors don't shift between frames
+            obj_colors = {det[0]: object_color_bgr(i) for i, det in enumerate(initial_detections)}
             # Output video: same directory as segmented image overlays
             overlay_dir = self.config.OUTPUT_DIR / job_id / "masks_overlay"
             overlay_dir.mkdir(parents=True, exist_ok=True)
@@ -2381,58 +2793,32 @@ class NutritionVideoPipeline:
                     inference_state, frame_idx
                 )
                 frame_bgr = cv2.cvtColor(frames_list[frame_idx], cv2.COLOR_RGB2BGR)
-                overlay = frame_bgr.astype(np.float32) / 255.0
+                frame_masks = {}
                 for i, sam2_id in enumerate(sam2_obj_ids):
                     obj_id = sam2_to_obj.get(sam2_id)
                     if obj_id is None:
                         continue
-                    mask_logit = out_mask_logits[i]
-                    mask_np = (mask_logit > 0.0).cpu().numpy()
-                    if len(mask_np.shape) == 3:
-                        mask_np = mask_np[0]
-                    if mask_np.shape[:2] != (h, w):
-                        mask_np = cv2.resize(
-                            mask_np.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST
-                        ).astype(bool)
-                    color = colors_bgr.get(obj_id, (128, 128, 128))
-                    color_f = np.array([color[0] / 255.0, color[1] / 255.0, color[2] / 255.0])
-                    for c in range(3):
-                        overlay[:, :, c] = np.where(
-                            mask_np,
-                            overlay[:, :, c] * 0.5 + color_f[c] * 0.5,
-                            overlay[:, :, c],
-                        )
-                overlay_uint8 = (np.clip(overlay, 0, 1) * 255).astype(np.uint8)
+                    frame_masks[obj_id] = (out_mask_logits[i] > 0.0).cpu().numpy()
                 # Draw labels on first frame and every 15th for readability
-                if frame_idx == 0 or frame_idx % 15 == 0:
-                    for obj_id in sam2_to_obj.values():
-                        label = obj_id_to_label.get(obj_id, '')
-                        if label:
-                            # Place text at top, offset by obj_id to avoid overlap
-                            y_pos = 30 + list(sam2_to_obj.values()).index(obj_id) * 22
-                            cv2.putText(
-                                overlay_uint8, label[:40], (10, y_pos),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2,
-                            )
+                overlay_uint8 = composite_overlay(
+                    frame_bgr,
+                    frame_masks,
+                    obj_id_to_label,
+                    alpha=self.config.OVERLAY_ALPHA,
+                    draw_legend=(frame_idx == 0 or frame_idx % 15 == 0),
+                    colors=obj_colors
+                )
                 writer.write(overlay_uint8)
             writer.release()
             logger.info(f"[{job_id}] Saved segmented overlay video: {out_video_path}")
             # Upload to S3 (same prefix as segmented images)
             if S3_RESULTS_BUCKET and UPLOAD_SEGMENTED_IMAGES and out_video_path.exists():
                 try:
-                    global s3_client
-                    if s3_client is None:
-                        s3_client = boto3.client('s3')
                     s3_key = f"segmented_images/{job_id}/segmented_overlay_video.mp4"
-                    s3_client.upload_file(
-                        str(out_video_path),
-                        S3_RESULTS_BUCKET,
-                        s3_key,
-                        ExtraArgs={'ContentType': 'video/mp4'}
-                    )
-                    logger.info(f"[{job_id}] Uploaded segmented video to s3://{S3_RESULTS_BUCKET}/{s3_key}")
+                    self._get_uploader().submit(job_id, out_video_path, s3_key, 'video/mp4')
+                    logger.info(f"[{job_id}] Queued segmented video upload to s3://{S3_RESULTS_BUCKET}/{s3_key}")
                 except Exception as e:
-                    logger.warning(f"[{job_id}] Failed to upload segmented video to S3: {e}")
+                    logger.warning(f"[{job_id}] Failed to queue segmented video upload to S3: {e}")
         finally:
             # Clean temp frame dir
             import shutil
@@ -2469,20 +2855,21 @@ class NutritionVideoPipeline:
         
         return inter_area / union_area
     
-    def _run_florence2(self, task_prompt, text_input, image, processor, model):
-        """Run Florence-2 inference"""
-        prompt = task_prompt if text_input is None else task_prompt + text_input
-        inputs = processor(text=prompt, images=image, return_tensors="pt").to(self.device)
-        
+    def _florence2_generation_kwargs(self, task_prompt):
+        """Generation parameters for a Florence-2 task (FLORENCE2_FAST_MODE = greedy decoding)"""
         # Use configurable generation parameters for longer, more detailed captions
         generation_kwargs = {
-            "input_ids": inputs["input_ids"],
-            "pixel_values": inputs["pixel_values"],
             "max_new_tokens": self.config.FLORENCE2_MAX_NEW_TOKENS,
             "early_stopping": False,
-            "use_cache": False,
+            "use_cache": self.config.FLORENCE2_USE_CACHE,  # KV cache: linear instead of quadratic decoding
         }
         
+        if self.config.FLORENCE2_FAST_MODE:
+            # Greedy, deterministic decoding - no beams, no sampling
+            generation_kwargs["num_beams"] = 1
+            generation_kwargs["do_sample"] = False
+            return generation_kwargs
+        
         # Add beam search for better quality (especially for captions)
         if self.config.FLORENCE2_NUM_BEAMS > 1:
             generation_kwargs["num_beams"] = self.config.FLORENCE2_NUM_BEAMS
@@ -2499,18 +2886,32 @@ class NutritionVideoPipeline:
             # Use VQA-specific min_length for more complete answers
             generation_kwargs["min_length"] = self.config.FLORENCE2_VQA_MIN_LENGTH
         
-        with torch.no_grad():
-            generated_ids = model.generate(**generation_kwargs)
-        
-        generated_text = processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
-        
-        # Debug: Log generated text for VQA tasks
-        if task_prompt == "<VQA>":
-            logger.debug(f"Generated text before post-processing: '{generated_text[:500]}'")
-        
-        parsed_answer = processor.post_process_generation(
-            generated_text, task=task_prompt, image_size=(image.width, image.height)
+        return generation_kwargs
+    
+    def _florence2_session(self, image, processor, model):
+        """
+        Florence-2 session for this image - reused while the same image object is passed,
+        so OD / caption / grounding / VQA calls on one frame share a single vision encode
+        """
+        from app.florence import Florence2Session
+        
+        prefetched = self._florence_prefetched.get(id(image))
+        if prefetched is not None and prefetched.image is image and prefetched.model is model:
+            return prefetched
+        cached = getattr(self, '_florence_session_cache', None)
+        if cached is not None and cached.image is image and cached.model is model:
+            return cached
+        session = Florence2Session(
+            processor, model, image, self.device,
+            share_vision=self.config.FLORENCE2_SHARE_VISION_ENCODING
         )
+        self._florence_session_cache = session
+        return session
+    
+    def _run_florence2(self, task_prompt, text_input, image, processor, model):
+        """Run Florence-2 inference"""
+        session = self._florence2_session(image, processor, model)
+        parsed_answer = session.run(task_prompt, text_input, **self._florence2_generation_kwargs(task_prompt))
         
         # Debug: Log parsed answer for VQA tasks
         if task_prompt == "<VQA>":
@@ -2559,8 +2960,13 @@ class NutritionVideoPipeline:
         
         return intersection / union if union > 0 else 0
     
+    @timed_stage("depth")
     def _estimate_depth_metric3d(self, frame_np, model):
         """Estimate depth using Metric3D (returns meters)"""
+        if isinstance(model, InferenceClient):
+            # Inference server: batched with other jobs' frames
+            return model.estimate_depth(frame_np)
+        
         rgb_input = torch.from_numpy(frame_np).permute(2, 0, 1).unsqueeze(0).float().to(self.device)
         
         with torch.no_grad():
@@ -2665,162 +3071,157 @@ class NutritionVideoPipeline:
         
         return reference_depth_m
     
-    def _calculate_volume_metric3d(self, mask, depth_map_meters, box, label):
-        """Calculate volume using metric depth (implementation from test_tracking_metric3d.py)"""
-        # This is a simplified version - full implementation in the original file
-        mask_bool = mask.astype(bool)
-        depth_values_m = depth_map_meters[mask_bool]
+    @staticmethod
+    def _segment_percentiles(sorted_values, starts, counts, q):
+        """
+        np.percentile (linear interpolation) of every segment of an array sorted within segments
+        
+        Args:
+            sorted_values: Values, grouped by segment and ascending within each segment
+            starts, counts: Segment offsets and lengths (counts > 0)
+            q: Percentile in [0, 100]
+        """
+        pos = (q / 100.0) * (counts - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, counts - 1)
+        v_lo = sorted_values[starts + lo]
+        v_hi = sorted_values[starts + hi]
+        return v_lo + (v_hi - v_lo) * (pos - lo)
+    
+    @timed_stage("volume")
+    def _calculate_volumes_metric3d(self, masks: Dict, depth_map_meters, labels: Dict) -> Dict:
+        """
+        Calculate volumes of all objects of a frame from metric depth in one pass
+        
+        Mask pixels of every object are gathered once, depths are sorted by (object, depth) in a
+        single sort, and pixel counts / depth percentiles come from bincount + segment offsets
+        instead of one boolean index and four percentile sorts per object. Height, shape-factor
+        and cap rules are then applied per label as array operations. Overlapping masks are
+        handled (a pixel counts for every object whose mask covers it).
         
-        if len(depth_values_m) == 0 or not self.calibration['calibrated']:
-            return {'volume_ml': 0.0, 'avg_height_cm': 0.0, 'surface_area_cm2': 0.0}
+        Args:
+            masks: {obj_id: mask} (HxW or 1xHxW, same resolution as depth_map_meters)
+            depth_map_meters: HxW metric depth
+            labels: {obj_id: label}
         
-        pixel_count = mask_bool.sum()
+        Returns:
+            {obj_id: {'volume_ml', 'avg_height_cm', 'surface_area_cm2'[, 'diameter_cm']}}
+        """
+        obj_ids = list(masks)
+        if not obj_ids:
+            return {}
+        if not self.calibration['calibrated']:
+            return {obj_id: {'volume_ml': 0.0, 'avg_height_cm': 0.0, 'surface_area_cm2': 0.0} for obj_id in obj_ids}
+        
+        num_objects = len(obj_ids)
+        stack = np.stack([np.asarray(masks[obj_id]).reshape(depth_map_meters.shape).astype(bool) for obj_id in obj_ids])
+        obj_index, pixel_index = np.nonzero(stack.reshape(num_objects, -1))  # obj_index is non-decreasing
+        depths = depth_map_meters.reshape(-1)[pixel_index].astype(np.float64)
+        
+        pixel_counts = np.bincount(obj_index, minlength=num_objects)
         pixels_per_cm = self.calibration['pixels_per_cm']
-        surface_area_cm2 = pixel_count / (pixels_per_cm ** 2)
+        surface_area_cm2 = pixel_counts / (pixels_per_cm ** 2)
+        
+        # Valid depths, sorted within each object: offset every object by more than the depth range
+        valid = depths > 0
+        obj_valid = obj_index[valid]
+        depths_valid = depths[valid]
+        valid_counts = np.bincount(obj_valid, minlength=num_objects)
+        if len(depths_valid):
+            span = float(depths_valid.max()) + 1.0
+            sorted_depths = np.sort(depths_valid + obj_valid * span) - obj_valid * span
+        else:
+            sorted_depths = depths_valid
+        starts = np.concatenate(([0], np.cumsum(valid_counts)[:-1]))
+        measured = valid_counts > 0
         
-        valid_depths = depth_values_m[depth_values_m > 0]
-        if len(valid_depths) == 0:
-            return {'volume_ml': 0.0, 'avg_height_cm': 0.0, 'surface_area_cm2': surface_area_cm2}
+        def percentile(q):
+            values = np.zeros(num_objects)
+            values[measured] = self._segment_percentiles(sorted_depths, starts[measured], valid_counts[measured], q)
+            return values
         
         # Height calculation: Use reference plane (plate) as baseline
-        # Calculate height relative to reference plane, not absolute depth difference
         reference_plane_depth_m = self.calibration.get('reference_plane_depth_m')
-        
         if reference_plane_depth_m is not None and reference_plane_depth_m > 0:
-            # Use reference plane approach: height = reference_plane_depth - object_top_depth
-            # This gives us the height of the object above the plate/surface
-            object_top_depth_m = np.percentile(valid_depths, 10)  # Top 10% = closest to camera (top of object)
-            object_bottom_depth_m = np.percentile(valid_depths, 90)  # Bottom 90% = farthest (bottom/base)
-            
-            # Height is the difference from reference plane to top of object
-            # If object is above reference plane, height is positive
+            # Height above the reference plane (top 10% = closest to camera) or the depth variation
+            # within the object (10th-90th percentile), whichever is larger
+            object_top_depth_m = percentile(10)
+            object_bottom_depth_m = percentile(90)
             height_above_plane_m = reference_plane_depth_m - object_top_depth_m
-            
-            # Also check depth variation within object (for objects with significant height)
             depth_variation_m = object_bottom_depth_m - object_top_depth_m
-            
-            # Use the larger of: height above plane OR depth variation within object
-            # This handles both cases: objects on plate vs objects with internal height
-            raw_height_cm = max(height_above_plane_m, depth_variation_m) * 100
-            raw_height_cm = max(0, raw_height_cm)  # Ensure non-negative
-            
-            logger.debug(f"Height calculation for {label}: reference_plane={reference_plane_depth_m:.3f}m, "
-                        f"top={object_top_depth_m:.3f}m, height_above_plane={height_above_plane_m*100:.2f}cm, "
-                        f"depth_variation={depth_variation_m*100:.2f}cm, final={raw_height_cm:.2f}cm")
+            raw_height_cm = np.maximum(np.maximum(height_above_plane_m, depth_variation_m) * 100, 0)
         else:
             # Fallback: use depth variation within object (old method)
-            base_depth_m = np.percentile(valid_depths, 75)  # Bottom of object
-            top_depth_m = np.percentile(valid_depths, 15)   # Top of object
-            depth_diff_m = base_depth_m - top_depth_m
-            raw_height_cm = max(0, depth_diff_m * 100)
-            logger.warning(f"No reference plane - using depth variation method for {label}")
-        
-        # General approach: Estimate reasonable height based on object size
-        # Larger surface area → potentially taller object, but cap at reasonable limits
-        # Use surface area to estimate if object is "flat" (fries) or "tall" (burger)
+            raw_height_cm = np.maximum((percentile(75) - percentile(15)) * 100, 0)
+            logger.warning(f"No reference plane - using depth variation method for {[labels[obj_id] for obj_id in obj_ids]}")
         
         # Estimate object diameter from surface area (assuming roughly circular)
-        # diameter_cm ≈ 2 * sqrt(area / π)
         estimated_diameter_cm = 2 * np.sqrt(surface_area_cm2 / np.pi)
         
-        # General height estimation: height should be proportional to size but capped
-        # For food items, height is typically 10-30% of diameter for most items
-        # Flat items (fries): 2-5% of diameter
-        # Tall items (burgers): 20-40% of diameter
-        
-        label_lower = label.lower()
-        
-        # Detect flat items (fries, chips, etc.) - very low height-to-diameter ratio
-        is_flat_item = any(word in label_lower for word in ['fries', 'chips', 'crisps', 'potato', 'flat'])
-        
-        if 'plate' in label_lower:
-            height_cm = min(raw_height_cm, 2.5) if raw_height_cm > 5 else max(raw_height_cm, 1.5)
-        elif any(word in label_lower for word in ['glass', 'cup']):
-            height_cm = max(raw_height_cm, 8) if raw_height_cm < 3 else min(raw_height_cm, 15)
-        elif is_flat_item:
-            # Flat items: height should be very small relative to diameter
-            height_cm = min(raw_height_cm, estimated_diameter_cm * 0.05)  # Max 5% of diameter
-            height_cm = max(height_cm, 0.3)  # But at least 0.3cm
-            height_cm = min(height_cm, 2.0)  # Cap at 2cm
-        else:
-            # General food items: height is typically 15-30% of diameter
-            # But cap at reasonable maximums based on object size
-            height_from_diameter = estimated_diameter_cm * 0.25  # 25% of diameter
-            height_cm = min(raw_height_cm, height_from_diameter)
-            # Cap based on absolute size: larger objects can be taller
-            if estimated_diameter_cm < 5:  # Small items (<5cm diameter)
-                height_cm = min(height_cm, 3.0)
-            elif estimated_diameter_cm < 10:  # Medium items (5-10cm)
-                height_cm = min(height_cm, 6.0)
-            else:  # Large items (>10cm)
-                height_cm = min(height_cm, 10.0)
-            # Ensure minimum height
-            height_cm = max(height_cm, 1.0)
-        
-        # General shape factor: accounts for irregular shapes and air gaps
-        # Most food items are not perfect cylinders, so reduce volume
-        # Smaller items tend to have more air gaps (lower factor)
-        # Larger items are more solid (higher factor)
-        
-        if is_flat_item:
-            shape_factor = 0.4  # Very irregular, lots of air
-        elif estimated_diameter_cm < 5:
-            shape_factor = 0.5  # Small items: more air gaps
-        elif estimated_diameter_cm < 10:
-            shape_factor = 0.6  # Medium items: moderate air gaps
-        else:
-            shape_factor = 0.65  # Large items: less air, more solid
-        
+        # Label rules as boolean arrays (plate / glass-cup / flat items / general food)
+        labels_lower = [labels[obj_id].lower() for obj_id in obj_ids]
+        is_plate = np.array(['plate' in label for label in labels_lower])
+        is_glass = np.array([any(word in label for word in ['glass', 'cup']) for label in labels_lower]) & ~is_plate
+        is_flat = np.array([any(word in label for word in ['fries', 'chips', 'crisps', 'potato', 'flat']) for label in labels_lower])
+        is_flat_height = is_flat & ~is_plate & ~is_glass
+        is_general = ~(is_plate | is_glass | is_flat)
+        
+        height_cm = np.zeros(num_objects)
+        height_cm[is_plate] = np.where(raw_height_cm > 5, np.minimum(raw_height_cm, 2.5), np.maximum(raw_height_cm, 1.5))[is_plate]
+        height_cm[is_glass] = np.where(raw_height_cm < 3, np.maximum(raw_height_cm, 8), np.minimum(raw_height_cm, 15))[is_glass]
+        # Flat items: at most 5% of diameter, between 0.3cm and 2cm
+        flat_height = np.minimum(np.maximum(np.minimum(raw_height_cm, estimated_diameter_cm * 0.05), 0.3), 2.0)
+        height_cm[is_flat_height] = flat_height[is_flat_height]
+        # General food items: at most 25% of diameter, capped by size class, at least 1cm
+        size_cap = np.where(estimated_diameter_cm < 5, 3.0, np.where(estimated_diameter_cm < 10, 6.0, 10.0))
+        general_height = np.maximum(np.minimum(np.minimum(raw_height_cm, estimated_diameter_cm * 0.25), size_cap), 1.0)
+        height_cm[is_general] = general_height[is_general]
+        
+        # Shape factor: irregular shapes and air gaps (smaller items have more air)
+        shape_factor = np.where(
+            is_flat, 0.4,
+            np.where(estimated_diameter_cm < 5, 0.5, np.where(estimated_diameter_cm < 10, 0.6, 0.65))
+        )
         volume_ml = surface_area_cm2 * height_cm * shape_factor
         
-        # Debug logging
-        logger.info(f"Volume calculation for {label}: area={surface_area_cm2:.2f}cm², height={height_cm:.2f}cm, "
-                   f"shape_factor={shape_factor:.2f}, diameter={estimated_diameter_cm:.2f}cm, "
-                   f"raw_volume={volume_ml:.2f}ml")
-        
-        # Final validation: Cap volume at reasonable maximum
-        # Calculate max reasonable volume based on diameter
-        max_reasonable_volume_from_diameter = (estimated_diameter_cm ** 3) * 0.5
-        
-        # Also cap based on typical food volumes (stricter limits)
+        # Cap volume: diameter-based limit, typical food volumes (stricter), and 1000ml absolute maximum
         typical_max_volumes = {
             'burger': 500, 'sandwich': 500, 'cheeseburger': 500, 'hamburger': 500,
             'fries': 200, 'french fries': 200, 'potato': 200,
             'pizza': 1000, 'salad': 500, 'soup': 500,
             'ice cream': 300, 'nugget': 100, 'chicken': 300
         }
-        
-        # Check if label matches any typical food
-        matched_max = None
-        for food_type, max_vol in typical_max_volumes.items():
-            if food_type in label_lower:
-                matched_max = max_vol
-                break
-        
-        # Use the stricter limit (either diameter-based or food-specific)
-        if matched_max:
-            max_reasonable_volume = min(max_reasonable_volume_from_diameter, matched_max)
-        else:
-            max_reasonable_volume = max_reasonable_volume_from_diameter
-        
-        # Always cap at absolute maximum (1000ml) for safety
-        max_reasonable_volume = min(max_reasonable_volume, 1000.0)
-        
-        if volume_ml > max_reasonable_volume:
-            old_volume = volume_ml
-            volume_ml = max_reasonable_volume
-            logger.warning(f"⚠️ Volume capped from {old_volume:.1f}ml to {max_reasonable_volume:.1f}ml for '{label}' "
-                          f"(diameter: {estimated_diameter_cm:.1f}cm, area: {surface_area_cm2:.1f}cm², height: {height_cm:.2f}cm)")
-        
-        # Note: Volume validation is now batched with estimation at the end (optimization)
-        # We return the calculated volume as-is, validation happens later in batch
-        
-        return {
-            'volume_ml': float(volume_ml),
-            'avg_height_cm': float(height_cm),
-            'surface_area_cm2': float(surface_area_cm2),
-            'diameter_cm': float(estimated_diameter_cm)  # Store for later batch validation
-        }
+        matched_max = np.array([
+            next((max_vol for food_type, max_vol in typical_max_volumes.items() if food_type in label), np.inf)
+            for label in labels_lower
+        ])
+        max_reasonable_volume = np.minimum(np.minimum((estimated_diameter_cm ** 3) * 0.5, matched_max), 1000.0)
+        raw_volume_ml = volume_ml
+        volume_ml = np.minimum(volume_ml, max_reasonable_volume)
+        
+        results = {}
+        for i, obj_id in enumerate(obj_ids):
+            label = labels[obj_id]
+            if pixel_counts[i] == 0:
+                results[obj_id] = {'volume_ml': 0.0, 'avg_height_cm': 0.0, 'surface_area_cm2': 0.0}
+                continue
+            if not measured[i]:
+                results[obj_id] = {'volume_ml': 0.0, 'avg_height_cm': 0.0, 'surface_area_cm2': float(surface_area_cm2[i])}
+                continue
+            logger.info(f"Volume calculation for {label}: area={surface_area_cm2[i]:.2f}cm², height={height_cm[i]:.2f}cm, "
+                       f"shape_factor={shape_factor[i]:.2f}, diameter={estimated_diameter_cm[i]:.2f}cm, "
+                       f"raw_volume={raw_volume_ml[i]:.2f}ml")
+            if raw_volume_ml[i] > max_reasonable_volume[i]:
+                logger.warning(f"⚠️ Volume capped from {raw_volume_ml[i]:.1f}ml to {max_reasonable_volume[i]:.1f}ml for '{label}' "
+                              f"(diameter: {estimated_diameter_cm[i]:.1f}cm, area: {surface_area_cm2[i]:.1f}cm², height: {height_cm[i]:.2f}cm)")
+            # Volume validation is batched with estimation at the end of tracking
+            results[obj_id] = {
+                'volume_ml': float(volume_ml[i]),
+                'avg_height_cm': float(height_cm[i]),
+                'surface_area_cm2': float(surface_area_cm2[i]),
+                'diameter_cm': float(estimated_diameter_cm[i])  # Store for later batch validation
+            }
+        return results
     
     def _validate_volume_with_gemini(self, food_name, calculated_volume_ml, height_cm, area_cm2, diameter_cm):
         """Use Gemini to validate if calculated volume is reasonable, return adjusted volume if needed"""
@@ -2874,6 +3275,7 @@ Examples:
 {{"is_reasonable": false, "reason": "Height 0.49cm too low for fries", "suggested_volume_ml": 150}}
 {{"is_reasonable": true, "reason": "Reasonable pasta serving size"}}"""
 
+            self.timer.count('gemini_calls')
             response = gemini_model.generate_content(prompt)
             response_text = response.text.strip()
             
@@ -2901,6 +3303,7 @@ Examples:
             logger.warning(f"Gemini volume validation failed: {e}")
             return calculated_volume_ml
     
+    @timed_stage("gemini_validation")
     def _batch_validate_and_estimate_volumes_with_gemini(self, items_for_validation: list, untracked_items: list, job_id: str) -> dict:
         """
         Combined: Validate calculated volumes AND estimate untracked volumes in ONE Gemini call.
@@ -2990,6 +3393,7 @@ Example:
   "estimated": [{{"food": "Beans", "estimated_volume_ml": 150, "reason": "Typical side serving"}}]
 }}"""
 
+            self.timer.count('gemini_calls')
             response = gemini_model.generate_content(prompt)
             response_text = response.text.strip()
             
@@ -3109,6 +3513,7 @@ Respond ONLY with JSON array:
 Example:
 [{{"food": "Beans", "estimated_volume_ml": 150, "reason": "Typical side serving"}}, {{"food": "Gravy", "estimated_volume_ml": 100, "reason": "Standard gravy portion"}}]"""
 
+            self.timer.count('gemini_calls')
             response = gemini_model.generate_content(prompt)
             response_text = response.text.strip()
             
@@ -3205,6 +3610,7 @@ Example:
 {{"estimated_volume_ml": 150, "reason": "Standard serving of beans"}}
 {{"estimated_volume_ml": 100, "reason": "Typical gravy portion"}}"""
 
+            self.timer.count('gemini_calls')
             response = gemini_model.generate_content(prompt)
             response_text = response.text.strip()
             
@@ -3231,6 +3637,7 @@ Example:
             # Fallback: simple estimation from area
             return area_cm2 * 2.0  # area * 2cm height
     
+    @timed_stage("gemini_filter")
     def _format_and_filter_with_gemini(self, boxes, labels, vqa_answer, job_id, frame_idx):
         """
         Combined: Format VQA answer and filter non-food items in one Gemini call.
@@ -3268,6 +3675,7 @@ Respond ONLY with JSON:
 Example:
 {{"formatted_foods": "ribs, potatoes, beans, gravy, mashed potatoes", "food_items_to_keep": ["Ribs", "Potatoes", "Beans"]}}"""
 
+            self.timer.count('gemini_calls')
             response = gemini_model.generate_content(prompt)
             response_text = response.text.strip()
             
@@ -3362,6 +3770,7 @@ Respond ONLY with JSON listing merge groups:
 
 If no duplicates, respond: {{"merge_groups": [], "keep_separate": ["ID1", "ID2", ...]}}"""
 
+            self.timer.count('gemini_calls')
             response = gemini_model.generate_content(prompt)
             response_text = response.text.strip()
             
@@ -3514,6 +3923,7 @@ Respond ONLY with JSON:
 
 If no duplicates/combinations, respond: {{"merge_groups": [], "combine": [], "keep_separate": ["ID1", "ID2", ...]}}"""
 
+            self.timer.count('gemini_calls')
             response = gemini_model.generate_content(prompt)
             response_text = response.text.strip()
             
@@ -3670,6 +4080,7 @@ Respond ONLY with JSON:
 Example:
 {{"combine": ["Parsley", "Basil", "Sauce"], "keep_separate": ["Hamburger", "Fries", "Cola"]}}"""
 
+            self.timer.count('gemini_calls')
             response = gemini_model.generate_content(prompt)
             response_text = response.text.strip()
             
@@ -3718,6 +4129,7 @@ Example:
             logger.warning(f"Gemini item combining failed: {e}, keeping items as-is")
             return tracking_results
     
+    @timed_stage("nutrition_rag")
     def _analyze_nutrition(self, tracking_results, job_id):
         """Run nutrition analysis using RAG system"""
         logger.info(f"[{job_id}] Running nutrition analysis...")
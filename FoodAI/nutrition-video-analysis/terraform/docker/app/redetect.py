@@ -0,0 +1,193 @@
+"""
+Re-detection scheduling for the tracking loop
+"fixed" re-detects every DETECTION_INTERVAL frames. "adaptive" detects on the first frame and then
+only when tracking health degrades, using cheap per-frame signals from the SAM2 propagation step:
+- object score logits (SAM2's own "object is present" head)
+- mask IoU against the previous frame (drift / jumps)
+- relative mask-area change against the previous frame (shrinking or exploding masks)
+- change of the frame outside the tracked masks since the last detection (new content entering)
+A maximum gap forces a detection even on healthy tracks; a minimum gap avoids back-to-back calls.
+The gap before a triggered detection doubles (up to the maximum gap) after each triggered one that
+does not re-seed the tracks, so a plate that left the view or got covered doesn't re-trigger every frame.
+"""
+import logging
+import cv2
+import numpy as np
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_MODES = ("fixed", "adaptive")
+
+# Frames are compared at this width for the new-content signal
+_THUMB_WIDTH = 96
+
+
+def _thumbnail(frame: np.ndarray) -> np.ndarray:
+    """Small grayscale copy of an RGB frame"""
+    h, w = frame.shape[:2]
+    size = (_THUMB_WIDTH, max(1, round(h * _THUMB_WIDTH / w)))
+    return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY), size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def _mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+class RedetectionScheduler:
+    """Decides which frames run the detector; fed with SAM2 masks of the frames in between"""
+
+    def __init__(
+        self,
+        mode: str = "fixed",
+        interval: int = 5,
+        max_gap: Optional[int] = None,
+        min_gap: int = 1,
+        min_mask_iou: float = 0.5,
+        max_area_change: float = 0.5,
+        min_object_score: float = 0.0,
+        new_content_threshold: float = 12.0,
+    ):
+        """
+        Args:
+            mode: "fixed" or "adaptive"
+            interval: Fixed-mode period (frames)
+            max_gap: Adaptive: force a detection after this many frames (None = 2 x interval)
+            min_gap: Adaptive: frames to wait after a detection before a triggered one (doubles after
+                triggered detections that find nothing to track, back to min_gap once one does)
+            min_mask_iou: Adaptive: trigger when an object's mask IoU with the previous frame drops below this
+            max_area_change: Adaptive: trigger when an object's mask area changes by more than this fraction
+            min_object_score: Adaptive: trigger when an object's SAM2 score logit falls below this (object lost)
+            new_content_threshold: Adaptive: trigger when the mean absolute gray-level change outside the
+                tracked masks since the last detection exceeds this (0-255)
+        """
+        mode = (mode or "fixed").strip().lower()
+        if mode not in SCHEDULER_MODES:
+            raise ValueError(f"Unknown re-detection mode '{mode}' (expected one of {SCHEDULER_MODES})")
+        self.mode = mode
+        self.interval = max(1, int(interval))
+        self.max_gap = max(1, int(max_gap)) if max_gap else 2 * self.interval
+        self.min_gap = max(1, int(min_gap))
+        self.min_mask_iou = min_mask_iou
+        self.max_area_change = max_area_change
+        self.min_object_score = min_object_score
+        self.new_content_threshold = new_content_threshold
+
+        self.last_detection = None
+        self.pending_reason = None
+        self.trigger_gap = self.min_gap
+        self._prev_masks: Dict = {}
+        self._reference_thumb = None
+        self.decisions: List[Dict] = []
+
+    @classmethod
+    def from_config(cls, config) -> "RedetectionScheduler":
+        return cls(
+            mode=config.REDETECTION_MODE,
+            interval=config.DETECTION_INTERVAL,
+            max_gap=config.REDETECTION_MAX_GAP,
+            min_gap=config.REDETECTION_MIN_GAP,
+            min_mask_iou=config.REDETECTION_MIN_MASK_IOU,
+            max_area_change=config.REDETECTION_MAX_AREA_CHANGE,
+            min_object_score=config.REDETECTION_MIN_OBJECT_SCORE,
+            new_content_threshold=config.REDETECTION_NEW_CONTENT_THRESHOLD,
+        )
+
+    @property
+    def adaptive(self) -> bool:
+        return self.mode == "adaptive"
+
+    def planned_frames(self, num_frames: int) -> List[int]:
+        """Detection frames known before the loop runs (all of them in fixed mode, frame 0 in adaptive)"""
+        if self.adaptive:
+            return [0] if num_frames else []
+        return list(range(0, num_frames, self.interval))
+
+    def should_detect(self, frame_idx: int) -> bool:
+        """Whether frame_idx runs the detector (records the decision)"""
+        if not self.adaptive:
+            if frame_idx % self.interval:
+                return False
+            reason = "interval"
+        elif self.last_detection is None:
+            reason = "first frame"
+        else:
+            gap = frame_idx - self.last_detection
+            if gap >= self.max_gap:
+                reason = f"max gap ({self.max_gap} frames)"
+            elif self.pending_reason and gap >= self.trigger_gap:
+                reason = self.pending_reason
+                # Backed off until detected() gets masks from this detection
+                self.trigger_gap = min(2 * self.trigger_gap, self.max_gap)
+            else:
+                return False
+        self.decisions.append({'frame': frame_idx, 'reason': reason})
+        return True
+
+    def record(self, frame_idx: int, reason: str):
+        """Record a detection decided outside the schedule (e.g. the one-shot Gemini video pass)"""
+        self.decisions.append({'frame': frame_idx, 'reason': reason})
+
+    def detected(self, frame_idx: int, frame: np.ndarray, masks: Optional[Dict] = None):
+        """A detection ran on frame_idx: reset the health baseline to its masks (tracks re-seeded when given)"""
+        self.last_detection = frame_idx
+        self.pending_reason = None
+        if masks:
+            self.trigger_gap = self.min_gap
+        self._prev_masks = {obj_id: np.asarray(mask, dtype=bool) for obj_id, mask in (masks or {}).items()}
+        if self.adaptive:
+            self._reference_thumb = _thumbnail(frame)
+
+    def observe(self, frame_idx: int, frame: np.ndarray, masks: Dict, object_scores: Optional[Dict] = None) -> Optional[str]:
+        """
+        Feed the SAM2 masks of a non-detection frame; flags a detection for the next eligible frame
+        when tracks degrade or new content appears
+
+        Args:
+            masks: {obj_id: HxW bool mask}
+            object_scores: {obj_id: SAM2 object score logit} (optional)
+
+        Returns:
+            Trigger reason, or None when tracking looks healthy
+        """
+        if not self.adaptive:
+            return None
+        reason = None
+        for obj_id, mask in masks.items():
+            mask = np.asarray(mask, dtype=bool)
+            score = (object_scores or {}).get(obj_id)
+            if score is not None and score < self.min_object_score:
+                reason = f"object {obj_id} lost (score {score:.2f})"
+                break
+            prev = self._prev_masks.get(obj_id)
+            if prev is None or prev.shape != mask.shape:
+                continue
+            prev_area, area = np.count_nonzero(prev), np.count_nonzero(mask)
+            if prev_area and abs(area - prev_area) / prev_area > self.max_area_change:
+                reason = f"object {obj_id} area changed {100.0 * (area - prev_area) / prev_area:+.0f}%"
+                break
+            iou = _mask_iou(prev, mask)
+            if iou < self.min_mask_iou:
+                reason = f"object {obj_id} drifted (IoU {iou:.2f})"
+                break
+        if reason is None and self._reference_thumb is not None:
+            thumb = _thumbnail(frame)
+            if thumb.shape == self._reference_thumb.shape:
+                outside = np.ones(thumb.shape, dtype=bool)
+                for mask in masks.values():
+                    small = cv2.resize(np.asarray(mask, dtype=np.uint8), thumb.shape[::-1], interpolation=cv2.INTER_NEAREST)
+                    outside &= small == 0
+                if outside.any():
+                    change = float(np.abs(thumb - self._reference_thumb)[outside].mean())
+                    if change > self.new_content_threshold:
+                        reason = f"new content (change {change:.1f})"
+        self._prev_masks = {obj_id: np.asarray(mask, dtype=bool) for obj_id, mask in masks.items()}
+        if reason and not self.pending_reason:
+            self.pending_reason = reason
+            logger.debug(f"Re-detection requested at frame {frame_idx}: {reason}")
+        return reason
+
+    def summary(self) -> Dict:
+        """Detections run and why (for processing_info / logs)"""
+        return {'mode': self.mode, 'detections': len(self.decisions), 'decisions': self.decisions}
@@ -0,0 +1,59 @@
+"""
+SAM2 single-image session
+Drop-in for the SAM2VideoPredictor calls made by the tracking loop (init_state /
+add_new_points_or_box / infer_single_frame) when the job is a single photo: the image is
+encoded once with SAM2ImagePredictor.set_image and all box prompts are decoded in one batched
+predict call - no JPEG frame directory, no memory encoder, no per-box decoder runs.
+"""
+import logging
+import numpy as np
+import torch
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class SAM2ImageSession:
+    """Video-predictor surface over SAM2ImagePredictor for one RGB image"""
+
+    def __init__(self, image_predictor, image: np.ndarray):
+        """
+        Args:
+            image_predictor: SAM2ImagePredictor (shares weights with the video predictor)
+            image: HxWx3 RGB frame
+        """
+        self.predictor = image_predictor
+        self.image = image
+        self._embedded = False
+
+    def init_state(self, video_path=None, **kwargs) -> Dict:
+        """New prompt state; the image embedding is kept across resets (same image)"""
+        return {"num_frames": 1, "boxes": {}}
+
+    def add_new_points_or_box(self, inference_state, frame_idx, obj_id, box=None, points=None, labels=None, **kwargs):
+        """Record a box prompt; decoding is deferred to infer_single_frame (one batch for all boxes)"""
+        if box is None or points is not None:
+            raise ValueError("SAM2ImageSession supports box prompts only")
+        inference_state["boxes"][obj_id] = np.asarray(box, dtype=np.float32).reshape(4)
+        return frame_idx, list(inference_state["boxes"]), None
+
+    def infer_single_frame(self, inference_state, frame_idx):
+        """
+        Decode every recorded box against the image embedding
+
+        Returns:
+            (frame_idx, obj_ids, mask logits tensor of shape (num_objects, 1, H, W))
+        """
+        obj_ids = list(inference_state["boxes"])
+        if not obj_ids:
+            raise RuntimeError("No conditioning points provided. Please add points before inference.")
+        if not self._embedded:
+            self.predictor.set_image(self.image)
+            self._embedded = True
+        boxes = np.stack([inference_state["boxes"][obj_id] for obj_id in obj_ids])
+        with torch.inference_mode():
+            masks, _, _ = self.predictor.predict(box=boxes, multimask_output=False, return_logits=True)
+        # predict squeezes the batch axis for a single box: always (num_objects, 1, H, W)
+        masks = masks.reshape(len(obj_ids), 1, *masks.shape[-2:])
+        logger.debug(f"SAM2 image predictor: decoded {len(obj_ids)} box(es) in one batch")
+        return frame_idx, obj_ids, torch.from_numpy(masks)
@@ -0,0 +1,82 @@
+"""
+Per-frame stage executor
+Depth estimation only needs the RGB frame, so it can run while SAM2 prompts and decodes masks
+for the same frame; the two branches join at the volume step:
+
+    frame ──┬── SAM2 (add boxes → infer masks) ──┬── volumes → masks/overlays
+            └── Metric3D depth ──────────────────┘
+
+The depth branch runs on one background thread. On CPU the torch intra-op threads are split
+between the branches while both run (torch.set_num_threads applies to the calling thread's
+parallel regions with the OpenMP backend); on CUDA the depth branch gets its own stream.
+"""
+import logging
+import torch
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FrameStageExecutor:
+    """Runs the frame-only branch (depth) concurrently with the main thread (SAM2)"""
+
+    def __init__(self, device: str, enabled: bool = True, depth_threads: Optional[int] = None):
+        """
+        Args:
+            device: "cuda" or "cpu" (device of the depth model)
+            enabled: False = run submitted stages inline (sequential, previous behaviour)
+            depth_threads: CPU intra-op threads for the depth branch (None = half of torch.get_num_threads())
+        """
+        self.enabled = enabled
+        self.total_threads = torch.get_num_threads()
+        self.depth_threads = max(1, depth_threads or self.total_threads // 2)
+        self.main_threads = max(1, self.total_threads - self.depth_threads)
+        self._cpu = device != "cuda"
+        self._stream = torch.cuda.Stream() if enabled and not self._cpu and torch.cuda.is_available() else None
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-depth") if enabled else None
+        self._pending = 0
+
+    def _run(self, fn: Callable, args):
+        if self._cpu:
+            torch.set_num_threads(self.depth_threads)
+        if self._stream is not None:
+            with torch.cuda.stream(self._stream):
+                result = fn(*args)
+            self._stream.synchronize()
+            return result
+        return fn(*args)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Start fn(*args) on the depth branch; the main thread keeps its share of CPU threads until join"""
+        if self._pool is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        future = self._pool.submit(self._run, fn, args)
+        self._pending += 1
+        if self._cpu and self._pending == 1:
+            torch.set_num_threads(self.main_threads)
+        return future
+
+    def join(self, future: Future):
+        """Wait for a submitted stage and give the main thread all CPU threads back"""
+        try:
+            return future.result()
+        finally:
+            if self._pool is not None:
+                self._pending = max(0, self._pending - 1)
+                if self._cpu and self._pending == 0:
+                    torch.set_num_threads(self.total_threads)
+
+    def shutdown(self):
+        """Release the worker thread (does not wait for an abandoned stage)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        if self._cpu and self._pending:
+            self._pending = 0
+            torch.set_num_threads(self.total_threads)
@@ -0,0 +1,240 @@
+"""
+Stage timing and resource instrumentation
+Lightweight spans recording wall time, CPU time, RSS change and peak CUDA memory per pipeline stage,
+plus counters (frames, objects, Gemini calls). Summaries go into results['processing_info']['timings']
+and each finished span is logged as a structured record (JSON when LOG_FORMAT=json).
+CPU time and RSS are process-wide, so spans that overlap on other threads (the depth branch next to
+SAM2) each include the other's share; ACCOUNTING spells this out in every timings block.
+"""
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# LogRecord attributes that are not user extras
+_RESERVED_LOG_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# How to read the span metrics (included in summary())
+ACCOUNTING = {
+    "cpu_ms": "process-wide (all threads): overlapping spans on other threads count each other's CPU",
+    "rss_mb": "process-wide resident memory at span end; rss_delta_mb is end minus start",
+    "peak_cuda_mb": "device peak since the job thread's current top-level span started "
+                    "(spans on other threads, marked with 'thread', never reset it)",
+}
+
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):  # Windows
+    _PAGE_SIZE = 4096
+
+
+def _rss_mb() -> Optional[float]:
+    """
+    Current resident set size of this process (MB), None where unavailable (non-Linux).
+    Not ru_maxrss: a lifetime high-water mark is the same number for every stage of a long-lived worker.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * _PAGE_SIZE / (1024 * 1024)
+
+
+def _rss_delta(start: Optional[float], end: Optional[float]) -> Optional[float]:
+    return round(end - start, 1) if start is not None and end is not None else None
+
+
+def _cuda_available() -> bool:
+    torch = sys.modules.get("torch")
+    return torch is not None and torch.cuda.is_available()
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per log line; extras passed via `extra=` become top-level fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_LOG_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(level: str = "INFO", log_format: str = "json"):
+    """
+    Configure root logging
+
+    Args:
+        level: Log level name
+        log_format: "json" for structured lines, anything else for the plain text format
+    """
+    handler = logging.StreamHandler()
+    if log_format == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+
+class StageTimer:
+    """Collects timing spans and counters for one job"""
+
+    def __init__(self, job_id: str, track_cuda: bool = True):
+        """
+        Args:
+            job_id: Job the spans belong to (included in every log record)
+            track_cuda: Record peak CUDA memory per span when a GPU is in use
+        """
+        self.job_id = job_id
+        self.track_cuda = track_cuda and _cuda_available()
+        self.spans: List[Dict] = []
+        self.counters: Dict[str, int] = {}
+        self._local = threading.local()  # Per-thread stack of open span names (for nesting)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._rss_start = _rss_mb()
+        # Thread running the job: the only one allowed to reset the (device-wide) CUDA peak counter
+        self._job_thread = threading.get_ident()
+
+    def count(self, name: str, n: int = 1):
+        """Increment a job-level counter (e.g. gemini_calls)"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def span(self, name: str, **counts):
+        """
+        Time a stage
+
+        Usage:
+            with timer.span("sam2_init", frames=len(frames)) as s:
+                ...
+                s["objects"] = len(tracked_objects)
+
+        Args:
+            name: Stage name; nested spans are recorded as "parent/child"
+            **counts: Initial counts; the yielded dict accepts more
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        path = "/".join(stack + [name])
+        top_level = not stack
+        stack.append(name)
+        job_thread = threading.get_ident() == self._job_thread
+
+        info = dict(counts)
+        if self.track_cuda:
+            import torch
+            cuda_base = torch.cuda.memory_allocated()
+            if top_level and job_thread:
+                # Nested spans report the peak since their top-level stage started. Only the job
+                # thread resets it: a reset from the depth thread would cut the open SAM2 spans' peaks
+                torch.cuda.reset_peak_memory_stats()
+        rss_start = _rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()  # Process-wide: includes torch intra-op threads
+        error = None
+        try:
+            yield info
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            rss_end = _rss_mb()
+            record = {
+                "stage": path,
+                "wall_ms": round((time.perf_counter() - wall_start) * 1000.0, 1),
+                "cpu_ms": round((time.process_time() - cpu_start) * 1000.0, 1),
+                "rss_mb": round(rss_end, 1) if rss_end is not None else None,
+                "rss_delta_mb": _rss_delta(rss_start, rss_end),
+            }
+            if self.track_cuda:
+                import torch
+                record["peak_cuda_mb"] = round(torch.cuda.max_memory_allocated() / (1024 * 1024), 1)
+                record["cuda_delta_mb"] = round((torch.cuda.memory_allocated() - cuda_base) / (1024 * 1024), 1)
+            if not job_thread:
+                record["thread"] = threading.current_thread().name
+            record.update(info)
+            if error:
+                record["error"] = error
+            with self._lock:
+                self.spans.append(record)
+            logger.info(
+                f"[{self.job_id}] ⏱ {path}: {record['wall_ms']:.0f} ms wall, {record['cpu_ms']:.0f} ms cpu"
+                + (f" ({', '.join(f'{k}={v}' for k, v in info.items())})" if info else ""),
+                extra={"event": "stage_timing", "job_id": self.job_id, **record}
+            )
+
+    def summary(self) -> Dict:
+        """Timings block for results['processing_info']['timings']"""
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        # Top-level stages add up to (most of) the job; nested ones are breakdowns
+        by_stage: Dict[str, Dict] = {}
+        for span in spans:
+            entry = by_stage.setdefault(span["stage"], {"calls": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "rss_delta_mb": None})
+            entry["calls"] += 1
+            entry["wall_ms"] = round(entry["wall_ms"] + span["wall_ms"], 1)
+            entry["cpu_ms"] = round(entry["cpu_ms"] + span["cpu_ms"], 1)
+            if span.get("rss_delta_mb") is not None:
+                entry["rss_delta_mb"] = round((entry["rss_delta_mb"] or 0.0) + span["rss_delta_mb"], 1)
+        rss_end = _rss_mb()
+        return {
+            "total_wall_ms": round((time.perf_counter() - self._started) * 1000.0, 1),
+            "rss_mb": round(rss_end, 1) if rss_end is not None else None,
+            "rss_delta_mb": _rss_delta(self._rss_start, rss_end),
+            "stages": by_stage,
+            "spans": spans,
+            "counters": counters,
+            "accounting": ACCOUNTING,
+        }
+
+
+def timed_stage(name: str):
+    """Method decorator: run the method inside self.timer.span(name)"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with getattr(self, "timer", NULL_TIMER).span(name):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _NullTimer(StageTimer):
+    """Timer used outside a job (helpers called directly) - spans still run but nothing is kept"""
+
+    def __init__(self):
+        super().__init__(job_id="-", track_cuda=False)
+
+    @contextmanager
+    def span(self, name: str, **counts):
+        yield dict(counts)
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+
+NULL_TIMER = _NullTimer()
@@ -0,0 +1,99 @@
+"""
+Background S3 uploads for pipeline artifacts
+One bounded thread pool and one boto3 client/TransferConfig shared by all jobs;
+uploads run while compute continues and are joined per job before completion.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class S3UploadManager:
+    """Asynchronous, bounded S3 uploader with per-job join and failure reporting"""
+
+    def __init__(
+        self,
+        bucket: str,
+        s3_client=None,
+        max_workers: int = 8,
+        max_pending: int = 64,
+        multipart_threshold_mb: int = 8
+    ):
+        """
+        Args:
+            bucket: Destination bucket
+            s3_client: boto3 S3 client to share (created if None); boto3 clients are thread-safe
+            max_workers: Concurrent uploads
+            max_pending: Max queued + running uploads; submit() blocks beyond this (backpressure)
+            multipart_threshold_mb: Files above this size use multipart upload
+        """
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.client = s3_client or boto3.client('s3')
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold_mb * 1024 * 1024,
+            max_concurrency=2,  # Per-file parts; parallelism comes from the pool
+            use_threads=True
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3-upload")
+        self._slots = threading.BoundedSemaphore(max(max_pending, max_workers))
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List] = {}  # job_id -> [(future, local_path, key)]
+
+    def submit(self, job_id: str, local_path: Path, key: str, content_type: Optional[str] = None):
+        """Queue a file for upload (returns immediately unless max_pending uploads are in flight)"""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._upload, str(local_path), key, content_type)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._pending.setdefault(job_id, []).append((future, str(local_path), key))
+        return future
+
+    def _upload(self, local_path: str, key: str, content_type: Optional[str]):
+        extra_args = {'ContentType': content_type} if content_type else None
+        self.client.upload_file(local_path, self.bucket, key, ExtraArgs=extra_args, Config=self.transfer_config)
+        return key
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Dict:
+        """
+        Block until all uploads queued for a job finish
+
+        Returns:
+            {'uploaded': int, 'failed': [{'path', 's3_key', 'error'}], 'bucket': str}
+        """
+        with self._lock:
+            entries = self._pending.pop(job_id, [])
+
+        done, not_done = wait([f for f, _, _ in entries], timeout=timeout)
+        uploaded = 0
+        failed = []
+        for future, local_path, key in entries:
+            if future in not_done:
+                failed.append({'path': local_path, 's3_key': key, 'error': 'timed out'})
+                continue
+            error = future.exception()
+            if error is None:
+                uploaded += 1
+            else:
+                failed.append({'path': local_path, 's3_key': key, 'error': str(error)})
+
+        if failed:
+            logger.error(f"[{job_id}] {len(failed)}/{len(entries)} S3 uploads failed: "
+                         f"{[f['s3_key'] for f in failed]}")
+        elif entries:
+            logger.info(f"[{job_id}] Uploaded {uploaded} artifacts to s3://{self.bucket}")
+        return {'bucket': self.bucket, 'uploaded': uploaded, 'failed': failed}
+
+    def shutdown(self, wait_for_pending: bool = True):
+        """Stop the pool (optionally finishing queued uploads first)"""
+        self._executor.shutdown(wait=wait_for_pending)
@@ -0,0 +1,13 @@
+"""
+Offline benchmark harness for NutritionVideoPipeline
+Runs process_image / process_video over a fixed corpus with stubbed Gemini and (optionally)
+stub models, and reports per-stage latency percentiles, throughput and peak memory as JSON.
+
+    python -m bench.run_bench run --out bench_results/baseline.json
+    python -m bench.run_bench compare bench_results/baseline.json bench_results/new.json
+
+bench.eval_batch runs the same pipeline over a <category>/<image> tree (Food-101 extraction) with a
+process pool and a resumable results.jsonl:
+
+    python -m bench.eval_batch --out eval_results/run1 --workers 2 --gemini-concurrency 8
+"""
@@ -0,0 +1,98 @@
+"""
+Benchmark corpus
+Sample images shipped at the repo root plus synthetic clips generated deterministically, so every
+run (and every machine) measures the same inputs.
+"""
+from pathlib import Path
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+DOCKER_DIR = Path(__file__).resolve().parent.parent
+REPO_ROOT = DOCKER_DIR.parents[3]
+
+# Fixed sample images (repo root); missing files are skipped with a warning by the runner
+SAMPLE_IMAGES = [
+    "paratha.jpeg",
+    "gemini_test.jpeg",
+    "chicken-curry-recipe.jpg",
+]
+
+# Synthetic clips: name -> (width, height, fps, seconds, number of food blobs)
+SYNTHETIC_CLIPS = {
+    "synthetic_plate_5s_360p": (640, 360, 10, 5, 3),
+    "synthetic_plate_5s_720p": (1280, 720, 15, 5, 4),
+}
+
+
+def make_synthetic_clip(path: Path, width: int, height: int, fps: int, seconds: int, num_items: int, seed: int = 0) -> Path:
+    """
+    Render a plate with coloured food blobs and a slow camera pan / shake (deterministic per seed)
+
+    Args:
+        path: Output .mp4 path
+        width, height: Frame size
+        fps: Frames per second
+        seconds: Clip length
+        num_items: Number of food blobs on the plate
+        seed: RNG seed
+
+    Returns:
+        path
+    """
+    rng = np.random.default_rng(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not open video writer for {path}")
+
+    # Wooden-table texture + plate, rendered once at 1.2x and cropped per frame for the pan
+    canvas_w, canvas_h = int(width * 1.2), int(height * 1.2)
+    table = np.full((canvas_h, canvas_w, 3), (60, 100, 140), dtype=np.uint8)
+    noise = rng.integers(-20, 20, size=(canvas_h, canvas_w, 1), dtype=np.int16)
+    table = np.clip(table.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    center = (canvas_w // 2, canvas_h // 2)
+    plate_radius = int(min(canvas_w, canvas_h) * 0.38)
+    cv2.circle(table, center, plate_radius, (235, 235, 240), -1)
+    for _ in range(num_items):
+        angle = rng.uniform(0, 2 * np.pi)
+        dist = rng.uniform(0.2, 0.55) * plate_radius
+        cx, cy = int(center[0] + dist * np.cos(angle)), int(center[1] + dist * np.sin(angle))
+        axes = (int(rng.uniform(0.15, 0.3) * plate_radius), int(rng.uniform(0.1, 0.22) * plate_radius))
+        color = tuple(int(c) for c in rng.integers(30, 220, size=3))
+        cv2.ellipse(table, (cx, cy), axes, float(rng.uniform(0, 180)), 0, 360, color, -1)
+
+    num_frames = fps * seconds
+    max_dx, max_dy = canvas_w - width, canvas_h - height
+    for i in range(num_frames):
+        t = i / max(1, num_frames - 1)
+        dx = int(t * max_dx * 0.8 + rng.integers(0, 3))
+        dy = int(max_dy / 2 + np.sin(t * 2 * np.pi) * max_dy * 0.3)
+        writer.write(table[dy:dy + height, dx:dx + width])
+    writer.release()
+    return path
+
+
+def build_corpus(work_dir: Path, include_images: bool = True, include_videos: bool = True) -> List[Dict]:
+    """
+    Resolve the corpus into concrete files
+
+    Returns:
+        [{'name', 'path', 'media_type'}] in a fixed order
+    """
+    items = []
+    if include_images:
+        for name in SAMPLE_IMAGES:
+            path = REPO_ROOT / name
+            if path.exists():
+                items.append({'name': name, 'path': path, 'media_type': 'image'})
+            else:
+                print(f"⚠️  Sample image not found, skipping: {path}")
+    if include_videos:
+        for name, (w, h, fps, seconds, num_items) in SYNTHETIC_CLIPS.items():
+            path = work_dir / "corpus" / f"{name}.mp4"
+            if not path.exists():
+                make_synthetic_clip(path, w, h, fps, seconds, num_items)
+            items.append({'name': name, 'path': path, 'media_type': 'video'})
+    return items
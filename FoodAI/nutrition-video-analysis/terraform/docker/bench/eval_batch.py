@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Batch evaluation runner
+
+Runs the production NutritionVideoPipeline (detection + nutrition) over a directory tree of images
+laid out as <root>/<category>/<image>.jpg (gemini/extract_images.py output) and writes one JSON line
+per image with the detected items, totals and per-image latency.
+
+- Local models run in worker processes (--workers), one ModelManager per process
+- In-flight Gemini calls are bounded across all processes (--gemini-concurrency). Each process runs
+  ceil(gemini_concurrency / workers) images at once on threads so their Gemini calls overlap; its
+  local-model stages (SAM2, Metric3D, a local detector) take one lock per model
+- results.jsonl doubles as the manifest: it is appended and flushed per image, so after a crash
+  re-running the same command skips every image already recorded (--retry-failed re-runs errors)
+- results.parquet (latest record per image) is written at the end when pandas + pyarrow are installed
+
+Usage (from the docker/ directory):
+    python -m bench.eval_batch --out eval_results/gemini-2.5 --workers 2 --gemini-concurrency 8
+    python -m bench.eval_batch --categories pizza ramen --limit-per-category 20 --out eval_results/quick
+    python -m bench.eval_batch --gemini replay --fixtures eval_results/fixtures --out eval_results/replay
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+DOCKER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(DOCKER_DIR))
+
+from bench.corpus import REPO_ROOT
+
+DEFAULT_INPUT_DIR = REPO_ROOT / "gemini" / "food101_images"
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+# Per-process state, set by _init_worker
+_worker = {}
+
+# Span name -> model whose lock the span holds (one image at a time per model and process)
+LOCAL_MODEL_SPANS = {'sam2_init': 'sam2', 'sam2_masks': 'sam2', 'sam2_track': 'sam2', 'depth': 'metric3d'}
+LOCAL_DETECTORS = ("florence2", "groundingdino")
+
+
+def discover_images(input_dir: Path, categories: List[str] = None, limit_per_category: int = None) -> List[Dict]:
+    """
+    List <input_dir>/<category>/<image> files in a stable order
+
+    Returns:
+        [{'key', 'path', 'category'}] where key is the path relative to input_dir
+    """
+    items = []
+    for category_dir in sorted(p for p in input_dir.iterdir() if p.is_dir()):
+        if categories and category_dir.name not in categories:
+            continue
+        images = sorted(p for p in category_dir.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+        if limit_per_category:
+            images = images[:limit_per_category]
+        for path in images:
+            items.append({
+                'key': path.relative_to(input_dir).as_posix(),
+                'path': str(path),
+                'category': category_dir.name,
+            })
+    return items
+
+
+def load_manifest(results_path: Path) -> Dict[str, Dict]:
+    """Latest record per image key from results.jsonl (a torn last line from a crash is ignored)"""
+    done = {}
+    if not results_path.exists():
+        return done
+    with open(results_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[record['key']] = record
+    return done
+
+
+def _install_model_locks(detector_backend: str):
+    """
+    Serialize this process's local-model spans across its image threads (one lock per model),
+    so the threads only overlap in Gemini / network-bound stages. Replaces the pipeline's StageTimer.
+    """
+    import app.pipeline
+    from app.timing import StageTimer
+
+    spans = dict(LOCAL_MODEL_SPANS)
+    if detector_backend in LOCAL_DETECTORS:
+        spans['detection'] = detector_backend
+    locks = {model: threading.RLock() for model in set(spans.values())}
+
+    class ModelLockTimer(StageTimer):
+        @contextmanager
+        def span(self, name: str, **counts):
+            model = spans.get(name)
+            if model is None:
+                with super().span(name, **counts) as info:
+                    yield info
+                return
+            # Taken before the span starts: waiting for the model is not stage time
+            with locks[model], super().span(name, **counts) as info:
+                yield info
+
+    app.pipeline.StageTimer = ModelLockTimer
+
+
+def _init_worker(options: Dict, gemini_semaphore):
+    """Worker process setup: one model manager + Gemini setup per worker process"""
+    from app.gemini_transport import limit_gemini_concurrency
+    from bench.run_bench import _make_pipeline
+    from app.timing import configure_logging
+
+    configure_logging("WARNING", "text")
+    args = argparse.Namespace(**options)
+    if args.gemini == "stub":
+        from bench.fakes import StubGeminiTransport, install_stub_gemini
+        install_stub_gemini(StubGeminiTransport(latency_ms=args.gemini_latency_ms))
+
+    work_dir = Path(args.work_dir) / f"worker-{os.getpid()}"
+    new_pipeline = _make_pipeline(args, work_dir)
+    # First pipeline installs the record/replay transport; limit calls on top of it
+    new_pipeline()
+    limit_gemini_concurrency(gemini_semaphore)
+    _install_model_locks(new_pipeline().config.DETECTOR_BACKEND)
+    _worker['new_pipeline'] = new_pipeline
+
+
+def _worker_main(options: Dict, gemini_semaphore, tasks, results, threads: int):
+    """Worker process: `threads` images in flight, pulled from tasks until a None sentinel"""
+    _init_worker(options, gemini_semaphore)
+
+    def drain():
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            results.put(_evaluate_one(item))
+
+    image_threads = [threading.Thread(target=drain, name=f"image-{i}") for i in range(threads)]
+    for thread in image_threads:
+        thread.start()
+    for thread in image_threads:
+        thread.join()
+
+
+def _evaluate_one(item: Dict) -> Dict:
+    """Run one image through the pipeline (on a worker process thread) and summarize the result"""
+    record = {
+        'key': item['key'],
+        'category': item['category'],
+        'worker_pid': os.getpid(),
+        'finished_at': None,
+    }
+    job_id = f"eval-{Path(item['key']).stem}"
+    start = time.perf_counter()
+    try:
+        results = _worker['new_pipeline']().process_image(Path(item['path']), job_id)
+        nutrition = results.get('nutrition') or {}
+        summary = nutrition.get('summary') or {}
+        items = [
+            {
+                'name': entry.get('food_name'),
+                'quantity': entry.get('quantity'),
+                'mass_g': round(float(entry.get('mass_g') or 0), 1),
+                'calories': round(float(entry.get('total_calories') or 0), 1),
+                'matched_food': entry.get('matched_food'),
+            }
+            for entry in nutrition.get('items', [])
+        ]
+        category_words = set(item['category'].lower().split('_'))
+        processing_info = results.get('processing_info') or {}
+        gemini = processing_info.get('gemini_transport') or {}
+        record.update({
+            'status': 'ok',
+            'num_items': len(items),
+            'items': items,
+            'total_mass_g': round(float(summary.get('total_mass_g') or 0), 1),
+            'total_calories_kcal': round(float(summary.get('total_calories_kcal') or 0), 1),
+            # Loose label check: any category word appears in a detected item name
+            'category_match': any(category_words & set((entry['name'] or '').lower().replace('_', ' ').split())
+                                  for entry in items),
+            'gemini_calls': gemini.get('calls'),
+            'gemini_ms': gemini.get('latency_ms'),
+            'stages_ms': {
+                stage: entry['wall_ms']
+                for stage, entry in ((processing_info.get('timings') or {}).get('stages') or {}).items()
+            },
+        })
+    except Exception as e:
+        record.update({'status': 'error', 'error': f"{type(e).__name__}: {e}"})
+    record['latency_ms'] = round((time.perf_counter() - start) * 1000.0, 1)
+    record['finished_at'] = datetime.utcnow().isoformat() + "Z"
+    return record
+
+
+def write_parquet(results_path: Path) -> Path:
+    """Latest record per image as Parquet (needs pandas + pyarrow); returns the path or None"""
+    try:
+        import pandas as pd
+    except ImportError:
+        print("⚠️  pandas not installed - skipping Parquet output (results.jsonl is complete)")
+        return None
+    records = list(load_manifest(results_path).values())
+    if not records:
+        return None
+    frame = pd.DataFrame(records)
+    for column in ('items', 'stages_ms'):
+        if column in frame:
+            frame[column] = frame[column].map(lambda value: json.dumps(value) if value is not None else None)
+    parquet_path = results_path.with_suffix('.parquet')
+    try:
+        frame.to_parquet(parquet_path, index=False)
+    except ImportError as e:
+        print(f"⚠️  Could not write Parquet ({e}) - results.jsonl is complete")
+        return None
+    return parquet_path
+
+
+def summarize(results_path: Path) -> Dict:
+    """Counts, error rate, category match rate and latency percentiles over the latest records"""
+    from bench.run_bench import _percentiles
+
+    records = list(load_manifest(results_path).values())
+    ok = [r for r in records if r.get('status') == 'ok']
+    summary = {
+        'images': len(records),
+        'ok': len(ok),
+        'errors': len(records) - len(ok),
+        'category_match_rate': round(sum(1 for r in ok if r.get('category_match')) / len(ok), 3) if ok else None,
+    }
+    if ok:
+        summary['latency_ms'] = _percentiles([r['latency_ms'] for r in ok])
+        gemini_ms = [r['gemini_ms'] for r in ok if r.get('gemini_ms') is not None]
+        if gemini_ms:
+            summary['gemini_ms'] = _percentiles(gemini_ms)
+    return summary
+
+
+def run(args):
+    input_dir = Path(args.input_dir)
+    if not input_dir.is_dir():
+        raise SystemExit(f"❌ Input directory not found: {input_dir}")
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    results_path = out_dir / "results.jsonl"
+
+    items = discover_images(input_dir, args.categories, args.limit_per_category)
+    done = load_manifest(results_path)
+    pending = [
+        item for item in items
+        if item['key'] not in done or (args.retry_failed and done[item['key']].get('status') != 'ok')
+    ]
+    print(f"📋 {len(items)} image(s) in {input_dir}: {len(items) - len(pending)} already done, {len(pending)} to run")
+    threads = math.ceil(args.gemini_concurrency / args.workers)
+    print(f"   workers={args.workers} x {threads} image thread(s), gemini concurrency={args.gemini_concurrency}, "
+          f"models={args.models}, gemini={args.gemini}, device={args.device}")
+    sys.stdout.flush()
+
+    if pending:
+        options = {
+            'models': args.models,
+            'gemini': args.gemini,
+            'fixtures': args.fixtures,
+            'gemini_latency_ms': args.gemini_latency_ms,
+            'gemini_error_rate': 0.0,
+            'device': args.device,
+            'work_dir': args.work_dir or tempfile.mkdtemp(prefix="nutrition-eval-"),
+        }
+        # spawn: CUDA and the model libraries do not survive fork
+        context = multiprocessing.get_context("spawn")
+        gemini_semaphore = context.BoundedSemaphore(args.gemini_concurrency)
+        tasks, results = context.Queue(), context.Queue()
+        for item in pending:
+            tasks.put(item)
+        for _ in range(args.workers * threads):
+            tasks.put(None)
+        workers = [
+            context.Process(target=_worker_main, args=(options, gemini_semaphore, tasks, results, threads),
+                            name=f"eval-worker-{i}")
+            for i in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        start = time.perf_counter()
+        completed = errors = 0
+        with open(results_path, "a") as results_file:
+            while completed < len(pending):
+                try:
+                    record = results.get(timeout=5)
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        raise SystemExit(f"❌ Worker processes exited with {len(pending) - completed} image(s) "
+                                         f"unfinished - re-run the same command to resume")
+                    continue
+                results_file.write(json.dumps(record, default=str) + "\n")
+                results_file.flush()
+                completed += 1
+                if record['status'] != 'ok':
+                    errors += 1
+                    print(f"  ❌ {record['key']}: {record.get('error')}")
+                if completed % 25 == 0 or completed == len(pending):
+                    rate = completed / (time.perf_counter() - start)
+                    print(f"  {completed}/{len(pending)} done ({errors} errors, {rate:.2f} images/s)")
+                    sys.stdout.flush()
+        for worker in workers:
+            worker.join()
+
+    summary = summarize(results_path)
+    (out_dir / "summary.json").write_text(json.dumps(summary, indent=2))
+    parquet_path = write_parquet(results_path)
+    print(f"\n✓ {summary['ok']}/{summary['images']} images OK, {summary['errors']} errors, "
+          f"category match {summary['category_match_rate']}")
+    print(f"  Results: {results_path}" + (f", {parquet_path}" if parquet_path else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch evaluation over <category>/<image> directories")
+    parser.add_argument("--input-dir", type=str, default=str(DEFAULT_INPUT_DIR),
+                        help="Root with one sub-directory per category (default: gemini/food101_images)")
+    parser.add_argument("--out", type=str, required=True, help="Output dir (results.jsonl, results.parquet, summary.json)")
+    parser.add_argument("--categories", type=str, nargs="+", default=None, help="Only these categories")
+    parser.add_argument("--limit-per-category", type=int, default=None, help="First N images per category")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (each loads the local models)")
+    parser.add_argument("--gemini-concurrency", type=int, default=4,
+                        help="Max in-flight Gemini calls across all workers (also sets images in flight per worker)")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-run images whose last record is an error")
+    parser.add_argument("--models", choices=["stub", "real"], default="real")
+    parser.add_argument("--gemini", choices=["live", "record", "replay", "stub"], default="live",
+                        help="live = real API (GEMINI_API_KEY); record/replay = GEMINI_TRANSPORT fixtures")
+    parser.add_argument("--fixtures", type=str, default=None, help="Fixture dir for --gemini record/replay")
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0,
+                        help="Simulated latency per stub/replayed Gemini call (replay: 0 = recorded latency)")
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--work-dir", type=str, default=None, help="Scratch dir for pipeline outputs (default: temp dir)")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be >= 1")
+    if args.gemini_concurrency < 1:
+        parser.error("--gemini-concurrency must be >= 1")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
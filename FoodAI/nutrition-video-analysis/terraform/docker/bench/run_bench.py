@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+End-to-end pipeline benchmark
+
+Runs process_image / process_video over the fixed corpus (bench/corpus.py) and writes a JSON report
+with per-stage latency percentiles (from processing_info.timings), throughput and peak memory.
+
+Usage (from the docker/ directory):
+    # Fully offline: stub Gemini + stub models (no network, no GPU, no checkpoints)
+    python -m bench.run_bench run --out bench_results/baseline.json
+
+    # Real model weights, stub Gemini with 800 ms simulated latency
+    python -m bench.run_bench run --models real --gemini-latency-ms 800 --out bench_results/real.json
+
+    # Record real Gemini answers once, then replay them (recorded latency, 5% injected errors)
+    python -m bench.run_bench run --gemini record --fixtures bench_results/fixtures --repeat 1 --warmup 0
+    python -m bench.run_bench run --gemini replay --fixtures bench_results/fixtures --gemini-error-rate 0.05
+
+    # Compare two runs (exit 1 on regressions with --fail-on-regression)
+    python -m bench.run_bench compare bench_results/baseline.json bench_results/new.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+DOCKER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(DOCKER_DIR))
+
+PERCENTILES = (50, 90, 99)
+
+
+def _percentiles(values: List[float]) -> Dict:
+    arr = np.asarray(values, dtype=np.float64)
+    stats = {f"p{p}": round(float(np.percentile(arr, p)), 1) for p in PERCENTILES}
+    stats["mean"] = round(float(arr.mean()), 1)
+    stats["n"] = int(arr.size)
+    return stats
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=DOCKER_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def _make_pipeline(args, work_dir: Path):
+    """Settings + model manager + pipeline factory for the requested mode"""
+    # Never upload benchmark artifacts (pipeline reads this at import time)
+    os.environ.pop("S3_RESULTS_BUCKET", None)
+
+    from app.config import Settings
+    from app.pipeline import NutritionVideoPipeline
+
+    overrides = {
+        "DEVICE": args.device,
+        "LOG_LEVEL": "WARNING",
+        "STAGE_TIMING_ENABLED": True,
+    }
+    if args.gemini in ("record", "replay"):
+        overrides.update({
+            "GEMINI_TRANSPORT": args.gemini,
+            "GEMINI_REPLAY_LATENCY_MS": args.gemini_latency_ms if args.gemini_latency_ms else None,
+            "GEMINI_REPLAY_ERROR_RATE": args.gemini_error_rate,
+        })
+    config = Settings(**overrides)
+    if args.gemini in ("stub", "replay") and not config.GEMINI_API_KEY:
+        config.GEMINI_API_KEY = "offline-benchmark"
+    # Set after construction: the local-paths validator would override constructor values
+    config.OUTPUT_DIR = work_dir / "outputs"
+    config.UPLOAD_DIR = work_dir / "uploads"
+    if args.fixtures:
+        config.GEMINI_FIXTURES_DIR = Path(args.fixtures)
+    config.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    if args.models == "stub":
+        from bench.fakes import StubModelManager
+        model_manager = StubModelManager(config)
+    else:
+        from app.models import ModelManager
+        model_manager = ModelManager(config)
+
+    return lambda: NutritionVideoPipeline(model_manager, config)
+
+
+def run(args) -> Dict:
+    from bench.corpus import build_corpus
+    from app.timing import configure_logging
+
+    configure_logging("WARNING", "text")
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="nutrition-bench-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    transport = None
+    if args.gemini == "stub":
+        from bench.fakes import StubGeminiTransport, install_stub_gemini
+        transport = StubGeminiTransport(latency_ms=args.gemini_latency_ms)
+        install_stub_gemini(transport)
+
+    corpus = build_corpus(work_dir, include_images=not args.videos_only, include_videos=not args.images_only)
+    if not corpus:
+        raise SystemExit("❌ Empty corpus")
+    new_pipeline = _make_pipeline(args, work_dir)
+
+    print(f"📊 Benchmark: {len(corpus)} item(s) x {args.repeat} run(s) (+{args.warmup} warmup), "
+          f"models={args.models}, gemini={args.gemini}, device={args.device}")
+    sys.stdout.flush()
+
+    jobs = []
+    for iteration in range(args.warmup + args.repeat):
+        warmup = iteration < args.warmup
+        for item in corpus:
+            pipeline = new_pipeline()
+            job_id = f"bench-{item['name']}-{iteration}"
+            start = time.perf_counter()
+            if item['media_type'] == 'image':
+                results = pipeline.process_image(item['path'], job_id)
+            else:
+                results = pipeline.process_video(item['path'], job_id)
+            wall_ms = (time.perf_counter() - start) * 1000.0
+            processing_info = results.get('processing_info') or {}
+            timings = processing_info.get('timings') or {}
+            print(f"  {'(warmup) ' if warmup else ''}{item['name']}: {wall_ms:.0f} ms, "
+                  f"{len(results.get('tracking', {}).get('objects', {}))} objects")
+            sys.stdout.flush()
+            if warmup:
+                continue
+            jobs.append({
+                'name': item['name'],
+                'media_type': item['media_type'],
+                'iteration': iteration - args.warmup,
+                'wall_ms': round(wall_ms, 1),
+                'frames': results.get('num_frames_processed', 0),
+                'objects': len(results.get('tracking', {}).get('objects', {})),
+                'stages': {stage: entry['wall_ms'] for stage, entry in timings.get('stages', {}).items()},
+                'rss_mb': timings.get('rss_mb'),
+                'rss_delta_mb': timings.get('rss_delta_mb'),
+                'peak_cuda_mb': max((s.get('peak_cuda_mb', 0) for s in timings.get('spans', [])), default=None),
+                'counters': timings.get('counters', {}),
+                'gemini': processing_info.get('gemini_transport'),
+            })
+
+    return {
+        'created_at': datetime.utcnow().isoformat() + "Z",
+        'environment': {
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'torch': _torch_version(),
+            'device': args.device,
+        },
+        'settings': {
+            'models': args.models,
+            'gemini': args.gemini,
+            'gemini_latency_ms': args.gemini_latency_ms,
+            'gemini_error_rate': args.gemini_error_rate,
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+        },
+        'gemini_stub_calls': transport.calls if transport is not None else None,
+        'summary': summarize(jobs),
+        'jobs': jobs,
+    }
+
+
+def _torch_version() -> str:
+    try:
+        import torch
+        return torch.__version__
+    except ImportError:
+        return "not installed"
+
+
+def summarize(jobs: List[Dict]) -> Dict:
+    """Per media type: job latency and per-stage percentiles, throughput, memory"""
+    summary = {}
+    for media_type in sorted({job['media_type'] for job in jobs}):
+        group = [job for job in jobs if job['media_type'] == media_type]
+        total_sec = sum(job['wall_ms'] for job in group) / 1000.0
+        stage_values: Dict[str, List[float]] = {}
+        for job in group:
+            for stage, wall_ms in job['stages'].items():
+                stage_values.setdefault(stage, []).append(wall_ms)
+        peak_cuda = [job['peak_cuda_mb'] for job in group if job.get('peak_cuda_mb')]
+        # Time inside Gemini calls (record/replay only) vs everything else
+        gemini_ms = [job['gemini']['latency_ms'] for job in group if job.get('gemini')]
+        summary[media_type] = {
+            'jobs': len(group),
+            'job_wall_ms': _percentiles([job['wall_ms'] for job in group]),
+            'throughput_jobs_per_sec': round(len(group) / total_sec, 3) if total_sec else None,
+            'throughput_frames_per_sec': round(sum(job['frames'] for job in group) / total_sec, 3) if total_sec else None,
+            'max_rss_mb': max((job['rss_mb'] or 0 for job in group), default=None),
+            'rss_delta_mb': _percentiles([job['rss_delta_mb'] for job in group if job.get('rss_delta_mb') is not None]),
+            'peak_cuda_mb': max(peak_cuda) if peak_cuda else None,
+            'stages': {stage: _percentiles(values) for stage, values in sorted(stage_values.items())},
+        }
+        if gemini_ms:
+            summary[media_type]['gemini_ms'] = _percentiles(gemini_ms)
+            summary[media_type]['non_gemini_ms'] = _percentiles(
+                [job['wall_ms'] - job['gemini']['latency_ms'] for job in group if job.get('gemini')]
+            )
+    return summary
+
+
+def compare(baseline: Dict, candidate: Dict, threshold_pct: float, min_delta_ms: float) -> List[Dict]:
+    """
+    Stage-by-stage p50 comparison
+
+    Returns:
+        Rows with baseline/candidate p50, delta and a regression flag (slower by more than
+        threshold_pct and min_delta_ms)
+    """
+    rows = []
+    for media_type, base in baseline['summary'].items():
+        cand = candidate['summary'].get(media_type)
+        if cand is None:
+            continue
+        entries = [("(job)", base['job_wall_ms'], cand['job_wall_ms'])]
+        for stage in sorted(set(base['stages']) | set(cand['stages'])):
+            entries.append((stage, base['stages'].get(stage), cand['stages'].get(stage)))
+        for stage, b, c in entries:
+            row = {'media_type': media_type, 'stage': stage,
+                   'baseline_p50': b['p50'] if b else None, 'candidate_p50': c['p50'] if c else None}
+            if b and c:
+                delta = c['p50'] - b['p50']
+                row['delta_ms'] = round(delta, 1)
+                row['delta_pct'] = round(100.0 * delta / b['p50'], 1) if b['p50'] else None
+                row['regression'] = bool(
+                    delta > min_delta_ms and row['delta_pct'] is not None and row['delta_pct'] > threshold_pct
+                )
+            rows.append(row)
+    return rows
+
+
+def _print_comparison(rows: List[Dict]):
+    def fmt(value, suffix=""):
+        return "-" if value is None else f"{value:.1f}{suffix}"
+
+    print(f"{'media':<6} {'stage':<42} {'base p50':>10} {'new p50':>10} {'delta':>10} {'delta %':>9}")
+    for row in rows:
+        flag = "  ⚠️ regression" if row.get('regression') else ""
+        print(f"{row['media_type']:<6} {row['stage']:<42} {fmt(row['baseline_p50']):>10} "
+              f"{fmt(row['candidate_p50']):>10} {fmt(row.get('delta_ms')):>10} "
+              f"{fmt(row.get('delta_pct'), '%'):>9}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nutrition pipeline benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="Run the benchmark corpus")
+    run_p.add_argument("--out", type=str, default="bench_results/latest.json", help="Report path")
+    run_p.add_argument("--repeat", type=int, default=3, help="Measured runs per corpus item")
+    run_p.add_argument("--warmup", type=int, default=1, help="Unmeasured warmup runs per corpus item")
+    run_p.add_argument("--models", choices=["stub", "real"], default="stub",
+                       help="stub = random-weight / box-mask stand-ins; real = ModelManager checkpoints")
+    run_p.add_argument("--gemini", choices=["stub", "replay", "record", "live"], default="stub",
+                       help="stub = canned offline responses; replay/record = GEMINI_TRANSPORT fixtures; "
+                            "live = real API (needs GEMINI_API_KEY)")
+    run_p.add_argument("--fixtures", type=str, default=None, help="Fixture dir for --gemini record/replay")
+    run_p.add_argument("--gemini-latency-ms", type=float, default=0.0,
+                       help="Simulated latency per stub/replayed Gemini call (replay: 0 = recorded latency)")
+    run_p.add_argument("--gemini-error-rate", type=float, default=0.0, help="Replay: fraction of calls failing")
+    run_p.add_argument("--device", type=str, default="cpu")
+    run_p.add_argument("--images-only", action="store_true")
+    run_p.add_argument("--videos-only", action="store_true")
+    run_p.add_argument("--work-dir", type=str, default=None, help="Corpus/output scratch dir (default: temp dir)")
+
+    cmp_p = sub.add_parser("compare", help="Compare two benchmark reports")
+    cmp_p.add_argument("baseline", type=str)
+    cmp_p.add_argument("candidate", type=str)
+    cmp_p.add_argument("--threshold-pct", type=float, default=10.0, help="Regression threshold on p50 (%%)")
+    cmp_p.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore p50 changes smaller than this")
+    cmp_p.add_argument("--fail-on-regression", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run(args)
+        out = Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(report, indent=2, default=str))
+        print(f"\n✓ Report written to {out}")
+        for media_type, stats in report['summary'].items():
+            print(f"  {media_type}: p50 {stats['job_wall_ms']['p50']:.0f} ms/job, "
+                  f"{stats['throughput_jobs_per_sec']} jobs/s, max RSS {stats['max_rss_mb']} MB")
+        return
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    candidate = json.loads(Path(args.candidate).read_text())
+    rows = compare(baseline, candidate, args.threshold_pct, args.min_delta_ms)
+    print(f"Baseline:  {args.baseline} ({baseline['environment'].get('git_commit')})")
+    print(f"Candidate: {args.candidate} ({candidate['environment'].get('git_commit')})\n")
+    _print_comparison(rows)
+    regressions = [row for row in rows if row.get('regression')]
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} stage(s) regressed by more than {args.threshold_pct}%")
+        if args.fail_on_regression:
+            sys.exit(1)
+    else:
+        print("\n✓ No regressions")
+
+
+if __name__ == "__main__":
+    main()
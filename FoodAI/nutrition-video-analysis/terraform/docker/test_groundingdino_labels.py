@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Check that GroundingDINO phrases map back to the right FOOD_VOCABULARY class
+(NutritionVideoPipeline._groundingdino_class): compound foods such as "fried rice" must keep their
+own class instead of the shorter one listed before them ("rice"), which is what the vendored
+Model.phrases2classes returns.
+
+Usage:
+    python test_groundingdino_labels.py
+"""
+import ast
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+APP_DIR = Path(__file__).parent / "app"
+
+# Predicted phrase -> expected class
+CASES = {
+    "fried rice": "fried rice",
+    "rice": "rice",
+    "fried chicken": "fried chicken",
+    "chicken": "chicken",
+    "fried egg": "fried egg",
+    "mashed potatoes": "mashed potatoes",
+    "potato": "potato",
+    "french fries": "french fries",
+    "spicy fried rice": "fried rice",
+    " Fried Rice ": "fried rice",
+    "table": None,
+}
+
+
+def load_vocabulary() -> List[str]:
+    """FOOD_VOCABULARY default from app/config.py (without importing pydantic)"""
+    tree = ast.parse((APP_DIR / "config.py").read_text(encoding="utf-8"))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.AnnAssign) and getattr(node.target, "id", None) == "FOOD_VOCABULARY":
+            return ast.literal_eval(node.value)
+    raise SystemExit("❌ FOOD_VOCABULARY not found in app/config.py")
+
+
+def load_mapper():
+    """_groundingdino_class from app/pipeline.py without importing it (avoids torch and the model stack)"""
+    tree = ast.parse((APP_DIR / "pipeline.py").read_text(encoding="utf-8"))
+    pipeline_cls = next(node for node in tree.body
+                        if isinstance(node, ast.ClassDef) and node.name == "NutritionVideoPipeline")
+    method = next(node for node in pipeline_cls.body
+                  if isinstance(node, ast.FunctionDef) and node.name == "_groundingdino_class")
+    method.decorator_list = []
+    module = ast.fix_missing_locations(ast.Module(body=[method], type_ignores=[]))
+    namespace = {'List': List, 'Optional': Optional}
+    exec(compile(module, str(APP_DIR / "pipeline.py"), "exec"), namespace)
+    return namespace['_groundingdino_class']
+
+
+def first_substring_class(phrase: str, classes: List[str]) -> Optional[str]:
+    """Vendored phrases2classes rule, for comparison"""
+    return next((cls for cls in classes if cls in phrase), None)
+
+
+def main():
+    classes = load_vocabulary()
+    to_class = load_mapper()
+    failures = 0
+    for phrase, expected in CASES.items():
+        got = to_class(phrase, classes)
+        status = "✓" if got == expected else "❌"
+        failures += got != expected
+        print(f"  {status} {phrase!r:22} -> {got!r:20} (first-substring rule: {first_substring_class(phrase, classes)!r})")
+    # Every vocabulary class predicted verbatim must come back as itself
+    for cls in classes:
+        if to_class(cls, classes) != cls:
+            print(f"  ❌ {cls!r} -> {to_class(cls, classes)!r}")
+            failures += 1
+    if failures:
+        print(f"❌ {failures} phrase(s) mapped to the wrong class")
+        sys.exit(1)
+    print(f"✓ All {len(CASES)} phrases and {len(classes)} vocabulary classes map to the right class")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Parity check for the vectorized per-frame volume kernel (NutritionVideoPipeline._calculate_volumes_metric3d)
+against the previous one-object-at-a-time implementation, on randomized frames covering overlapping
+masks, empty masks, zero depths, missing calibration and a missing reference plane.
+
+Usage:
+    python test_volume_parity.py
+    python test_volume_parity.py --trials 1000 --seed 3
+"""
+import ast
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+PIPELINE_PATH = Path(__file__).parent / "app" / "pipeline.py"
+LABELS = ['rice', 'french fries', 'plate', 'glass of water', 'burger', 'chicken curry',
+          'chips', 'cup', 'salad', 'flat bread', 'pizza', 'soup bowl']
+TYPICAL_MAX_VOLUMES = {
+    'burger': 500, 'sandwich': 500, 'cheeseburger': 500, 'hamburger': 500,
+    'fries': 200, 'french fries': 200, 'potato': 200,
+    'pizza': 1000, 'salad': 500, 'soup': 500,
+    'ice cream': 300, 'nugget': 100, 'chicken': 300
+}
+
+
+def load_kernel():
+    """
+    Pull the volume methods out of app/pipeline.py without importing it (avoids loading torch, boto3
+    and the model stack); the timing decorator is dropped
+    """
+    tree = ast.parse(PIPELINE_PATH.read_text(encoding="utf-8"))
+    pipeline_cls = next(node for node in tree.body
+                        if isinstance(node, ast.ClassDef) and node.name == "NutritionVideoPipeline")
+    methods = []
+    for node in pipeline_cls.body:
+        if isinstance(node, ast.FunctionDef) and node.name in ("_segment_percentiles", "_calculate_volumes_metric3d"):
+            node.decorator_list = [d for d in node.decorator_list if isinstance(d, ast.Name) and d.id == "staticmethod"]
+            methods.append(node)
+    kernel_cls = ast.ClassDef(name="VolumeKernel", bases=[], keywords=[], body=methods, decorator_list=[])
+    module = ast.fix_missing_locations(ast.Module(body=[kernel_cls], type_ignores=[]))
+    namespace = {'np': np, 'Dict': Dict, 'logger': logging.getLogger("volume_parity")}
+    exec(compile(module, str(PIPELINE_PATH), "exec"), namespace)
+    return namespace['VolumeKernel']
+
+
+def reference_volume(calibration: Dict, mask, depth_map_meters, label: str) -> Dict:
+    """Previous per-object implementation (one boolean index and four percentile sorts per object)"""
+    mask_bool = mask.astype(bool)
+    depth_values_m = depth_map_meters[mask_bool]
+    if len(depth_values_m) == 0 or not calibration['calibrated']:
+        return {'volume_ml': 0.0, 'avg_height_cm': 0.0, 'surface_area_cm2': 0.0}
+
+    pixel_count = mask_bool.sum()
+    surface_area_cm2 = pixel_count / (calibration['pixels_per_cm'] ** 2)
+    valid_depths = depth_values_m[depth_values_m > 0]
+    if len(valid_depths) == 0:
+        return {'volume_ml': 0.0, 'avg_height_cm': 0.0, 'surface_area_cm2': surface_area_cm2}
+
+    reference_plane_depth_m = calibration.get('reference_plane_depth_m')
+    if reference_plane_depth_m is not None and reference_plane_depth_m > 0:
+        object_top_depth_m = np.percentile(valid_depths, 10)
+        object_bottom_depth_m = np.percentile(valid_depths, 90)
+        height_above_plane_m = reference_plane_depth_m - object_top_depth_m
+        depth_variation_m = object_bottom_depth_m - object_top_depth_m
+        raw_height_cm = max(0, max(height_above_plane_m, depth_variation_m) * 100)
+    else:
+        raw_height_cm = max(0, (np.percentile(valid_depths, 75) - np.percentile(valid_depths, 15)) * 100)
+
+    estimated_diameter_cm = 2 * np.sqrt(surface_area_cm2 / np.pi)
+    label_lower = label.lower()
+    is_flat_item = any(word in label_lower for word in ['fries', 'chips', 'crisps', 'potato', 'flat'])
+    if 'plate' in label_lower:
+        height_cm = min(raw_height_cm, 2.5) if raw_height_cm > 5 else max(raw_height_cm, 1.5)
+    elif any(word in label_lower for word in ['glass', 'cup']):
+        height_cm = max(raw_height_cm, 8) if raw_height_cm < 3 else min(raw_height_cm, 15)
+    elif is_flat_item:
+        height_cm = min(max(min(raw_height_cm, estimated_diameter_cm * 0.05), 0.3), 2.0)
+    else:
+        height_cm = min(raw_height_cm, estimated_diameter_cm * 0.25)
+        if estimated_diameter_cm < 5:
+            height_cm = min(height_cm, 3.0)
+        elif estimated_diameter_cm < 10:
+            height_cm = min(height_cm, 6.0)
+        else:
+            height_cm = min(height_cm, 10.0)
+        height_cm = max(height_cm, 1.0)
+
+    if is_flat_item:
+        shape_factor = 0.4
+    elif estimated_diameter_cm < 5:
+        shape_factor = 0.5
+    elif estimated_diameter_cm < 10:
+        shape_factor = 0.6
+    else:
+        shape_factor = 0.65
+    volume_ml = surface_area_cm2 * height_cm * shape_factor
+
+    max_reasonable_volume = (estimated_diameter_cm ** 3) * 0.5
+    matched_max = next((max_vol for food_type, max_vol in TYPICAL_MAX_VOLUMES.items() if food_type in label_lower), None)
+    if matched_max:
+        max_reasonable_volume = min(max_reasonable_volume, matched_max)
+    volume_ml = min(volume_ml, min(max_reasonable_volume, 1000.0))
+
+    return {
+        'volume_ml': float(volume_ml),
+        'avg_height_cm': float(height_cm),
+        'surface_area_cm2': float(surface_area_cm2),
+        'diameter_cm': float(estimated_diameter_cm)
+    }
+
+
+def make_frame(rng, height, width):
+    """Random depth map plus 1-8 box masks (some empty, overlaps allowed)"""
+    depth = rng.uniform(0.3, 0.7, size=(height, width)).astype(np.float32)
+    depth[rng.random((height, width)) < 0.05] = 0  # Missing depth pixels
+    masks, labels = {}, {}
+    for obj_id in range(1, rng.integers(1, 9) + 1):
+        mask = np.zeros((height, width), dtype=bool)
+        if rng.random() > 0.1:
+            y0, x0 = rng.integers(0, height - 5), rng.integers(0, width - 5)
+            mask[y0:y0 + rng.integers(1, height // 2), x0:x0 + rng.integers(1, width // 2)] = True
+        if rng.random() < 0.05:
+            depth[mask] = 0  # Object without any valid depth
+        masks[obj_id] = mask[None]  # SAM2 masks are 1xHxW
+        labels[obj_id] = LABELS[rng.integers(len(LABELS))]
+    return depth, masks, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized volume kernel vs per-object reference parity check")
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--height", type=int, default=120)
+    parser.add_argument("--width", type=int, default=160)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)  # The kernel warns on every frame without a reference plane
+    kernel = load_kernel()()
+    rng = np.random.default_rng(args.seed)
+    max_err = 0.0
+    objects = 0
+    kernel_s = reference_s = 0.0
+    for trial in range(args.trials):
+        depth, masks, labels = make_frame(rng, args.height, args.width)
+        kernel.calibration = {
+            'calibrated': trial % 13 != 0,
+            'pixels_per_cm': float(rng.uniform(3.0, 20.0)),
+            'reference_plane_depth_m': (0.5, None)[trial % 2],
+        }
+        start = time.perf_counter()
+        got = kernel._calculate_volumes_metric3d(masks, depth, labels)
+        kernel_s += time.perf_counter() - start
+        for obj_id, mask in masks.items():
+            start = time.perf_counter()
+            expected = reference_volume(kernel.calibration, mask[0], depth, labels[obj_id])
+            reference_s += time.perf_counter() - start
+            if set(expected) != set(got[obj_id]):
+                print(f"❌ Trial {trial}, object {obj_id} ({labels[obj_id]}): keys {sorted(got[obj_id])} != {sorted(expected)}")
+                sys.exit(1)
+            for key, value in expected.items():
+                max_err = max(max_err, abs(value - got[obj_id][key]))
+            objects += 1
+
+    print(f"{args.trials} frames, {objects} objects | Reference: {reference_s * 1000:.1f} ms | "
+          f"Vectorized: {kernel_s * 1000:.1f} ms | max |diff| = {max_err:.2e}")
+    if max_err > args.atol:
+        print(f"❌ Parity check failed (atol={args.atol})")
+        sys.exit(1)
+    print("✓ Vectorized volume kernel matches the per-object implementation")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 """
 ECS Worker - Polls SQS queue and processes video files for nutrition analysis.
+
+WORKER_PROCESSES > 1 runs in pre-fork mode: the parent loads the models once, then forks that
+many job processes that each poll the queue and share the weights copy-on-write.
+On a GPU (DEVICE=cuda) this needs an inference server owning the GPU copies of SAM2 image
+segmentation and Metric3D, which batches them across the job processes:
+    WORKER_PROCESSES=4 WORKER_INFERENCE_SERVER=true python3 worker.py   # server started by the worker
+    WORKER_PROCESSES=4 INFERENCE_SERVER_ADDRESS=... INFERENCE_SERVER_AUTHKEY=... python3 worker.py
+                                                   # server run separately (python -m app.inference_server)
+Each job process still loads its own detector and SAM2 video predictor on the GPU after the fork.
 """
 
 # VERSION CHECK: This ensures we're running the latest code (no mock fallback)
@@ -37,6 +46,7 @@ patch_applied = patch_transformers_utils()
 import numpy as np
 print(f"✅ NumPy {np.__version__} imported before PyTorch")
 
+import gzip
 import json
 import os
 import sys
@@ -68,6 +78,21 @@ MAX_FRAMES = int(os.environ.get('MAX_FRAMES', '60'))
 FRAME_SKIP = int(os.environ.get('FRAME_SKIP', '10'))
 DETECTION_INTERVAL = int(os.environ.get('DETECTION_INTERVAL', '30'))
 
+# Results layout: "sectioned" = compact gzip summary + separately fetchable detail sections, "legacy" = one results.json
+RESULTS_FORMAT = os.environ.get('RESULTS_FORMAT', 'sectioned').strip().lower()
+RESULTS_FORMAT_VERSION = 2
+
+# Pre-fork mode: job processes sharing one copy of the model weights (1 = single process, no fork)
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', '1'))
+# Torch intra-op threads per job process (0 = CPU cores / WORKER_PROCESSES)
+WORKER_TORCH_THREADS = int(os.environ.get('WORKER_TORCH_THREADS', '0'))
+# Pre-fork mode: also run an inference server process (SAM2 image / Metric3D batched across the job
+# processes). Its socket secret is random per run unless INFERENCE_SERVER_AUTHKEY is set
+WORKER_INFERENCE_SERVER = os.environ.get('WORKER_INFERENCE_SERVER', 'false').strip().lower() == 'true'
+# A job process that dies sooner than this after start is restarted with exponential backoff (up to the max)
+WORKER_RESTART_HEALTHY_SECONDS = 60
+WORKER_RESTART_MAX_DELAY = 300
+
 
 def convert_floats_to_decimal(obj):
     """Recursively convert floats to Decimal for DynamoDB compatibility."""
@@ -111,18 +136,96 @@ def download_media(s3_bucket: str, s3_key: str, local_path: str):
     print(f"Downloaded to {local_path}")
 
 
+def _gzip_json(obj) -> bytes:
+    """Compact JSON (no indentation / spaces), gzip-compressed"""
+    return gzip.compress(json.dumps(obj, separators=(',', ':'), default=str).encode('utf-8'), compresslevel=6)
+
+
+def split_results(results: dict):
+    """
+    Split worker results into a compact summary and heavy detail sections.
+
+    full_results repeats tracking / detected_items, so it is not stored as-is: its unique
+    parts go to sections and its small scalar fields to the summary.
+
+    Returns:
+        (summary dict, {section_name: section dict})
+    """
+    full = results.get('full_results') or {}
+    tracking = dict(results.get('tracking') or full.get('tracking') or {})
+    mask_files = tracking.pop('mask_files', None)
+    processing_info = dict(results.get('processing_info') or {})
+    timings = processing_info.pop('timings', None)
+    if timings:
+        processing_info['total_wall_ms'] = timings.get('total_wall_ms')
+
+    sections = {
+        'tracking': tracking,
+        'detections': {
+            'florence_detections': full.get('florence_detections', []),
+            'frame_selection': full.get('frame_selection'),
+            'calibration': full.get('calibration'),
+        },
+        'masks': {
+            'mask_files': mask_files or [],
+            'uploads': full.get('uploads'),
+        },
+    }
+    if timings:
+        sections['timings'] = timings
+
+    summary = {key: value for key, value in results.items() if key not in ('full_results', 'tracking', 'processing_info')}
+    summary['processing_info'] = processing_info
+    summary['results_format_version'] = RESULTS_FORMAT_VERSION
+    # Small scalar fields of the pipeline result (media name, timestamp, frame count, status)
+    for key, value in full.items():
+        if key not in summary and not isinstance(value, (dict, list)):
+            summary[key] = value
+    nutrition = full.get('nutrition') or {}
+    if nutrition.get('unquantified_ingredients'):
+        summary['unquantified_ingredients'] = nutrition['unquantified_ingredients']
+    return summary, sections
+
+
 def upload_results(job_id: str, results: dict):
-    """Upload results to S3."""
-    results_key = f'results/{job_id}/results.json'
+    """Upload results to S3 (returns the key of the summary document)."""
+    if RESULTS_FORMAT == 'legacy':
+        results_key = f'results/{job_id}/results.json'
+        s3.put_object(
+            Bucket=S3_RESULTS_BUCKET,
+            Key=results_key,
+            Body=json.dumps(results, indent=2, default=str),
+            ContentType='application/json'
+        )
+        print(f"Results uploaded to s3://{S3_RESULTS_BUCKET}/{results_key}")
+        return results_key
+
+    summary, sections = split_results(results)
+    summary['sections'] = {}
+    for name, section in sections.items():
+        key = f'results/{job_id}/sections/{name}.json.gz'
+        body = _gzip_json(section)
+        s3.put_object(
+            Bucket=S3_RESULTS_BUCKET,
+            Key=key,
+            Body=body,
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+        summary['sections'][name] = {'key': key, 'bytes': len(body)}
 
+    results_key = f'results/{job_id}/summary.json.gz'
+    body = _gzip_json(summary)
     s3.put_object(
         Bucket=S3_RESULTS_BUCKET,
         Key=results_key,
-        Body=json.dumps(results, indent=2, default=str),
-        ContentType='application/json'
+        Body=body,
+        ContentType='application/json',
+        ContentEncoding='gzip'
     )
-
-    print(f"Results uploaded to s3://{S3_RESULTS_BUCKET}/{results_key}")
+    total = len(body) + sum(info['bytes'] for info in summary['sections'].values())
+    print(f"Results uploaded to s3://{S3_RESULTS_BUCKET}/{results_key} "
+          f"(summary {len(body)} B + {len(sections)} sections, {total} B gzip total)")
     return results_key
 
 
@@ -212,7 +315,8 @@ def process_media(media_path: str, job_id: str) -> dict:
                 'frames_processed': results.get('num_frames_processed', 0),
                 'device': DEVICE,
                 'mock': False,
-                'calibration': results.get('calibration', {})
+                'calibration': results.get('calibration', {}),
+                'timings': results.get('processing_info', {}).get('timings')
             },
             'tracking': results.get('tracking', {}),
             'full_results': results
@@ -294,7 +398,8 @@ def process_video(video_path: str, job_id: str) -> dict:
                 'frames_processed': results.get('num_frames_processed', 0),
                 'device': DEVICE,
                 'mock': False,
-                'calibration': results.get('calibration', {})
+                'calibration': results.get('calibration', {}),
+                'timings': results.get('processing_info', {}).get('timings')
             },
             'tracking': results.get('tracking', {}),
             'full_results': results
@@ -356,7 +461,8 @@ def real_process_video(video_path: str, job_id: str) -> dict:
             'frames_processed': results.get('num_frames_processed', 0),
             'device': DEVICE,
             'mock': False,
-            'calibration': results.get('calibration', {})
+            'calibration': results.get('calibration', {}),
+            'timings': results.get('processing_info', {}).get('timings')
         },
         'tracking': results.get('tracking', {}),
         'full_results': results
@@ -520,6 +626,210 @@ def poll_queue():
             time.sleep(5)  # Wait before retrying
 
 
+def _set_compute_threads(num_threads: int):
+    """Intra-op threads for torch and FAISS (OpenMP) in this process"""
+    import torch
+    torch.set_num_threads(num_threads)
+    try:
+        import faiss
+        faiss.omp_set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+def preload_shared_models(inference_server: bool = False):
+    """
+    Load the configured pipeline's models in the parent, to be shared copy-on-write by the forked
+    job processes. Models the inference server answers for are skipped. With DEVICE=cuda the GPUs stay hidden here
+    (CUDA must not be initialized before fork), so only the CPU-side models are shared.
+    """
+    # Building the RAG encodes the whole nutrition database (SentenceTransformer + FAISS). Run that
+    # single-threaded: OpenMP / tokenizer thread pools started before fork deadlock in the children
+    os.environ['OMP_NUM_THREADS'] = '1'
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    _set_compute_threads(1)
+    visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if DEVICE != 'cpu':
+        # NVML-based availability checks don't initialize CUDA; SentenceTransformer picks a visible GPU
+        os.environ['PYTORCH_NVML_BASED_CUDA_CHECK'] = '1'
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+    sys.path.insert(0, '/app')
+    from app.config import Settings
+    from app.models import ModelManager
+
+    # Same settings as process_media, so the job processes hit the same model cache keys
+    config = Settings()
+    config.DEVICE = DEVICE
+    config.GEMINI_API_KEY = GEMINI_API_KEY
+
+    print("Loading AI models in the parent process...")
+    start = time.time()
+    try:
+        model_manager = ModelManager(config)
+        names = model_manager.profile_models()
+        if inference_server:
+            names = [name for name in names if name != 'metric3d']
+        if DEVICE != 'cpu':
+            names = [name for name in names if name in ('rag', 'flan_t5')]
+        model_manager.preload_all(names)
+        # Not module.share_memory(): the weights are read-only, so fork already shares their pages, and
+        # /dev/shm (64 MB by default in Docker, not configurable on Fargate) could not hold them anyway
+        shared_mb = sum(m['footprint_mb'] for m in model_manager.residency()['models'] if m['device'] == 'cpu')
+    finally:
+        if DEVICE != 'cpu':
+            if visible_devices is None:
+                del os.environ['CUDA_VISIBLE_DEVICES']
+            else:
+                os.environ['CUDA_VISIBLE_DEVICES'] = visible_devices
+    print(f"✓ Models loaded in {time.time() - start:.1f}s ({shared_mb:.0f} MB of CPU weights shared with the job processes)")
+    sys.stdout.flush()
+
+
+def _job_process(index: int, torch_threads: int):
+    """Forked job process: own AWS clients and torch thread budget, then the normal poll loop"""
+    global s3, sqs, dynamodb
+    import signal
+
+    # The parent's SIGTERM handler is inherited by respawned children; the default one stops a job process
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # boto3 clients (and their connection pools) must not be shared across processes
+    s3 = boto3.client('s3')
+    sqs = boto3.client('sqs')
+    dynamodb = boto3.resource('dynamodb')
+    _set_compute_threads(torch_threads)
+    print(f"👷 Job process {index} (pid {os.getpid()}) started with {torch_threads} torch thread(s)")
+    sys.stdout.flush()
+    poll_queue()
+
+
+def _start_inference_server():
+    """
+    Spawn (not fork: it initializes CUDA) an inference server process for the job processes, which
+    find it through the INFERENCE_SERVER_* environment. Returns (process target, args, socket dir to clean up)
+    """
+    import secrets
+    from app.inference_server import serve
+
+    socket_dir = None
+    address = os.environ.get('INFERENCE_SERVER_ADDRESS')
+    if not address:
+        # Private directory (0700) for the socket
+        socket_dir = tempfile.mkdtemp(prefix='nutrition-inference-')
+        address = os.path.join(socket_dir, 'server.sock')
+    elif os.path.exists(address):
+        os.unlink(address)  # Stale socket: readiness is signalled by the server binding it
+    authkey = os.environ.get('INFERENCE_SERVER_AUTHKEY') or secrets.token_hex(32)
+    os.environ['INFERENCE_SERVER_ADDRESS'] = address
+    os.environ['INFERENCE_SERVER_AUTHKEY'] = authkey
+    return serve, (address, authkey.encode()), socket_dir
+
+
+def run_prefork(num_processes: int):
+    """
+    Pre-fork worker: load the models once, fork num_processes job processes that pull from the
+    queue, and restart any that die. Weights are shared copy-on-write, so RAM
+    grows by the per-job working set only, not by a model copy per process.
+    With WORKER_INFERENCE_SERVER the inference server is one more supervised (spawned) process.
+    """
+    import gc
+    import multiprocessing
+    import shutil
+    import signal
+
+    external_server = bool(os.environ.get('INFERENCE_SERVER_ADDRESS')) and not WORKER_INFERENCE_SERVER
+    if DEVICE != 'cpu' and not (WORKER_INFERENCE_SERVER or external_server):
+        print(f"⚠️  WORKER_PROCESSES={num_processes} with DEVICE={DEVICE} needs an inference server "
+              f"(WORKER_INFERENCE_SERVER=true or INFERENCE_SERVER_ADDRESS; CUDA does not survive fork) - running one process")
+        poll_queue()
+        return
+
+    fork_context = multiprocessing.get_context('fork')
+    targets = {}
+    socket_dir = None
+    if WORKER_INFERENCE_SERVER:
+        # Started first so it loads its models while this process loads the shared ones
+        server_target, server_args, socket_dir = _start_inference_server()
+        targets['inference-server'] = (multiprocessing.get_context('spawn'), server_target, server_args)
+
+    processes = {}
+    started_at = {}
+    # Restart backoff per slot: doubles while a process keeps dying soon after start
+    restart_delay = {}
+    restart_at = {}
+
+    def spawn(slot):
+        context, target, args = targets[slot]
+        name = slot if isinstance(slot, str) else f"job-{slot}"
+        process = context.Process(target=target, args=args, name=name)
+        process.start()
+        processes[slot] = process
+        started_at[slot] = time.time()
+
+    if 'inference-server' in targets:
+        spawn('inference-server')
+    preload_shared_models(inference_server=WORKER_INFERENCE_SERVER or external_server)
+    torch_threads = WORKER_TORCH_THREADS or max(1, (os.cpu_count() or 1) // num_processes)
+    # Move the loaded objects out of the cyclic GC's generations: collections in the children
+    # would otherwise write to their headers and copy the pages holding them
+    gc.collect()
+    gc.freeze()
+    for index in range(num_processes):
+        targets[index] = (fork_context, _job_process, (index, torch_threads))
+
+    if 'inference-server' in targets:
+        address = os.environ['INFERENCE_SERVER_ADDRESS']
+        print(f"Waiting for the inference server on {address}...")
+        while not os.path.exists(address):
+            if not processes['inference-server'].is_alive():
+                print(f"❌ Inference server exited with code {processes['inference-server'].exitcode}")
+                if socket_dir:
+                    shutil.rmtree(socket_dir, ignore_errors=True)
+                sys.exit(1)
+            time.sleep(1)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    print(f"Forking {num_processes} job processes ({torch_threads} torch thread(s) each)...")
+    for index in range(num_processes):
+        spawn(index)
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        while not stopping:
+            now = time.time()
+            for slot, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                if slot not in restart_at:
+                    if now - started_at[slot] < WORKER_RESTART_HEALTHY_SECONDS:
+                        restart_delay[slot] = min(2 * restart_delay.get(slot, 0.5), WORKER_RESTART_MAX_DELAY)
+                    else:
+                        restart_delay[slot] = 1.0
+                    restart_at[slot] = now + restart_delay[slot]
+                    label = "Inference server" if isinstance(slot, str) else f"Job process {slot}"
+                    print(f"⚠️  {label} exited with code {process.exitcode} - "
+                          f"restarting in {restart_delay[slot]:.0f}s")
+                elif now >= restart_at[slot]:
+                    del restart_at[slot]
+                    spawn(slot)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("\nShutting down job processes...")
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=30)
+        if socket_dir:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
 def download_models_from_s3():
     """Download AI model checkpoints from S3 if they don't exist locally."""
     if not S3_MODELS_BUCKET:
@@ -575,7 +885,15 @@ if __name__ == '__main__':
         print(f"Error: Missing required environment variables: {missing}")
         sys.exit(1)
 
+    # Structured logs (LOG_FORMAT=json|text), including the pipeline's per-stage timing records
+    sys.path.insert(0, '/app')
+    from app.timing import configure_logging
+    configure_logging(os.environ.get('LOG_LEVEL', 'INFO'), os.environ.get('LOG_FORMAT', 'json'))
+
     # Download models from S3 before starting
     download_models_from_s3()
 
-    poll_queue()
+    if WORKER_PROCESSES > 1:
+        run_prefork(WORKER_PROCESSES)
+    else:
+        poll_queue()
@@ -1,3 +1,4 @@
+import gzip
 import json
 import os
 import boto3
@@ -20,6 +21,31 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(obj)
 
 
+def read_json_object(key):
+    """Fetch a JSON object from the results bucket (gzip bodies are decompressed)."""
+    body = s3.get_object(Bucket=S3_RESULTS_BUCKET, Key=key)['Body'].read()
+    if body[:2] == b'\x1f\x8b':
+        body = gzip.decompress(body)
+    return json.loads(body.decode('utf-8'))
+
+
+def fetch_sections(summary, names):
+    """Fetch only the requested detail sections of a sectioned (v2) result."""
+    index = summary.get('sections') or {}
+    sections = {}
+    errors = {}
+    for name in names:
+        info = index.get(name)
+        if info is None:
+            errors[name] = 'unknown section'
+            continue
+        try:
+            sections[name] = read_json_object(info['key'])
+        except Exception as e:
+            errors[name] = str(e)
+    return sections, errors
+
+
 def lambda_handler(event, context):
     """Get job results from S3 and DynamoDB."""
 
@@ -69,6 +95,8 @@ def lambda_handler(event, context):
         # Get query parameters
         query_params = event.get('queryStringParameters') or {}
         detailed = query_params.get('detailed', 'false').lower() == 'true'
+        # ?sections=tracking,detections fetches only those detail sections
+        requested_sections = [name.strip() for name in (query_params.get('sections') or '').split(',') if name.strip()]
 
         # Build response with summary from DynamoDB
         result = {
@@ -92,16 +120,28 @@ def lambda_handler(event, context):
             result['items'] = job['items']
 
         # If detailed results requested, fetch from S3
-        if detailed:
+        if detailed or requested_sections:
             results_key = job.get('results_s3_key', f'results/{job_id}/results.json')
 
             try:
-                s3_response = s3.get_object(
-                    Bucket=S3_RESULTS_BUCKET,
-                    Key=results_key
-                )
-                detailed_results = json.loads(s3_response['Body'].read().decode('utf-8'))
-                result['detailed_results'] = detailed_results
+                stored = read_json_object(results_key)
+                if 'sections' in stored:
+                    # Sectioned (v2): compact summary + only the sections asked for
+                    result['available_sections'] = sorted(stored['sections'])
+                    names = requested_sections or sorted(stored['sections'])
+                    sections, errors = fetch_sections(stored, names)
+                    if errors:
+                        result['warning'] = f'Could not fetch sections: {errors}'
+                    if detailed:
+                        detailed_results = {k: v for k, v in stored.items() if k != 'sections'}
+                        detailed_results.update(sections)
+                        result['detailed_results'] = detailed_results
+                    else:
+                        result['summary'] = {k: v for k, v in stored.items() if k != 'sections'}
+                        result['sections'] = sections
+                else:
+                    # Legacy single results.json
+                    result['detailed_results'] = stored
             except s3.exceptions.NoSuchKey:
                 result['detailed_results'] = None
                 result['warning'] = 'Detailed results not found in S3'
@@ -160,7 +200,7 @@ def lambda_handler(event, context):
                             if len(parts) > 1:
                                 frame_match = parts[1].split('/')[0]
                         
-                        if 'overlays' in key and 'all_masks.png' in key:
+                        if 'overlays' in key and 'all_masks.' in key:
                             segmented_images['overlay_urls'].append({
                                 'frame': frame_match or '00000',
                                 'url': presigned_url,
@@ -175,6 +215,15 @@ def lambda_handler(event, context):
                                 'type': 'mask',
                                 'object_id': key.split('_obj_')[1].split('_')[0] if '_obj_' in key else None
                             })
+                        elif 'masks' in key and key.endswith('.npz'):
+                            # All masks of a frame bit-packed in one archive (decode with app.mask_codec)
+                            segmented_images['mask_urls'].append({
+                                'frame': frame_match or '00000',
+                                'url': presigned_url,
+                                'key': key,
+                                'type': 'mask_archive',
+                                'object_id': None
+                            })
                     except Exception as e:
                         print(f"Warning: Could not generate URL for {key}: {e}")
                         continue
@@ -7,6 +7,7 @@ This script provides easy access to the images and labels.
 
 from datasets import load_dataset
 from PIL import Image
+import json
 import os
 import shutil
 from pathlib import Path
@@ -110,31 +111,112 @@ def get_image_by_index(dataset, index):
     return image, label_idx, label_name
 
 
-def get_images_by_category(dataset, category_name):
+def _label_index_path(dataset):
     """
-    Get all images of a specific food category.
+    Location of the persisted label index: next to the dataset's Arrow files in the
+    Hugging Face cache (falls back to HF_DATASETS_CACHE for in-memory datasets).
+    """
+    cache_files = getattr(dataset, 'cache_files', None) or []
+    if cache_files:
+        cache_dir = Path(cache_files[0]['filename']).parent
+    else:
+        xdg_cache_home = os.getenv("XDG_CACHE_HOME", "~/.cache")
+        hf_home = os.path.expanduser(os.getenv("HF_HOME", os.path.join(xdg_cache_home, "huggingface")))
+        cache_dir = Path(os.getenv("HF_DATASETS_CACHE", os.path.join(hf_home, "datasets")))
+    split = str(getattr(dataset, 'split', None) or 'all')
+    return cache_dir / f"food101_{split}_label_index.json"
+
+
+def get_label_index(dataset, rebuild=False):
+    """
+    Map each label to the dataset indices that have it, without decoding any image.
+    
+    The labels are read straight from the Arrow 'label' column (one pass over a small int
+    column instead of one JPEG decode per row). The index is persisted next to the HF cache
+    and reused while the dataset fingerprint and length match.
+    
+    Args:
+        dataset: The dataset object
+        rebuild: Ignore a persisted index and rebuild it
+    
+    Returns:
+        dict: {label_index: [dataset indices in ascending order]}
+    """
+    index_path = _label_index_path(dataset)
+    fingerprint = getattr(dataset, '_fingerprint', None)
+    
+    if not rebuild and index_path.exists():
+        try:
+            with open(index_path) as f:
+                stored = json.load(f)
+            if stored.get('fingerprint') == fingerprint and stored.get('num_rows') == len(dataset):
+                return {int(label): indices for label, indices in stored['index'].items()}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠ Ignoring unreadable label index {index_path}: {e}")
+    
+    # Arrow column access: no image decoding
+    labels = dataset.data.column('label').to_pylist()
+    if getattr(dataset, '_indices', None) is not None:
+        # select()/shuffle() views: map through the indices mapping
+        mapping = dataset._indices.column(0).to_pylist()
+        labels = [labels[i] for i in mapping]
+    
+    index = {}
+    for i, label in enumerate(labels):
+        index.setdefault(label, []).append(i)
+    
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'num_rows': len(dataset), 'index': index}, f)
+        os.replace(tmp_path, index_path)
+        print(f"✓ Label index saved to: {index_path}")
+    except OSError as e:
+        print(f"⚠ Could not persist label index to {index_path}: {e}")
+    
+    return index
+
+
+def get_category_indices(dataset, category_name):
+    """
+    Get the dataset indices of a food category (no image decoding).
     
     Args:
         dataset: The dataset object
         category_name: Name of the food category (e.g., "pizza", "hamburger")
     
     Returns:
-        list: List of tuples (image, label_index, label_name)
+        list: Dataset indices in ascending order
     """
     label_names = dataset.features['label'].names
     
     if category_name not in label_names:
         raise ValueError(f"Category '{category_name}' not found. Available categories: {label_names[:10]}...")
     
-    category_idx = label_names.index(category_name)
+    return get_label_index(dataset).get(label_names.index(category_name), [])
+
+
+def get_images_by_category(dataset, category_name, max_images=None):
+    """
+    Get all images of a specific food category.
+    
+    Only the images of the category are decoded (indices come from the label index).
+    
+    Args:
+        dataset: The dataset object
+        category_name: Name of the food category (e.g., "pizza", "hamburger")
+        max_images: Optional cap on the number of images returned
     
-    # Filter images by category
-    images = []
-    for item in dataset:
-        if item['label'] == category_idx:
-            images.append((item['image'], item['label'], category_name))
+    Returns:
+        list: List of tuples (image, label_index, label_name)
+    """
+    indices = get_category_indices(dataset, category_name)
+    if max_images is not None:
+        indices = indices[:max_images]
     
-    return images
+    category_idx = dataset.features['label'].names.index(category_name)
+    return [(item['image'], category_idx, category_name) for item in dataset.select(indices)]
 
 
 def display_image_info(dataset, index):
@@ -190,10 +272,8 @@ def get_dataset_stats(dataset):
     """
     label_names = dataset.features['label'].names
     
-    # Count images per category
-    from collections import Counter
-    labels = [item['label'] for item in dataset]
-    label_counts = Counter(labels)
+    # Count images per category (from the label index, no image decoding)
+    label_counts = {label: len(indices) for label, indices in get_label_index(dataset).items()}
     
     stats = {
         'total_images': len(dataset),
@@ -4,28 +4,65 @@ Extract images from Food-101 dataset and save them to folders for easy browsing.
 This script will create a directory structure with images organized by food category.
 """
 
-from access_images import load_dataset_from_cache, get_image_by_index
+from access_images import load_dataset_from_cache, get_label_index
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datasets import Image as ImageFeature
+from PIL import Image
 from pathlib import Path
 import argparse
+import io
+import os
 from tqdm import tqdm
 
+JPEG_MAGIC = b'\xff\xd8\xff'
+
+
+def _write_image(dataset, img_idx, image_path):
+    """
+    Write one dataset image to image_path (atomic: temp file + rename).
+    
+    dataset must have its image column cast to decode=False: JPEG sources are written
+    byte-for-byte, anything else is decoded once and re-encoded as JPEG.
+    """
+    image = dataset[img_idx]['image']
+    data = image.get('bytes')
+    if data is None and image.get('path'):
+        with open(image['path'], 'rb') as f:
+            data = f.read()
+    
+    tmp_path = image_path.with_name(image_path.name + '.part')
+    if data[:3] == JPEG_MAGIC:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+    else:
+        Image.open(io.BytesIO(data)).convert('RGB').save(tmp_path, "JPEG", quality=95)
+    os.replace(tmp_path, image_path)
+
 
 def extract_images(
     output_dir="food101_images",
     split="train",
     num_images_per_category=10,
     categories=None,
-    start_index=0
+    start_index=0,
+    num_workers=None,
+    overwrite=False
 ):
     """
     Extract images from the dataset and save them to disk.
     
+    Indices per category come from the label index (no image decoding to find them),
+    files are written by a thread pool, and files already on disk are skipped so an
+    interrupted run can be resumed by re-running the same command.
+    
     Args:
         output_dir: Directory to save images
         split: Dataset split ("train" or "validation")
         num_images_per_category: Number of images to extract per category
         categories: List of category names to extract (None = all categories)
         start_index: Starting index for each category
+        num_workers: Writer threads (None = min(16, CPU count))
+        overwrite: Re-write files that already exist
     """
     print("=" * 60)
     print("Food-101 Image Extractor")
@@ -55,39 +92,44 @@ def extract_images(
     print(f"  Images per category: {num_images_per_category}")
     print(f"  Output directory: {output_path.resolve()}")
     
-    # Extract images
-    total_extracted = 0
-    
-    for category_name in tqdm(categories_to_extract, desc="Categories"):
+    # Select indices per category from the label index
+    label_index = get_label_index(dataset)
+    jobs = []
+    skipped = 0
+    for category_name in categories_to_extract:
         category_idx = label_names.index(category_name)
+        category_images = label_index.get(category_idx, [])
         
         # Create category directory
         category_dir = output_path / category_name
         category_dir.mkdir(exist_ok=True)
         
-        # Find images of this category
-        category_images = []
-        for i in range(len(dataset)):
-            if dataset[i]['label'] == category_idx:
-                category_images.append(i)
-        
-        # Extract specified number of images
-        images_to_extract = category_images[start_index:start_index + num_images_per_category]
-        
-        for img_idx in images_to_extract:
+        for img_idx in category_images[start_index:start_index + num_images_per_category]:
+            image_path = category_dir / f"{category_name}_{img_idx:06d}.jpg"
+            if not overwrite and image_path.exists() and image_path.stat().st_size > 0:
+                skipped += 1
+                continue
+            jobs.append((img_idx, image_path))
+    
+    if skipped:
+        print(f"  Resuming: {skipped} images already extracted")
+    
+    # Raw image bytes: JPEGs are copied without a decode / re-encode round trip
+    raw_dataset = dataset.cast_column('image', ImageFeature(decode=False))
+    num_workers = num_workers or min(16, os.cpu_count() or 1)
+    
+    # Extract images
+    total_extracted = 0
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(_write_image, raw_dataset, img_idx, image_path): img_idx for img_idx, image_path in jobs}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Images"):
             try:
-                image, label_idx, label_name = get_image_by_index(dataset, img_idx)
-                
-                # Save image
-                filename = f"{category_name}_{img_idx:06d}.jpg"
-                image_path = category_dir / filename
-                image.save(image_path, "JPEG", quality=95)
+                future.result()
                 total_extracted += 1
             except Exception as e:
-                print(f"\n⚠ Error extracting image {img_idx}: {e}")
-                continue
+                print(f"\n⚠ Error extracting image {futures[future]}: {e}")
     
-    print(f"\n✓ Extracted {total_extracted} images")
+    print(f"\n✓ Extracted {total_extracted} images ({skipped} already present)")
     print(f"  Saved to: {output_path.resolve()}")
     print(f"\nYou can now browse the images in: {output_path}")
     
@@ -167,6 +209,17 @@ if __name__ == "__main__":
         default=0,
         help="Starting index for each category (default: 0)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of writer threads (default: min(16, CPU count))"
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Re-extract images that already exist (default: skip them, i.e. resume)"
+    )
     
     args = parser.parse_args()
     
@@ -182,5 +235,7 @@ if __name__ == "__main__":
             split=args.split,
             num_images_per_category=args.num_images,
             categories=args.categories,
-            start_index=args.start_index
+            start_index=args.start_index,
+            num_workers=args.workers,
+            overwrite=args.overwrite
         )